@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 
-import argparse, bisect, json, os, subprocess, sys
-import os.path, re, urllib2
+import argparse, array, BaseHTTPServer, bisect, collections, copy, cPickle, fcntl
+import hashlib, heapq, httplib, itertools, json, multiprocessing, multiprocessing.pool
+import os, shutil, socket, SocketServer, subprocess, sys, tempfile, threading, time
+import os.path, re, urlparse
+
+# The ELF symbolizer lives with the other tools which use it.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+from include import elf_symbolizer
 
 gSpecialLibs = {
     # The [vectors] is a special section used for functions which can really
@@ -15,14 +21,58 @@ gSpecialLibs = {
     }
 }
 
-symbol_path_matcher = re.compile(r"^(.+) \[(.*)]$")
+# Directory holding the persistent symbol indexes, library tree indexes and
+# symbol caches. Can be changed with --cache-dir.
+gCacheDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         ".profile-symbolicate-cache")
+
+# The most symbols kept in the cache of any one library; the least recently
+# used ones are evicted beyond that. Set with --symbol-cache-size.
+gSymbolCacheSize = 1 << 18
+
+# Whether to run the toolchain's nm and addr2line rather than reading the
+# libraries ourselves. Set with --use-toolchain.
+gUseToolchain = False
+
+# Whether to name the functions inlined at each address as well as the one
+# they were inlined into. Set with --inlines.
+gInlines = False
+
+# Whether to use the symbols of another build of a library when --symbols-path
+# has none for the library's own breakpad ID, but has them for exactly one
+# other build. Set with --allow-mismatched-symbols.
+gAllowMismatchedSymbols = False
 
 def fixupAddress(lib, address):
-  lib_address = int(address, 0) - lib.start + lib.offset
+  lib_address = address - lib.start + lib.offset
   return (lib_address & ~1) - 1
 
-def formatAddress(address):
-  return "0x{:X}".format(address)
+def SortedUnique(values):
+  """Returns the distinct values as a sorted array."""
+  return array.array("L", [value for (value, _) in itertools.groupby(sorted(values))])
+
+class AddressSet:
+  """Collects addresses in a compact array. Every so often the array is
+  sorted and deduplicated, so it never holds many more entries than there
+  are distinct addresses, however often each one is added."""
+  def __init__(self):
+    self.addresses = array.array("L")
+    self.compact_size = 1 << 16
+
+  def update(self, addresses):
+    addresses = iter(addresses)
+    while True:
+      space = self.compact_size - len(self.addresses)
+      self.addresses.extend(itertools.islice(addresses, space))
+      if len(self.addresses) < self.compact_size:
+        return
+      self.addresses = SortedUnique(self.addresses)
+      self.compact_size = max(1 << 16, 2 * len(self.addresses))
+
+  def SortedUnique(self):
+    """Returns the distinct addresses added so far as a sorted array."""
+    self.addresses = SortedUnique(self.addresses)
+    return self.addresses
 
 def get_tools_prefix():
   if "GECKO_TOOLS_PREFIX" in os.environ:
@@ -33,14 +83,715 @@ def get_tools_prefix():
 
   return None
 
+###############################################################################
+#
+# SymbolIndex class. Holds the sorted function start addresses and names of
+# one build of a library, and is stored on disk keyed by the library's
+# breakpad ID so that it only has to be built once. We only build one for a
+# library without debug information, whose symbol table is all we have to go
+# on; addr2line names the functions in other libraries better.
+#
+###############################################################################
+
+class SymbolIndex:
+  VERSION = 2
+
+  def __init__(self, addresses, sizes, names):
+    """addresses and sizes are array('L')s sorted by address, names a list"""
+    self.addresses = addresses
+    self.sizes = sizes
+    self.names = names
+
+  @staticmethod
+  def Filename(breakpad_id):
+    return os.path.join(gCacheDir, "index", breakpad_id + ".idx")
+
+  @staticmethod
+  def Load(breakpad_id):
+    """Returns the stored index for breakpad_id, or None if there isn't one."""
+    try:
+      with open(SymbolIndex.Filename(breakpad_id), "rb") as f:
+        data = cPickle.load(f)
+    except (EOFError, IOError, ValueError, cPickle.PickleError):
+      return None
+    if data.get("version") != SymbolIndex.VERSION:
+      return None
+    addresses = array.array("L")
+    addresses.fromstring(data["addresses"])
+    sizes = array.array("L")
+    sizes.fromstring(data["sizes"])
+    return SymbolIndex(addresses, sizes, data["names"].split("\n"))
+
+  def Save(self, breakpad_id):
+    """Writes the index out atomically, so concurrent runs never see a
+    partially written file."""
+    filename = SymbolIndex.Filename(breakpad_id)
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+      try:
+        os.makedirs(dirname)
+      except OSError:
+        pass
+    data = {"version": SymbolIndex.VERSION,
+            "addresses": self.addresses.tostring(),
+            "sizes": self.sizes.tostring(),
+            "names": "\n".join(self.names)}
+    try:
+      fd, tmp_name = tempfile.mkstemp(dir=dirname)
+      with os.fdopen(fd, "wb") as f:
+        cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_name, filename)
+    except (IOError, OSError):
+      pass
+
+  @staticmethod
+  def Build(host_name):
+    """Builds an index from the function symbols in host_name. Falls back
+    to the dynamic symbols for stripped libraries."""
+    if not gUseToolchain:
+      try:
+        symbolizer = elf_symbolizer.ElfSymbolizer.get(host_name)
+        return SymbolIndex(*symbolizer.symbols())
+      except elf_symbolizer.ElfError:
+        pass
+    return SymbolIndex.BuildWithNm(host_name)
+
+  @staticmethod
+  def BuildWithNm(host_name):
+    """Builds an index from the function symbols nm finds in host_name."""
+    target_tools_prefix = get_tools_prefix()
+    if target_tools_prefix is None:
+      target_tools_prefix = "arm-eabi-"
+    nm = target_tools_prefix + "nm"
+    symbols = {}
+    for extra_args in ([], ["-D"]):
+      args = [nm, "-C", "-S", "--defined-only"] + extra_args + [host_name]
+      try:
+        output = subprocess.check_output(args, stderr=open(os.devnull, "w"))
+      except (OSError, subprocess.CalledProcessError):
+        continue
+      for line in output.split("\n"):
+        # Lines look like "00001234 00000040 T name" or, for symbols without
+        # a size, "00001234 T name". Demangled names may contain spaces.
+        fields = line.split(None, 2)
+        if len(fields) < 3:
+          continue
+        if len(fields[1]) == 1:
+          size = 0
+          sym_type, name = fields[1], fields[2]
+        else:
+          fields = line.split(None, 3)
+          if len(fields) < 4:
+            continue
+          size = int(fields[1], 16)
+          sym_type, name = fields[2], fields[3]
+        if sym_type not in "tTwW":
+          continue
+        # Thumb functions have the low bit set.
+        address = int(fields[0], 16) & ~1
+        # Several names can alias one address; keep the first one nm gives us.
+        if address not in symbols:
+          symbols[address] = (size, name)
+      if symbols:
+        break
+    addresses = array.array("L", sorted(symbols.keys()))
+    sizes = array.array("L", [symbols[address][0] for address in addresses])
+    names = [symbols[address][1] for address in addresses]
+    return SymbolIndex(addresses, sizes, names)
+
+  def __len__(self):
+    return len(self.addresses)
+
+  def Lookup(self, lib_address):
+    """Returns the name of the function containing lib_address, or "??"."""
+    i = bisect.bisect(self.addresses, lib_address) - 1
+    if i < 0:
+      return "??"
+    size = self.sizes[i]
+    if size and lib_address >= self.addresses[i] + size:
+      return "??"
+    return self.names[i]
+
+###############################################################################
+#
+# BreakpadSymbols class. Holds the FUNC, PUBLIC and line records of a
+# breakpad .sym file in sorted arrays, so that a whole batch of addresses can
+# be looked up without going back to the file.
+#
+###############################################################################
+
+class BreakpadSymbols:
+  # Symbol files which have been read already, keyed by path.
+  loaded = {}
+
+  # The (libname, breakpad_id)s we have warned about having no symbols for.
+  mismatched = set()
+
+  def __init__(self, filename):
+    self.func_addresses = array.array("L")
+    self.func_sizes = array.array("L")
+    self.func_names = []
+    self.public_addresses = array.array("L")
+    self.public_names = []
+    self.line_addresses = array.array("L")
+    self.line_sizes = array.array("L")
+    self.line_numbers = array.array("L")
+    self.line_files = array.array("L")
+    self.files = {}
+    # The breakpad ID of the build the symbols are for.
+    self.breakpad_id = os.path.basename(os.path.dirname(filename))
+    self.Read(filename)
+
+  @staticmethod
+  def Filename(symbols_path, libname, breakpad_id):
+    """Returns the path of the .sym file for the given library. If
+    breakpad_id isn't among the builds we have symbols for, and there is only
+    one, we say so on stderr, and use that one's symbols with
+    --allow-mismatched-symbols."""
+    lib_dir = os.path.join(symbols_path, libname)
+    filename = os.path.join(lib_dir, breakpad_id, libname + ".sym")
+    if os.path.isfile(filename):
+      return filename
+    try:
+      ids = os.listdir(lib_dir)
+    except OSError:
+      return None
+    if len(ids) != 1:
+      return None
+    filename = os.path.join(lib_dir, ids[0], libname + ".sym")
+    if not os.path.isfile(filename):
+      return None
+    if (libname, breakpad_id) not in BreakpadSymbols.mismatched:
+      BreakpadSymbols.mismatched.add((libname, breakpad_id))
+      if gAllowMismatchedSymbols:
+        print >>sys.stderr, "Warning: no symbols for build " + breakpad_id + " of '" + libname + "'; using those of build " + ids[0]
+      else:
+        print >>sys.stderr, "No symbols for build " + breakpad_id + " of '" + libname + "', only for build " + ids[0] + "; pass --allow-mismatched-symbols to use them"
+    if gAllowMismatchedSymbols:
+      return filename
+    return None
+
+  @staticmethod
+  def Get(symbols_path, libname, breakpad_id):
+    """Returns the symbols for the given library, or None if there is no
+    symbol file for it under symbols_path."""
+    filename = BreakpadSymbols.Filename(symbols_path, libname, breakpad_id)
+    if filename is None:
+      return None
+    if filename not in BreakpadSymbols.loaded:
+      BreakpadSymbols.loaded[filename] = BreakpadSymbols(filename)
+    return BreakpadSymbols.loaded[filename]
+
+  def Read(self, filename):
+    funcs = []
+    publics = []
+    lines = []
+    with open(filename, "r") as f:
+      for line in f:
+        # Most of the file is line records, which start with a (lower case)
+        # hex address: "address size line filenum".
+        first = line[0]
+        if first in "0123456789abcdef":
+          fields = line.split()
+          if len(fields) == 4:
+            lines.append((int(fields[0], 16), int(fields[1], 16),
+                          int(fields[2]), int(fields[3])))
+        elif first == "F":
+          if line.startswith("FUNC "):
+            # FUNC [m] address size parameter_size name
+            rest = line[5:].rstrip("\r\n")
+            if rest.startswith("m "):
+              rest = rest[2:]
+            fields = rest.split(" ", 3)
+            if len(fields) == 4:
+              funcs.append((int(fields[0], 16), int(fields[1], 16), fields[3]))
+          elif line.startswith("FILE "):
+            fields = line.rstrip("\r\n").split(" ", 2)
+            if len(fields) == 3:
+              self.files[int(fields[1])] = fields[2]
+        elif first == "P" and line.startswith("PUBLIC "):
+          # PUBLIC [m] address parameter_size name
+          rest = line[7:].rstrip("\r\n")
+          if rest.startswith("m "):
+            rest = rest[2:]
+          fields = rest.split(" ", 2)
+          if len(fields) == 3:
+            publics.append((int(fields[0], 16), fields[2]))
+        # MODULE, INFO and STACK records aren't of any use to us.
+    funcs.sort()
+    for (address, size, name) in funcs:
+      self.func_addresses.append(address)
+      self.func_sizes.append(size)
+      self.func_names.append(name)
+    publics.sort()
+    for (address, name) in publics:
+      self.public_addresses.append(address)
+      self.public_names.append(name)
+    lines.sort()
+    for (address, size, number, file) in lines:
+      self.line_addresses.append(address)
+      self.line_sizes.append(size)
+      self.line_numbers.append(number)
+      self.line_files.append(file)
+
+  def Lookup(self, lib_addresses):
+    """Returns the symbol for each address, formatted as "function" or
+    "function @ file:line", or None for addresses we know nothing about.
+
+    The addresses are visited in sorted order, so each search only has to
+    look at the part of the tables past the previous answer.
+    """
+    results = [None] * len(lib_addresses)
+    order = sorted(range(len(lib_addresses)), key=lambda i: lib_addresses[i])
+    func_lo = public_lo = line_lo = 0
+    for i in order:
+      address = lib_addresses[i]
+      func_lo = max(0, bisect.bisect(self.func_addresses, address, func_lo) - 1)
+      public_lo = max(0, bisect.bisect(self.public_addresses, address, public_lo) - 1)
+      line_lo = max(0, bisect.bisect(self.line_addresses, address, line_lo) - 1)
+      if self.func_addresses and \
+         self.func_addresses[func_lo] <= address < self.func_addresses[func_lo] + self.func_sizes[func_lo]:
+        symbol = self.func_names[func_lo]
+        if self.line_addresses and \
+           self.line_addresses[line_lo] <= address < self.line_addresses[line_lo] + self.line_sizes[line_lo]:
+          source_file = os.path.basename(self.files.get(self.line_files[line_lo], "??"))
+          symbol += " @ %s:%d" % (source_file, self.line_numbers[line_lo])
+        results[i] = symbol
+      elif self.public_addresses and self.public_addresses[public_lo] <= address:
+        # A PUBLIC symbol covers everything up to the next symbol, so it
+        # doesn't cover us if a FUNC starts between it and us.
+        if not self.func_addresses or \
+           not (self.public_addresses[public_lo] < self.func_addresses[func_lo] <= address):
+          results[i] = self.public_names[public_lo]
+    return results
+
+###############################################################################
+#
+# Addr2line class. A long-lived addr2line process per library, which we
+# stream addresses through rather than starting a new one for every batch.
+#
+###############################################################################
+
+class Addr2line:
+  # Running processes, keyed by host library name.
+  procs = {}
+
+  # How many addresses we write before reading the results back. This keeps
+  # our input well inside the pipe buffer, so addr2line never blocks on a
+  # full stdout while we are still writing to its stdin.
+  BATCH_SIZE = 1024
+
+  def __init__(self, host_name, inlines=False):
+    target_tools_prefix = get_tools_prefix()
+    if target_tools_prefix is None:
+      target_tools_prefix = "arm-eabi-"
+    args = [target_tools_prefix + "addr2line", "-C", "-f"]
+    if inlines:
+      args += ["-i", "-a"]
+    self.proc = subprocess.Popen(args + ["-e", host_name], stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE)
+
+  @staticmethod
+  def Get(host_name, inlines=False):
+    """Returns the addr2line process for host_name, starting it if needed.
+    Processes for LookupInlines need inlines=True."""
+    key = (host_name, inlines)
+    if key not in Addr2line.procs:
+      Addr2line.procs[key] = Addr2line(host_name, inlines)
+    return Addr2line.procs[key]
+
+  @staticmethod
+  def CloseAll():
+    for addr2line in Addr2line.procs.values():
+      addr2line.Close()
+    Addr2line.procs = {}
+
+  def Close(self):
+    try:
+      self.proc.stdin.close()
+      self.proc.wait()
+    except (IOError, OSError):
+      pass
+
+  def Lookup(self, lib_addresses):
+    """Returns a (function, file:line) tuple for each address."""
+    # addr2line answers each address with 2 lines, and flushes its output
+    # after every address when reading from a pipe. The output will be
+    # something like the following:
+    #   PR_IntervalNow
+    #   /home/work/B2G-profiler/mozilla-inbound/nsprpub/pr/src/misc/prinrval.c:43
+    #   PR_Unlock
+    #   /home/work/B2G-profiler/mozilla-inbound/nsprpub/pr/src/pthreads/ptsynch.c:191
+    results = []
+    for i in range(0, len(lib_addresses), Addr2line.BATCH_SIZE):
+      batch = lib_addresses[i:i + Addr2line.BATCH_SIZE]
+      self.proc.stdin.write("".join(["0x%08x\n" % address for address in batch]))
+      self.proc.stdin.flush()
+      for address in batch:
+        sym = self.proc.stdout.readline().rstrip("\n")
+        line = self.proc.stdout.readline().rstrip("\n")
+        results.append((sym, line))
+    return results
+
+  def LookupInlines(self, lib_addresses):
+    """Returns a list of (function, file:line) tuples for each address, from
+    the innermost function inlined there out to the one it was inlined
+    into."""
+    # With -i, addr2line answers each address with as many pairs of lines as
+    # there are functions inlined there, so we have it print each address
+    # (-a) before its answer, and end each batch with an address which can't
+    # hold code to know when the last answer is complete:
+    #   0x00001234
+    #   nsTArray_Impl<...>::Length() const
+    #   /home/work/B2G/objdir-gecko/dist/include/nsTArray.h:378
+    #   nsThread::ProcessNextEvent(bool, bool*)
+    #   /home/work/B2G/gecko/xpcom/threads/nsThread.cpp:706
+    results = []
+    for i in range(0, len(lib_addresses), Addr2line.BATCH_SIZE):
+      batch = lib_addresses[i:i + Addr2line.BATCH_SIZE]
+      self.proc.stdin.write("".join(["0x%08x\n" % address for address in batch]) + "0x0\n")
+      self.proc.stdin.flush()
+      frames = None
+      while True:
+        line = self.proc.stdout.readline()
+        if not line:
+          raise IOError("addr2line exited")
+        if line.startswith("0x"):
+          if frames is not None:
+            results.append(frames)
+          if len(results) == i + len(batch):
+            break
+          frames = []
+          continue
+        frames.append((line.rstrip("\n"), self.proc.stdout.readline().rstrip("\n")))
+      # Skip the answer for the end of batch address.
+      self.proc.stdout.readline()
+      self.proc.stdout.readline()
+    return results
+
+###############################################################################
+#
+# LibraryTree class. Maps the basenames of the files in a directory tree to
+# their paths. The map is built with a single walk of the tree and kept on
+# disk along with the mtime of every directory in the tree, so that later
+# runs only need to stat the directories to know the map is still valid.
+#
+###############################################################################
+
+class LibraryTree:
+  VERSION = 1
+
+  # Trees which have been loaded already, keyed by (root, exclude_dir), so
+  # that all of the libraries share them.
+  trees = {}
+
+  def __init__(self, root, exclude_dir=None):
+    self.root = root
+    self.exclude_dir = exclude_dir
+    self.dirs = {}
+    self.files = {}
+    if not self.Load():
+      self.Walk()
+      self.Save()
+
+  @staticmethod
+  def Get(root, exclude_dir=None):
+    """Returns the shared index of the tree rooted at root."""
+    key = (root, exclude_dir)
+    if key not in LibraryTree.trees:
+      LibraryTree.trees[key] = LibraryTree(root, exclude_dir)
+    return LibraryTree.trees[key]
+
+  def Filename(self):
+    key = "%s\0%s" % (os.path.abspath(self.root), self.exclude_dir)
+    return os.path.join(gCacheDir, "trees", hashlib.sha1(key).hexdigest())
+
+  def Load(self):
+    try:
+      with open(self.Filename(), "rb") as f:
+        data = cPickle.load(f)
+    except (EOFError, IOError, ValueError, cPickle.PickleError):
+      return False
+    if data.get("version") != LibraryTree.VERSION:
+      return False
+    # A file can only have been added, removed or renamed if the mtime of
+    # the directory holding it changed.
+    for (dir, mtime) in data["dirs"].iteritems():
+      try:
+        if os.stat(dir).st_mtime != mtime:
+          return False
+      except OSError:
+        return False
+    self.dirs = data["dirs"]
+    self.files = data["files"]
+    return True
+
+  def Save(self):
+    filename = self.Filename()
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+      try:
+        os.makedirs(dirname)
+      except OSError:
+        pass
+    data = {"version": LibraryTree.VERSION,
+            "dirs": self.dirs,
+            "files": self.files}
+    try:
+      fd, tmp_name = tempfile.mkstemp(dir=dirname)
+      with os.fdopen(fd, "wb") as f:
+        cPickle.dump(data, f, cPickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_name, filename)
+    except (IOError, OSError):
+      pass
+
+  def Walk(self):
+    for (dir, subdirs, files) in os.walk(self.root):
+      try:
+        self.dirs[dir] = os.stat(dir).st_mtime
+      except OSError:
+        continue
+      if self.exclude_dir in subdirs:
+        subdirs.remove(self.exclude_dir)
+      # Walk in a fixed order so that we always pick the same copy of a
+      # library that appears more than once.
+      subdirs.sort()
+      for basename in sorted(files):
+        # Only shared libraries and executables can show up in a profile.
+        if ".so" in basename or "." not in basename:
+          self.files.setdefault(basename, []).append(os.path.join(dir, basename))
+
+  def Find(self, basename):
+    """Returns the path of the first regular file named basename, or None."""
+    for path in self.files.get(basename, []):
+      if os.path.isfile(path) and not os.path.islink(path):
+        return path
+    return None
+
+###############################################################################
+#
+# SymbolCache class. Remembers the symbols found for the addresses of one
+# build of a library between runs. Each kind of lookup has its own cache,
+# since they don't all produce the same symbols, and so does each name the
+# library goes by, since the symbols end with "(in <name>)".
+#
+###############################################################################
+
+class SymbolCache:
+  VERSION = 3
+
+  # How stale, in seconds, the record of when a cached symbol was last used
+  # may get before a run which only reads the cache rewrites it.
+  TOUCH_INTERVAL = 3600
+
+  def __init__(self, kind, breakpad_id, lib_name):
+    """Without a breakpad_id there is nothing to key the cache on, so it
+    stays empty, as it does when --symbol-cache-size is 0."""
+    if breakpad_id and gSymbolCacheSize > 0:
+      if isinstance(lib_name, unicode):
+        lib_name = lib_name.encode("utf-8")
+      self.filename = os.path.join(gCacheDir, "symbols", kind, breakpad_id + "-" +
+                                   hashlib.sha1(lib_name).hexdigest()[:16])
+    else:
+      self.filename = None
+    self.entries = None
+    self.used = None
+    self.added = {}
+    self.touched = set()
+
+  def Read(self):
+    """Returns the cached symbols and the time each was last used, both
+    keyed by address."""
+    try:
+      with open(self.filename, "rb") as f:
+        data = cPickle.load(f)
+    except (EOFError, IOError, ValueError, cPickle.PickleError):
+      return ({}, {})
+    if data.get("version") != SymbolCache.VERSION:
+      return ({}, {})
+    return (data["entries"], data["used"])
+
+  def Get(self, adj_address):
+    """Returns the cached symbol for adj_address, or None."""
+    if not self.filename:
+      return None
+    if self.entries is None:
+      (self.entries, self.used) = self.Read()
+    sym = self.entries.get(adj_address)
+    if sym is not None:
+      self.touched.add(adj_address)
+    return sym
+
+  def Put(self, adj_address, sym):
+    if self.filename:
+      self.added[adj_address] = sym
+
+  def Flush(self):
+    """Merges the symbols we've added into the file on disk, and notes which
+    ones we've used, evicting the least recently used symbols beyond
+    gSymbolCacheSize. Concurrent runs are serialized by a lock file, so none
+    of their additions get lost."""
+    now = int(time.time())
+    if not self.added:
+      stale = [address for address in self.touched
+               if self.used.get(address, 0) + SymbolCache.TOUCH_INTERVAL < now]
+      if not stale:
+        self.touched = set()
+        return
+    dirname = os.path.dirname(self.filename)
+    try:
+      if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+      with open(self.filename + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        (entries, used) = self.Read()
+        entries.update(self.added)
+        for address in itertools.chain(self.added, self.touched):
+          if address in entries:
+            used[address] = now
+        if len(entries) > gSymbolCacheSize:
+          for address in heapq.nsmallest(len(entries) - gSymbolCacheSize, entries,
+                                         key=lambda address: used.get(address, 0)):
+            del entries[address]
+            used.pop(address, None)
+        fd, tmp_name = tempfile.mkstemp(dir=dirname)
+        with os.fdopen(fd, "wb") as f:
+          cPickle.dump({"version": SymbolCache.VERSION, "entries": entries,
+                        "used": used}, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_name, self.filename)
+    except (IOError, OSError):
+      return
+    self.entries = entries
+    self.used = used
+    self.added = {}
+    self.touched = set()
+
+###############################################################################
+#
+# SymbolapiClient class. Sends symbolication requests to a symbolapi server
+# in chunks, over a pool of keep-alive connections. httplib can't pipeline
+# requests on one connection, so we keep several in flight on separate
+# connections instead.
+#
+###############################################################################
+
+class SymbolapiClient:
+  def __init__(self, url, jobs=4, chunk_size=2048, retries=3, timeout=120):
+    self.url = url
+    parts = urlparse.urlsplit(url)
+    self.scheme = parts.scheme
+    self.netloc = parts.netloc
+    self.path = parts.path or "/"
+    if parts.query:
+      self.path += "?" + parts.query
+    self.jobs = max(1, jobs)
+    self.chunk_size = max(1, chunk_size)
+    self.retries = retries
+    self.timeout = timeout
+    self.connections = []
+    self.lock = threading.Lock()
+
+  def GetConnection(self):
+    with self.lock:
+      if self.connections:
+        return self.connections.pop()
+    if self.scheme == "https":
+      return httplib.HTTPSConnection(self.netloc, timeout=self.timeout)
+    return httplib.HTTPConnection(self.netloc, timeout=self.timeout)
+
+  def ReleaseConnection(self, connection):
+    with self.lock:
+      self.connections.append(connection)
+
+  def Close(self):
+    with self.lock:
+      for connection in self.connections:
+        connection.close()
+      self.connections = []
+
+  def Post(self, memory_map, stack):
+    """Symbolicates one chunk of (memory_map index, address) frames, retrying
+    on connection errors and server errors."""
+    request_data = json.dumps({
+      "stacks": [stack],
+      "memoryMap": memory_map,
+      "version": 3,
+      "symbolSources": ["B2G", "Firefox"]
+    })
+    headers = {
+      "Content-Type": "application/json",
+      "Content-Length": str(len(request_data)),
+      "Connection": "keep-alive"
+    }
+    error = None
+    for attempt in range(self.retries):
+      connection = self.GetConnection()
+      try:
+        connection.request("POST", self.path, request_data, headers)
+        response = connection.getresponse()
+        content = response.read()
+      except (httplib.HTTPException, socket.error) as e:
+        connection.close()
+        error = e
+        continue
+      if response.will_close:
+        connection.close()
+      else:
+        self.ReleaseConnection(connection)
+      if response.status >= 500:
+        error = "server returned " + str(response.status)
+        continue
+      if response.status != 200:
+        raise Exception("Bad request: " + str(response.status))
+      syms = json.loads(content)[0]
+      if len(syms) != len(stack):
+        raise Exception("Bad response: got %d symbols for %d addresses" % (len(syms), len(stack)))
+      return syms
+    raise Exception("Symbolication request to %s failed: %s" % (self.url, error))
+
+  def Symbolicate(self, memory_map, frames):
+    """Returns the symbol for each (memory_map index, address) frame."""
+    chunks = [frames[i:i + self.chunk_size]
+              for i in range(0, len(frames), self.chunk_size)]
+    post = lambda chunk: self.Post(memory_map, chunk)
+    try:
+      if self.jobs > 1 and len(chunks) > 1:
+        pool = multiprocessing.pool.ThreadPool(min(self.jobs, len(chunks)))
+        try:
+          results = pool.map(post, chunks)
+        finally:
+          pool.close()
+          pool.join()
+      else:
+        results = map(post, chunks)
+    finally:
+      self.Close()
+    return list(itertools.chain(*results))
+
+  @staticmethod
+  def IsUnresolved(sym):
+    """Whether sym is the placeholder a server, or our own lookups, give for
+    an address they couldn't symbolicate: the address itself in hex,
+    "Unknown" or "??", possibly followed by the library's name."""
+    (function, sep, lib) = sym.rpartition(" (in ")
+    if not sep:
+      function = sym
+    return function in ("", "??", "Unknown") or function[:2] == "0x"
+
 ###############################################################################
 #
 # Library class. There is an instance of this for each library in the profile.
 #
 ###############################################################################
 
+class LocateError(Exception):
+  """Raised by Library.Locate when a build tree it has to search for the
+  library doesn't exist."""
+  pass
+
 class Library:
-  def __init__(self, lib_dict, verbose=False, symbols_path=None):
+  def __init__(self, lib_dict, verbose=False, symbols_path=None,
+               use_symbol_index=True):
     """lib_dict will be the JSON dictionary from the profile"""
     self.start = lib_dict["start"]
     self.end = lib_dict["end"]
@@ -50,67 +801,119 @@ class Library:
     self.verbose = verbose
     self.host_name = None
     self.located = False
-    self.symbols = {}
+    # The sorted, distinct addresses found in the profile for this library,
+    # and the symbol for each once they have been resolved.
+    self.addresses = array.array("L")
+    self.symbols = []
     self.symbol_table = None
     self.symbol_table_addresses = None
     self.symbols_path = symbols_path
+    # The SymbolCacheKind of the lookup which found the last symbols we
+    # looked up, or None if they shouldn't be cached.
+    self.lookup_kind = None
+    # Symbol indexes only know the functions inlined code ended up in.
+    self.use_symbol_index = use_symbol_index and not symbols_path and not gInlines
+    self.symbol_index = None
+    # The SymbolCaches we have read, keyed by kind.
+    self.symbol_caches = {}
 
-  def AddressToSymbol(self, address_str):
+  def __getstate__(self):
+    """Leaves out the symbol index and symbol caches we have loaded when the
+    library is sent to a worker process for --jobs. The worker reads them
+    from their files again, which is far cheaper than pickling them."""
+    state = self.__dict__.copy()
+    state["symbol_index"] = None
+    state["symbol_caches"] = {}
+    state["had_symbol_index"] = self.symbol_index is not None
+    return state
+
+  def __setstate__(self, state):
+    had_symbol_index = state.pop("had_symbol_index")
+    self.__dict__.update(state)
+    if had_symbol_index:
+      self.LoadSymbolIndex()
+
+  def AddressToSymbol(self, address):
     """Attempts to convert an address into a symbol."""
-    return self.AddressesToSymbols([address_str])[0]
+    return self.AddressesToSymbols([address])[0]
 
-  def AddressesToSymbols(self, addresses_strs):
+  def AddressesToSymbols(self, addresses):
     """Converts multiple addresses into symbols."""
     if not self.located:
       self.Locate()
     if self.symbol_table:
-      return self.LookupAddressesInSymbolTable(addresses_strs)
+      self.lookup_kind = None
+      return self.LookupAddressesInSymbolTable(addresses)
+    adj_addresses = []
+    for address in addresses:
+      if self.verbose:
+        lib_address = address - self.start + self.offset
+        print "Address 0x%08x maps to library '%s' offset 0x%08x" % (address, self.host_name, lib_address)
+      # Fix up addresses from stack frames; they're for the insn after
+      # the call, which might be a different function thanks to inlining:
+      adj_addresses.append(max(0, fixupAddress(self, address)))
+    return self.LibAddressesToSymbols(adj_addresses)
+
+  def LibAddressesToSymbols(self, adj_addresses):
+    """Converts multiple addresses into symbols. The addresses must already
+    be relative to the library and fixed up (see fixupAddress)."""
+    if not self.located:
+      self.Locate()
+    # The symbol index is kept on disk already, so there is no need to cache
+    # the symbols we look up in it.
+    if self.symbol_index:
+      self.lookup_kind = None
+      return self.LookupAddressesInSymbolIndex(adj_addresses)
     if not self.host_name:
+      self.lookup_kind = None
       unknown = "Unknown (in " + self.target_name + ")"
-      return [unknown for i in range(len(addresses_strs))]
-    syms = self.LookupAddressesInBreakpad(addresses_strs)
+      return [unknown for i in range(len(adj_addresses))]
+    syms = self.LookupAddressesInBreakpad(adj_addresses)
     if syms is not None:
       return syms
-    target_tools_prefix = get_tools_prefix()
-    if target_tools_prefix is None:
-      target_tools_prefix = "arm-eabi-"
-    args = [target_tools_prefix + "addr2line", "-C", "-f", "-e", self.host_name]
-    nm_args = ["gecko/tools/profiler/nm-symbolicate.py", self.host_name]
-    for address_str in addresses_strs:
-      lib_address = int(address_str, 0) - self.start + self.offset
-      if self.verbose:
-        print "Address %s maps to library '%s' offset 0x%08x" % (address_str, self.host_name, lib_address)
-      # Fix up addresses from stack frames; they're for the insn after
-      # the call, which might be a different function thanks to inlining:
-      adj_address = max(0, (lib_address & ~1) - 1)
-      args.append("0x%08x" % adj_address)
-      nm_args.append("0x%08x" % adj_address)
-    # Calling addr2line will return 2 lines for each address. The output will be something
-    # like the following:
-    #   PR_IntervalNow
-    #   /home/work/B2G-profiler/mozilla-inbound/nsprpub/pr/src/misc/prinrval.c:43
-    #   PR_Unlock
-    #   /home/work/B2G-profiler/mozilla-inbound/nsprpub/pr/src/pthreads/ptsynch.c:191
-    syms_and_lines = subprocess.check_output(args).split("\n")
+    if not self.HasDebugInfo() and self.BuildSymbolIndex():
+      self.lookup_kind = None
+      return self.LookupAddressesInSymbolIndex(adj_addresses)
+    if not gUseToolchain:
+      syms = self.LookupAddressesInElf(adj_addresses)
+      if syms is not None:
+        self.lookup_kind = "elf-inlines" if gInlines else "elf"
+        return syms
+    if gInlines:
+      self.lookup_kind = "addr2line-inlines"
+      syms = []
+      for frames in Addr2line.Get(self.host_name, inlines=True).LookupInlines(adj_addresses):
+        syms.append(self.FormatInlines([sym for (sym, line) in frames]))
+      return syms
+    syms_and_lines = Addr2line.Get(self.host_name).Lookup(adj_addresses)
+    self.lookup_kind = "addr2line"
 
     # Check if we had no useful output from addr2line. If so well try using the symbol table
     # from nm.
     has_good_line = False
-    for line in syms_and_lines:
-      if line != "??" and line != "??:0" and line != "":
+    for (sym, line) in syms_and_lines:
+      if sym != "??" or line != "??:0":
         has_good_line = True
+        break
     if has_good_line == False:
-      syms_and_lines = subprocess.check_output(nm_args).split("\n")
+      nm_args = ["gecko/tools/profiler/nm-symbolicate.py", self.host_name]
+      nm_args += ["0x%08x" % adj_address for adj_address in adj_addresses]
+      output = subprocess.check_output(nm_args).split("\n")
+      syms_and_lines = zip(output[0::2], output[1::2])
+      self.lookup_kind = "nm"
 
     syms = []
-    for i in range(len(addresses_strs)):
-      syms.append(syms_and_lines[i*2] + " (in " + self.target_name + ")")
+    for (sym, line) in syms_and_lines:
+      syms.append(sym + " (in " + self.target_name + ")")
     return syms
 
-  def AddUnresolvedAddress(self, address):
-    """Stores an address into a set of addresses which will be translated into symbols later"""
-    # The output format wants the addresses as 0xAAAAAAAA, so we store the keys as strings
-    self.symbols["0x%08x" % address] = None
+  def AddUnresolvedAddresses(self, addresses):
+    """Adds a sorted array of distinct addresses to the ones which will be
+    translated into symbols later."""
+    if self.addresses:
+      self.addresses = SortedUnique(itertools.chain(self.addresses, addresses))
+    else:
+      self.addresses = array.array("L", addresses)
 
   def ContainsAddress(self, address):
     """Determines if the indicated address is contained in this library"""
@@ -123,25 +926,51 @@ class Library:
 
   def DumpSymbols(self):
     """Dumps out some information about the symbols in this library."""
-    for address_str in sorted(self.symbols.keys()):
-      print address_str, self.symbols[address_str]
+    symbols = self.symbols or [None] * len(self.addresses)
+    for (address, symbol) in zip(self.addresses, symbols):
+      print "0x%08x" % address, symbol
 
   def FindLibInTree(self, basename, dir, exclude_dir=None):
     """Search a tree for a library and return the first one found"""
-    args = ["find", dir]
-    if exclude_dir:
-      args = args + ["!", "(", "-name", exclude_dir, "-prune", ")"]
-    args = args + ["-name", basename, "-type", "f", "-print", "-quit"]
-    fullname = subprocess.check_output(args)
-    if len(fullname) > 0:
-      if fullname[-1] == "\n":
-        return fullname[:-1]
-      return fullname
-    return None
+    return LibraryTree.Get(dir, exclude_dir).Find(basename)
+
+  def LoadSymbolIndex(self):
+    """Loads a previously built symbol index for this library, if any."""
+    if self.use_symbol_index and self.id:
+      self.symbol_index = SymbolIndex.Load(self.id)
+      if self.symbol_index and self.verbose:
+        print "Using symbol index '" + SymbolIndex.Filename(self.id) + "' for '" + self.target_name + "'"
+    return self.symbol_index is not None
+
+  def HasDebugInfo(self):
+    """Determines if the library has debug information for addr2line to
+    name its functions from. We assume so if we can't tell."""
+    try:
+      return elf_symbolizer.ElfSymbolizer.get(self.host_name).has_debug_info()
+    except (elf_symbolizer.ElfError, EnvironmentError):
+      return True
+
+  def BuildSymbolIndex(self):
+    """Builds and stores a symbol index for this library. Returns False if
+    no function symbols could be found in it."""
+    if not self.use_symbol_index or not self.id:
+      return False
+    index = SymbolIndex.Build(self.host_name)
+    if not len(index):
+      return False
+    if self.verbose:
+      print "Built symbol index for '" + self.host_name + "' with", len(index), "functions"
+    index.Save(self.id)
+    self.symbol_index = index
+    return True
 
   def Locate(self):
     """Try to determine the local name of a given library"""
     if self.target_name[:7] == "/system":
+      # An index built from an earlier run spares us searching the trees.
+      if self.LoadSymbolIndex():
+        self.located = True
+        return
       basename = os.path.basename(self.target_name)
       # First look for a gecko library. We avoid the dist tree since
       # those are stripped.
@@ -151,8 +980,7 @@ class Library:
         gecko_objdir = "objdir-gecko"
       if not os.path.isdir(gecko_objdir):
         if self.symbols_path is None:
-          print(gecko_objdir, "isn't a directory");
-          sys.exit(1)
+          raise LocateError(gecko_objdir + " isn't a directory")
         self.host_name = os.path.basename(self.target_name)
         self.located = True
         return
@@ -165,8 +993,7 @@ class Library:
         else:
           product_out = "out/target/product/symbols"
         if not os.path.isdir(product_out):
-          print(product_out, "isn't a directory");
-          sys.exit(1)
+          raise LocateError(product_out + " isn't a directory")
         lib_name = self.FindLibInTree(basename, product_out)
         if not lib_name:
           if "PRODUCT_OUT" in os.environ:
@@ -174,15 +1001,17 @@ class Library:
           else:
             product_out = "out/target/product/system"
           if not os.path.isdir(product_out):
-            print(product_out, "isn't a directory");
-            sys.exit(1)
+            raise LocateError(product_out + " isn't a directory")
           lib_name = self.FindLibInTree(basename, product_out)
       if lib_name:
         self.host_name = lib_name
         if self.verbose:
           print "Found '" + self.host_name + "' for '" + self.target_name + "'"
+        if self.Identify():
+          self.LoadSymbolIndex()
     elif self.target_name in gSpecialLibs:
-      self.symbol_table = gSpecialLibs[self.target_name]
+      self.symbol_table = dict((int(address_str, 0), sym) for (address_str, sym)
+                               in gSpecialLibs[self.target_name].iteritems())
       self.symbol_table_addresses = sorted(self.symbol_table.keys())
     elif self.target_name[:1] == "/": # Absolute paths.
       basename = os.path.basename(self.target_name)
@@ -193,14 +1022,31 @@ class Library:
         self.host_name = lib_name
         if self.verbose:
           print "Found '" + self.host_name + "' for '" + self.target_name + "'"
+        self.Identify()
+        self.LoadSymbolIndex()
     self.located = True
 
-  def LookupAddressInSymbolTable(self, address_str):
+  def Identify(self):
+    """Derives the breakpad ID of a library which came without one, as
+    libraries listed in /proc/<pid>/maps do, from the library we found for
+    it. That lets it share the symbol index and cache of the same build in
+    profiles. Returns True if we derived an ID."""
+    if self.id:
+      return False
+    try:
+      self.id = elf_symbolizer.ElfSymbolizer.get(self.host_name).breakpad_id() or ""
+    except (elf_symbolizer.ElfError, EnvironmentError):
+      pass
+    if self.id and self.verbose:
+      print "Derived breakpad ID " + self.id + " for '" + self.host_name + "'"
+    return bool(self.id)
+
+  def LookupAddressInSymbolTable(self, address):
     """Lookup an address using a special symbol_table."""
-    i = bisect.bisect(self.symbol_table_addresses, address_str)
+    i = bisect.bisect(self.symbol_table_addresses, address)
     if i:
       i = i - 1
-    if address_str >= self.symbol_table_addresses[i]:
+    if address >= self.symbol_table_addresses[i]:
       sym = self.symbol_table[self.symbol_table_addresses[i]]
     else:
       sym = "Unknown"
@@ -213,54 +1059,145 @@ class Library:
       syms.append(self.LookupAddressInSymbolTable(address))
     return syms
 
-  def LookupAddressesInBreakpad(self, addresses):
+  def LookupAddressesInSymbolIndex(self, adj_addresses):
+    """Looks up multiple addresses by bisecting the symbol index."""
+    syms = []
+    for adj_address in adj_addresses:
+      syms.append(self.symbol_index.Lookup(adj_address) + " (in " + self.target_name + ")")
+    return syms
+
+  def LookupAddressesInElf(self, adj_addresses):
+    """Looks up multiple addresses by reading the library's debug
+    information and symbol table in-process, naming functions as addr2line
+    does. Returns None if the library isn't an ELF file we can read."""
+    try:
+      symbolizer = elf_symbolizer.ElfSymbolizer.get(self.host_name)
+      if gInlines:
+        results = symbolizer.lookup_inlines(adj_addresses)
+      else:
+        results = [[frame] for frame in symbolizer.lookup(adj_addresses)]
+    except elf_symbolizer.ElfError:
+      return None
+    syms = []
+    for frames in results:
+      syms.append(self.FormatInlines([function for (function, _, _) in frames]))
+    return syms
+
+  def FormatInlines(self, functions):
+    """Makes one symbol out of the functions at an address, innermost
+    first, as "inner [inlined into outer] (in lib)"."""
+    functions = [function or "??" for function in functions]
+    sym = functions[0] + "".join([" [inlined into " + function + "]"
+                                  for function in functions[1:]])
+    return sym + " (in " + self.target_name + ")"
+
+  def LookupAddressesInBreakpad(self, adj_addresses):
+    """Looks up multiple addresses in the library's breakpad symbol file,
+    setting lookup_kind. Returns None without a --symbols-path."""
     if not self.symbols_path:
       return None
 
-    if "GECKO_PATH" in os.environ:
-      gecko_src_path = os.environ["GECKO_PATH"]
+    self.lookup_kind = "breakpad"
+    libname = os.path.basename(self.host_name)
+    breakpad_symbols = BreakpadSymbols.Get(self.symbols_path, libname, self.id)
+    if breakpad_symbols is None:
+      return ["??" for adj_address in adj_addresses]
+    if breakpad_symbols.breakpad_id != self.id:
+      # Another build's symbols mustn't be cached as this build's.
+      self.lookup_kind = None
+    syms = []
+    for symbol in breakpad_symbols.Lookup(adj_addresses):
+      if symbol is None:
+        syms.append("??")
+      else:
+        syms.append(symbol + " (in " + self.target_name + ")")
+    return syms
+
+  def SymbolCacheKind(self):
+    """Names the symbol cache for the way we expect to look up this
+    library's symbols, as they don't all give the same symbol for an
+    address. LibAddressesToSymbols sets lookup_kind to the way it actually
+    did."""
+    if self.symbols_path:
+      return "breakpad"
+    if gUseToolchain:
+      kind = "addr2line"
     else:
-      gecko_src_path = "gecko"
-    sys.path.append(os.path.join(gecko_src_path, "tools", "rb"))
-    from fix_stack_using_bpsyms import fixSymbols
-
-    def fixSymbol(address):
-      addr = fixupAddress(self, address)
-      # the 'x' in '0x' must be lower case, all others must be upper case
-      addr_str =  formatAddress(addr)
-      libname = os.path.basename(self.host_name)
-      line = "[" + libname + " +" + addr_str + "]"
-      symbol = fixSymbols(line, self.symbols_path)
-      if symbol == line:
-        return "??"
-      if symbol[-1] == "\n":
-        symbol = symbol[:-1]
-      # Absolute source path ends up in a long string,
-      # take only the source file with line number.
-      # When the symbol is resolved with source path,
-      # the symbol format is:
-      #   <function-name> [<source-path>:<line>]
-      match = symbol_path_matcher.match(symbol)
-      if match:
-        symbol, source_path = match.group(1, 2)
-        source_file = os.path.basename(source_path)
-        symbol += " @ " + source_file
-      return symbol + " (in " + self.target_name + ")"
-
-    return map(lambda address: fixSymbol(address), addresses)
+      kind = "elf"
+    if gInlines:
+      kind += "-inlines"
+    return kind
 
   def ResolveSymbols(self, progress=False):
-    """Tries to convert all of the symbols into symbolic equivalents."""
-    if len(self.symbols) == 0:
+    """Tries to convert all of the symbols into symbolic equivalents. The
+    symbols found by earlier runs are taken from the library's symbol cache,
+    and the ones we find are added to it."""
+    if len(self.addresses) == 0:
       return
-    addresses_strs = self.symbols.keys()
-    for i in range(0,len(addresses_strs), 256):
-      slice = addresses_strs[i:i+256]
-      if progress:
-        print "Resolving symbols for", self.target_name, len(slice), "addresses"
-      syms = self.AddressesToSymbols(slice)
-      for j in range(len(syms)):
-        self.symbols[addresses_strs[i+j]] = syms[j]
+    if progress:
+      print "Resolving symbols for", self.target_name, len(self.addresses), "addresses"
+    self.symbols = self.CachedLookup(
+      [fixupAddress(self, address) for address in self.addresses],
+      lambda missing: self.AddressesToSymbols([self.addresses[i] for i in missing]))
+
+  def ResolveCachedSymbols(self):
+    """Takes the symbols for all of the library's addresses from its symbol
+    cache, without locating the library. Returns False, leaving the symbols
+    unresolved, if any of them aren't cached."""
+    cache = self.GetSymbolCache(self.SymbolCacheKind(), self.target_name)
+    symbols = [cache.Get(fixupAddress(self, address)) for address in self.addresses]
+    if None in symbols:
+      return False
+    cache.Flush()
+    self.symbols = symbols
+    return True
+
+  def GetSymbolCache(self, kind, lib_name):
+    """Returns the library's symbol cache of the given kind, keeping it
+    loaded for later lookups."""
+    if kind not in self.symbol_caches:
+      self.symbol_caches[kind] = SymbolCache(kind, self.id, lib_name)
+    return self.symbol_caches[kind]
+
+  def CachedLookup(self, adj_addresses, lookup):
+    """Returns the symbols for adj_addresses, which must be fixed up (see
+    fixupAddress). The symbols found by earlier runs are taken from the
+    library's symbol cache; lookup is called with the indexes of the rest,
+    and the symbols it returns are added to the cache."""
+    kind = self.SymbolCacheKind()
+    cache = self.GetSymbolCache(kind, self.target_name)
+    symbols = [cache.Get(adj_address) for adj_address in adj_addresses]
+    missing = [i for (i, sym) in enumerate(symbols) if sym is None]
+    if self.verbose:
+      print "Found", len(symbols) - len(missing), "of", len(symbols), "symbols for '" + self.target_name + "' in the symbol cache"
+    if missing:
+      # Locating the library can rename it, so note its name first.
+      lib_name = self.target_name
+      found = lookup(missing)
+      # Don't remember that we couldn't find the library or its symbol
+      # file; they may turn up.
+      cacheable = (self.host_name or self.symbol_index) and self.lookup_kind
+      if cacheable and self.lookup_kind != kind:
+        # We ended up looking the symbols up another way, so they belong
+        # in that way's cache.
+        cache.Flush()
+        cache = self.GetSymbolCache(self.lookup_kind, lib_name)
+      for (i, sym) in zip(missing, found):
+        symbols[i] = sym
+        if cacheable and not SymbolapiClient.IsUnresolved(sym):
+          cache.Put(adj_addresses[i], sym)
+    cache.Flush()
+    return symbols
+
+def ResolveLibrarySymbols(args):
+  """Resolves the symbols of one library. This runs in a worker process when
+  symbolicating with --jobs, so it hands back the symbols rather than relying
+  on the changes made to lib."""
+  (lib, progress) = args
+  lib.ResolveSymbols(progress=progress)
+  Addr2line.CloseAll()
+  elf_symbolizer.ElfSymbolizer.close_all()
+  return lib.symbols
 
 ###############################################################################
 #
@@ -269,17 +1206,24 @@ class Library:
 ###############################################################################
 
 class Libraries:
-  def __init__(self, profile, verbose=False, symbols_path=None):
+  def __init__(self, profile, verbose=False, symbols_path=None,
+               use_symbol_index=True):
     lib_dicts = json.loads(profile["libs"])
     lib_dicts = sorted(lib_dicts, key=lambda lib: lib["start"])
     self.libs = [Library(lib_dict, verbose=verbose,
-      symbols_path=symbols_path) for lib_dict in lib_dicts]
+      symbols_path=symbols_path, use_symbol_index=use_symbol_index)
+      for lib_dict in lib_dicts]
     # Create a sorted list of just the start addresses so that we can use
     # bisect to lookup addresses
     self.libs_start = [lib.start for lib in self.libs]
     self.profile = profile
+    # The profile's stacks for --summary, --diff and --folded; see
+    # ThreadStacks.
+    self.thread_stacks = None
     self.last_lib = None
+    self.verbose = verbose
     self.symbols_path = symbols_path
+    self.use_symbol_index = use_symbol_index
 
   def Dump(self):
     """Dumps out some information about all of the libraries that we're tracking."""
@@ -307,60 +1251,82 @@ class Libraries:
       self.last_lib = self.AddressToLib(address)
     return self.last_lib
 
-  def ResolveSymbols(self, progress=True):
-    """Tries to convert all of the symbols into symbolic equivalents."""
+  def ResolveSymbols(self, progress=True, jobs=1, remote_jobs=4,
+                     chunk_size=2048):
+    """Tries to convert all of the symbols into symbolic equivalents.
+
+    With jobs > 1 the libraries are resolved concurrently on a pool of that
+    many worker processes. When symbolicating against a symbolapi server,
+    remote_jobs and chunk_size bound the concurrent requests and the number
+    of addresses in each."""
     if not self.symbols_path or not self.symbols_path.startswith('http'):
-      for lib in self.libs:
-        lib.ResolveSymbols(progress=progress)
+      libs = [lib for lib in self.libs if lib.addresses]
+      if jobs > 1 and len(libs) > 1:
+        # Only the libraries whose symbols aren't all cached need a worker.
+        libs = [lib for lib in libs if not lib.ResolveCachedSymbols()]
+      if jobs > 1 and len(libs) > 1:
+        # Locate those up front, so that the workers inherit the library
+        # trees instead of each loading them again.
+        for lib in libs:
+          if not lib.located:
+            lib.Locate()
+        pool = multiprocessing.Pool(min(jobs, len(libs)))
+        try:
+          # Hand the biggest libraries out first so that they don't end up
+          # as the stragglers.
+          order = sorted(range(len(libs)), key=lambda i: -len(libs[i].addresses))
+          results = pool.map(ResolveLibrarySymbols,
+                             [(libs[i], progress) for i in order], chunksize=1)
+        finally:
+          pool.close()
+          pool.join()
+        for i, symbols in zip(order, results):
+          libs[i].symbols = symbols
+      else:
+        for lib in libs:
+          lib.ResolveSymbols(progress=progress)
       return
 
     # We were given a url address as the symbols path,
     # it must be a symbolapi server address
-    addresses = []
     memory_map = []
     libs = []
-    index = 0
-    address_map = {}
-
+    frames = []
+    frame_addresses = []
     for lib in self.libs:
-      # skip fake binaries
-      if not lib.target_name.startswith("["):
-        libname = os.path.basename(lib.target_name)
-        memory_map.append((libname, lib.id))
-        libs.append(lib)
-        for address in lib.symbols.keys():
-            adj_address = fixupAddress(lib, address)
-            address_map[adj_address] = address
-            addresses.append((index, adj_address))
-        index += 1
-
-    symbolication_request = {
-      "stacks": [addresses],
-      "memoryMap": memory_map,
-      "version": 3,
-      "symbolSources": ["B2G", "Firefox"]
-    }
-
-    request_data = json.dumps(symbolication_request)
-
-    headers = {
-      "Content-Type": "application/json",
-      "Content-Length": len(request_data),
-      "Connection": "close"
-    }
-
-    request = urllib2.Request(url=self.symbols_path, data=request_data, headers=headers)
-    r = urllib2.urlopen(request)
-    if r.getcode() != 200:
-      raise Exception("Bad request: " + str(r.status_code))
-
-    content = json.load(r)
+      # The server doesn't know about fake binaries, but we might.
+      if lib.target_name.startswith("["):
+        lib.ResolveSymbols(progress=progress)
+        continue
+      index = len(libs)
+      cache = SymbolCache("remote", lib.id, lib.target_name)
+      memory_map.append((os.path.basename(lib.target_name), lib.id))
+      libs.append((lib, cache))
+      lib.symbols = [None] * len(lib.addresses)
+      for (i, address) in enumerate(lib.addresses):
+        adj_address = fixupAddress(lib, address)
+        sym = cache.Get(adj_address)
+        if sym is not None:
+          lib.symbols[i] = sym
+        else:
+          frames.append((index, adj_address))
+          frame_addresses.append(i)
 
-    for sym, address in zip(content[0], addresses):
-      index = address[0]
-      lib = libs[index]
-      original_address = address_map[address[1]]
-      lib.symbols[original_address] = sym
+    if frames:
+      if progress:
+        print "Requesting", len(frames), "symbols from", self.symbols_path
+      client = SymbolapiClient(self.symbols_path, jobs=remote_jobs,
+                               chunk_size=chunk_size)
+      syms = client.Symbolicate(memory_map, frames)
+      for ((index, adj_address), i, sym) in zip(frames, frame_addresses, syms):
+        (lib, cache) = libs[index]
+        lib.symbols[i] = sym
+        # Don't remember what the server couldn't find; it may get the
+        # symbol files later.
+        if not SymbolapiClient.IsUnresolved(sym):
+          cache.Put(adj_address, sym)
+    for (lib, cache) in libs:
+      cache.Flush()
 
   def SearchUnresolvedAddresses(self, progress=False):
     """Search and build a set of unresolved addresses for each library."""
@@ -391,21 +1357,675 @@ class Libraries:
             except ValueError:
               continue
 
+    addresses = AddressSet()
     if self.profile["meta"]["version"] >= 3:
-      addresses = getUnresolvedAddressesV3()
+      addresses.update(getUnresolvedAddressesV3())
     else:
-      addresses = getUnresolvedAddressesV2()
-    for address in addresses:
-      lib = self.Lookup(address)
-      if lib:
-        lib.AddUnresolvedAddress(address)
+      addresses.update(getUnresolvedAddressesV2())
+    self.AddUnresolvedAddresses(addresses.SortedUnique())
+
+  def AddUnresolvedAddresses(self, addresses):
+    """Hands each address in the sorted array addresses to the library
+    containing it, in a single pass over both the addresses and the
+    libraries. Addresses outside of every library are ignored."""
+    if not self.libs:
+      return
+    lo = bisect.bisect_left(addresses, self.libs_start[0])
+    for (i, lib) in enumerate(self.libs):
+      # Like AddressToLib, an address belongs to the last library starting
+      # at or below it, provided that library contains it.
+      if i + 1 < len(self.libs):
+        next_start = self.libs_start[i + 1]
+        hi = bisect.bisect_left(addresses, min(lib.end, next_start), lo)
+      else:
+        next_start = None
+        hi = bisect.bisect_left(addresses, lib.end, lo)
+      if hi > lo:
+        lib.AddUnresolvedAddresses(addresses[lo:hi])
+      if next_start is not None:
+        lo = bisect.bisect_left(addresses, next_start, hi)
 
   def SymbolicationTable(self):
-    """Create the union of all of the symbols from all of the libraries."""
-    result = {}
+    """Create the union of all of the symbols from all of the libraries,
+    ordered by address so that the output doesn't depend on the order in
+    which the libraries were resolved."""
+    result = []
     for lib in self.libs:
-      result.update(lib.symbols)
-    return result
+      result.extend(zip(lib.addresses, lib.symbols or [None] * len(lib.addresses)))
+    result.sort()
+    # The output format wants the addresses as 0xAAAAAAAA
+    return collections.OrderedDict(("0x%08x" % address, sym)
+                                   for (address, sym) in result)
+
+def ResolveSymbolsForProfiles(libraries, progress=True, **kwargs):
+  """Resolves the symbols of several profiles' Libraries together, so that a
+  library loaded by more than one of them (at whatever address) is resolved
+  once, for the union of their addresses in it. kwargs are passed on to
+  Libraries.ResolveSymbols."""
+  if len(libraries) == 1:
+    libraries[0].ResolveSymbols(progress=progress, **kwargs)
+    return
+
+  groups = collections.OrderedDict()
+  for libs in libraries:
+    for lib in libs.libs:
+      if lib.addresses:
+        groups.setdefault((lib.target_name, lib.id), []).append(lib)
+
+  # Resolve a copy of the first instance of each library, after moving the
+  # other instances' addresses into its address space. Moving an address by
+  # the difference in load bias leaves fixupAddress's result unchanged.
+  merged = Libraries({"libs": "[]"}, libraries[0].verbose,
+                     libraries[0].symbols_path,
+                     use_symbol_index=libraries[0].use_symbol_index)
+  for members in groups.itervalues():
+    lib = copy.copy(members[0])
+    bias = lib.start - lib.offset
+    addresses = AddressSet()
+    for member in members:
+      delta = bias - (member.start - member.offset)
+      addresses.update(address + delta for address in member.addresses)
+    lib.addresses = addresses.SortedUnique()
+    merged.libs.append(lib)
+  merged.ResolveSymbols(progress=progress, **kwargs)
+
+  for (lib, members) in zip(merged.libs, groups.itervalues()):
+    bias = lib.start - lib.offset
+    for member in members:
+      delta = bias - (member.start - member.offset)
+      member.symbols = [lib.symbols[bisect.bisect_left(lib.addresses, address + delta)]
+                        for address in member.addresses]
+
+###############################################################################
+#
+# Streaming profile reading and writing. The reading is used by --stream to
+# symbolicate profiles without ever holding the decoded profile in memory.
+#
+###############################################################################
+
+json_token_matcher = re.compile(
+  r'[\s,:]*(?:"([^"\\]*(?:\\.[^"\\]*)*)"|([{}\[\]])|([^\s,:{}\[\]"]+))')
+
+def DecodeJSONString(raw):
+  """Decodes the contents of a JSON string token from IterJSONEvents into
+  unicode, as the json module would."""
+  if "\\" in raw:
+    return json.loads('"' + raw + '"')
+  return raw.decode("utf-8")
+
+def IterJSONEvents(f, chunk_size=1 << 20):
+  """Reads the JSON document in f a chunk at a time and yields a
+  (path, event, value) tuple for each token in it.
+
+  path is the list of map keys leading to the token, with None standing for
+  array elements. It is updated in place, so copy it if you need to keep it.
+  event is one of "start_map", "end_map", "start_array", "end_array", "key",
+  "string" or "scalar". value holds the token's text for the last three, with
+  strings left escaped; see DecodeJSONString.
+  """
+  path = []
+  # True for each open map, False for each open array.
+  in_map = []
+  expect_key = False
+  buf = ""
+  pos = 0
+  eof = False
+  while True:
+    match = json_token_matcher.match(buf, pos)
+    if match is None or (match.end() == len(buf) and not eof):
+      # The next token may carry on into the next chunk.
+      if eof:
+        if buf[pos:].strip(" \t\r\n,:"):
+          raise ValueError("Malformed JSON near '%s'" % buf[pos:pos + 40])
+        return
+      # Read at least as much as we're carrying over, so that a huge token
+      # isn't rescanned once for every chunk it spans.
+      data = f.read(max(chunk_size, len(buf) - pos))
+      eof = not data
+      buf = buf[pos:] + data
+      pos = 0
+      continue
+    pos = match.end()
+    (string, bracket, scalar) = match.groups()
+    if string is not None:
+      if expect_key:
+        path[-1] = DecodeJSONString(string)
+        expect_key = False
+        yield (path, "key", path[-1])
+      else:
+        yield (path, "string", string)
+        expect_key = bool(in_map) and in_map[-1]
+    elif bracket == "{":
+      yield (path, "start_map", None)
+      in_map.append(True)
+      path.append(None)
+      expect_key = True
+    elif bracket == "[":
+      yield (path, "start_array", None)
+      in_map.append(False)
+      path.append(None)
+      expect_key = False
+    elif bracket is not None:
+      was_map = in_map.pop()
+      path.pop()
+      yield (path, "end_map" if was_map else "end_array", None)
+      expect_key = bool(in_map) and in_map[-1]
+    else:
+      yield (path, "scalar", scalar)
+      expect_key = bool(in_map) and in_map[-1]
+
+def ScanProfile(f, collect_addresses=True):
+  """Scans the profile in f for its "libs" string and the set of addresses
+  it refers to, from threads[].samples[].frames[].location in version 2
+  profiles and threads[].stringTable in version 3 ones.
+
+  Returns a (libs, addresses) tuple, with the addresses in a sorted array.
+  If collect_addresses is False, we stop as soon as we have found the
+  libraries.
+  """
+  found = {}
+
+  def getAddresses():
+    for (path, event, value) in IterJSONEvents(f):
+      if event != "string":
+        continue
+      depth = len(path)
+      if depth == 1:
+        if path[0] == "libs":
+          found["libs"] = DecodeJSONString(value)
+          if not collect_addresses:
+            return
+      elif value[:2] == "0x" and path[0] == "threads" and \
+           ((depth == 4 and path[2] == "stringTable") or
+            (depth == 7 and path[6] == "location" and path[2] == "samples" and
+             path[4] == "frames")):
+        try:
+          yield int(value, 16)
+        except ValueError:
+          continue
+
+  addresses = AddressSet()
+  addresses.update(getAddresses())
+  return (found.get("libs"), addresses.SortedUnique())
+
+def WriteSymbolicatedProfile(outfile, profile_file, symbolication_table):
+  """Writes the profileJSONWithSymbolicationTable wrapper, copying the
+  profile text across from profile_file rather than re-encoding it."""
+  outfile.write('{"format": "profileJSONWithSymbolicationTable,1", "profileJSON": ')
+  shutil.copyfileobj(profile_file, outfile)
+  outfile.write(', "symbolicationTable": ')
+  json.dump(symbolication_table, outfile)
+  outfile.write('}')
+
+###############################################################################
+#
+# Profile summaries. With --summary, we list the functions and libraries
+# each thread spent the most samples in, without having to load the
+# symbolicated profile into Cleopatra.
+#
+###############################################################################
+
+def RowField(row, field):
+  """Returns a field of a version 3 table row, which may have had its
+  trailing nulls left out."""
+  if field < len(row):
+    return row[field]
+  return None
+
+def TableStacks(strings, frame_table, stack_table, counts):
+  """Turns the counts of samples taken in each of a version 3 thread's
+  stackTable entries into a Counter of samples for each distinct stack (see
+  ThreadStacks). Each stack is only walked once however many samples it
+  has."""
+  location_field = frame_table["schema"]["location"]
+  # Frames without a location still count, under a placeholder.
+  locations = []
+  for frame in frame_table["data"]:
+    index = RowField(frame, location_field)
+    locations.append(strings[index] if index is not None else "(unknown)")
+  prefix_field = stack_table["schema"]["prefix"]
+  frame_field = stack_table["schema"]["frame"]
+  stack_rows = stack_table["data"]
+  stacks = collections.Counter()
+  for (stack, count) in counts.iteritems():
+    if stack is None:
+      continue
+    frames = []
+    while stack is not None:
+      frames.append(locations[RowField(stack_rows[stack], frame_field)])
+      stack = RowField(stack_rows[stack], prefix_field)
+    frames.reverse()
+    stacks[tuple(frames)] += count
+  return stacks
+
+def ThreadStacks(profile):
+  """Returns a list of (thread name, stacks) tuples for the threads of a
+  version 2 or 3 profile, where stacks is a Counter of the number of samples
+  taken with each distinct stack. The stacks are tuples of frame locations,
+  outermost first."""
+  threads = []
+  if profile["meta"]["version"] >= 3:
+    for thread in profile["threads"]:
+      stack_field = thread["samples"]["schema"]["stack"]
+      counts = collections.Counter(RowField(sample, stack_field)
+                                   for sample in thread["samples"]["data"] if sample)
+      stacks = TableStacks(thread["stringTable"], thread["frameTable"],
+                           thread["stackTable"], counts)
+      threads.append((thread.get("name", ""), stacks))
+  else:
+    # Every frame has its own copy of its location, so we intern them to
+    # only keep one copy of each for all of the stacks.
+    locations = {}
+    for thread in profile["threads"]:
+      stacks = collections.Counter(tuple(locations.setdefault(frame["location"], frame["location"])
+                                         for frame in sample["frames"])
+                                   for sample in thread["samples"] if sample.get("frames"))
+      threads.append((thread.get("name", ""), stacks))
+  return threads
+
+def StreamThreadStacks(f):
+  """Like ThreadStacks, but reads the profile in f incrementally with
+  IterJSONEvents, so that only the distinct stacks are ever held in memory
+  rather than the whole profile."""
+  threads = []
+  # The version 2 frame locations, interned as in ThreadStacks.
+  locations = {}
+  for (path, event, value) in IterJSONEvents(f):
+    depth = len(path)
+    if depth < 2 or path[0] != "threads":
+      continue
+    if depth == 2:
+      if event == "start_map":
+        name = ""
+        # Version 2 state: the stack of the current sample.
+        stacks = collections.Counter()
+        frames = []
+        # Version 3 state: the tables, and the number of samples in each
+        # stackTable entry.
+        strings = []
+        tables = dict((table, {"schema": {}, "data": []})
+                      for table in ("frameTable", "stackTable", "samples"))
+        counts = collections.Counter()
+        row = None
+      elif event == "end_map":
+        if tables["stackTable"]["data"]:
+          # Count any samples which came before their schema.
+          stack_field = tables["samples"]["schema"].get("stack", 0)
+          counts.update(RowField(sample, stack_field) for sample in tables["samples"]["data"])
+          stacks = TableStacks(strings, tables["frameTable"], tables["stackTable"], counts)
+        threads.append((name, stacks))
+    elif depth == 3:
+      if event == "string" and path[2] == "name":
+        name = DecodeJSONString(value)
+    elif path[2] == "stringTable":
+      if depth == 4 and event == "string":
+        strings.append(DecodeJSONString(value))
+    elif path[2] in tables and path[3] == "schema":
+      if depth == 5 and event == "scalar":
+        tables[path[2]]["schema"][path[4]] = int(value)
+    elif path[2] in tables and path[3] == "data":
+      if depth == 5:
+        if event == "start_array":
+          row = []
+        elif event == "end_array":
+          table = tables[path[2]]
+          if path[2] == "samples" and "stack" in table["schema"]:
+            counts[RowField(row, table["schema"]["stack"])] += 1
+          else:
+            table["data"].append(row)
+      elif depth == 6:
+        # We only need the integer fields; anything else is a placeholder.
+        if event == "scalar" and value != "null":
+          try:
+            row.append(int(value))
+          except ValueError:
+            row.append(None)
+        elif event in ("scalar", "string", "start_map", "start_array"):
+          row.append(None)
+    elif path[2] == "samples":
+      # A version 2 sample.
+      if depth == 7 and event == "string" and path[4] == "frames" and path[6] == "location":
+        location = DecodeJSONString(value)
+        frames.append(locations.setdefault(location, location))
+      elif depth == 5 and event == "end_array" and path[4] == "frames":
+        if frames:
+          stacks[tuple(frames)] += 1
+        frames = []
+  return threads
+
+class FrameNames:
+  """Maps frame locations to (function, library basename) tuples using a
+  symbolication table, symbolicating each distinct location only once. The
+  library is None for locations which aren't in one."""
+  def __init__(self, symbolication_table):
+    self.symbolication_table = symbolication_table
+    self.names = {}
+
+  def Get(self, location):
+    if location not in self.names:
+      sym = None
+      if location[:2] == "0x":
+        try:
+          sym = self.symbolication_table.get("0x%08x" % int(location, 16))
+        except ValueError:
+          pass
+      if sym is None:
+        self.names[location] = (location, None)
+      else:
+        (function, sep, lib) = sym.rpartition(" (in ")
+        if sep and lib.endswith(")"):
+          self.names[location] = (function, os.path.basename(lib[:-1]))
+        else:
+          self.names[location] = (sym, None)
+    return self.names[location]
+
+def SummarizeStacks(stacks, symbolication_table, strip_lines=False):
+  """Counts the samples in stacks (see ThreadStacks) for each function and
+  library, both where they were the innermost frame (self) and anywhere in
+  the stack (total). Returns a (samples, function_self, function_total,
+  lib_self, lib_total) tuple of the sample count and four Counters. With
+  strip_lines, the " @ file:line" breakpad symbols end with is dropped, so
+  that each function is counted once rather than once per line."""
+  frame_names = FrameNames(symbolication_table)
+  function_self = collections.Counter()
+  function_total = collections.Counter()
+  lib_self = collections.Counter()
+  lib_total = collections.Counter()
+  for (stack, count) in stacks.iteritems():
+    if not stack:
+      continue
+    names = [frame_names.Get(location) for location in stack]
+    if strip_lines:
+      names = [(function.rpartition(" @ ")[0] or function, lib)
+               for (function, lib) in names]
+    (function, lib) = names[-1]
+    function_self[function, lib] += count
+    if lib:
+      lib_self[lib] += count
+    # Recursive functions only count once towards their total.
+    for name in set(names):
+      function_total[name] += count
+    for lib in set(lib for (function, lib) in names if lib):
+      lib_total[lib] += count
+  return (sum(stacks.itervalues()), function_self, function_total, lib_self, lib_total)
+
+def FunctionLabel((function, lib)):
+  """Formats a function as counted by SummarizeStacks."""
+  if lib:
+    return function + " (in " + lib + ")"
+  return function
+
+def PrintSummary(threads, symbolication_table, top):
+  """Prints the top functions and libraries of each of threads (see
+  ThreadStacks) by self and total samples."""
+  def PrintTop(title, self_counts, total_counts, by_total, label):
+    print "  Top %s by %s samples:" % (title, "total" if by_total else "self")
+    print "     Self          Total"
+    counts = total_counts if by_total else self_counts
+    for (name, _) in heapq.nlargest(top, counts.iteritems(), key=lambda (name, count): count):
+      print "  %7d %5.1f%% %7d %5.1f%%  %s" % (
+          self_counts[name], 100.0 * self_counts[name] / samples,
+          total_counts[name], 100.0 * total_counts[name] / samples,
+          label(name).encode("utf-8"))
+
+  for (name, stacks) in threads:
+    (samples, function_self, function_total, lib_self, lib_total) = \
+      SummarizeStacks(stacks, symbolication_table)
+    print "Thread %s: %d samples" % (name.encode("utf-8"), samples)
+    if not samples:
+      continue
+    PrintTop("functions", function_self, function_total, False, FunctionLabel)
+    PrintTop("functions", function_self, function_total, True, FunctionLabel)
+    PrintTop("libraries", lib_self, lib_total, False, lambda lib: lib)
+    PrintTop("libraries", lib_self, lib_total, True, lambda lib: lib)
+
+def PrintDiff(base_threads, base_table, new_threads, new_table, top):
+  """Prints the top functions of each thread (see ThreadStacks) whose share
+  of the thread's self and total samples changed the most from the base
+  profile to the new one. Threads are matched by name, and threads sharing
+  a name are counted together. Functions are matched by name and library
+  alone, as their line numbers shift between builds."""
+  def ThreadsByName(threads):
+    by_name = collections.OrderedDict()
+    for (name, stacks) in threads:
+      by_name.setdefault(name, collections.Counter()).update(stacks)
+    return by_name
+
+  base_threads = ThreadsByName(base_threads)
+  new_threads = ThreadsByName(new_threads)
+  empty = collections.Counter()
+  for name in base_threads.keys() + [name for name in new_threads if name not in base_threads]:
+    (base_samples, base_self, base_total, _, _) = \
+      SummarizeStacks(base_threads.get(name, empty), base_table, strip_lines=True)
+    (new_samples, new_self, new_total, _, _) = \
+      SummarizeStacks(new_threads.get(name, empty), new_table, strip_lines=True)
+    print "Thread %s: %d -> %d samples" % (name.encode("utf-8"), base_samples,
+                                           new_samples)
+    if not base_samples or not new_samples:
+      continue
+    for (kind, base_counts, new_counts) in (("self", base_self, new_self),
+                                            ("total", base_total, new_total)):
+      print "  Top functions by change in share of %s samples:" % kind
+      print "     Base     New  Change"
+      deltas = []
+      for function in set(base_counts) | set(new_counts):
+        base_share = 100.0 * base_counts[function] / base_samples
+        new_share = 100.0 * new_counts[function] / new_samples
+        if new_share != base_share:
+          deltas.append((new_share - base_share, base_share, new_share, function))
+      for (delta, base_share, new_share, function) in \
+          heapq.nlargest(top, deltas, key=lambda delta: abs(delta[0])):
+        label = FunctionLabel(function).encode("utf-8")
+        print "  %6.1f%% %6.1f%% %+6.1f%%  %s" % (base_share, new_share, delta, label)
+
+def WriteFoldedStacks(outfile, threads, symbolication_table):
+  """Writes the stacks of threads (see ThreadStacks) in the folded format
+  read by flame graph tools, one line for each distinct stack:
+    GeckoMain;(root);nsThread::ProcessNextEvent(bool, bool*) (in libxul.so);... 42
+  The thread name is the outermost frame."""
+  frame_names = FrameNames(symbolication_table)
+  # The folded text of each distinct location, with the semicolons which
+  # would split it into several frames replaced.
+  labels = {}
+  def Label(location):
+    if location not in labels:
+      labels[location] = FunctionLabel(frame_names.Get(location)).replace(";", ":")
+    return labels[location]
+
+  for (name, stacks) in threads:
+    # Locations which symbolicate the same fold into the same stack.
+    folded = collections.Counter()
+    prefix = name.replace(";", ":")
+    for (stack, count) in stacks.iteritems():
+      folded[";".join([prefix] + [Label(location) for location in stack])] += count
+    for (line, count) in sorted(folded.iteritems()):
+      outfile.write("%s %d\n" % (line.encode("utf-8"), count))
+
+###############################################################################
+#
+# Symbolication server. Answers the same version 3 "stacks"/"memoryMap"
+# requests that Libraries.ResolveSymbols sends to a symbolapi server, using
+# libraries and symbol tables which stay loaded between requests.
+#
+###############################################################################
+
+class SymbolicationRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  # Lets clients keep their connection open between requests.
+  protocol_version = "HTTP/1.1"
+
+  def do_POST(self):
+    try:
+      length = int(self.headers.getheader("Content-Length", 0))
+      request = json.loads(self.rfile.read(length))
+      response = json.dumps(self.server.Symbolicate(request))
+    except (ValueError, KeyError, TypeError, IndexError) as e:
+      self.send_error(400, "Bad symbolication request: " + str(e))
+      return
+    except Exception as e:
+      self.send_error(500, "Symbolication failed: " + str(e))
+      return
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(response)))
+    self.end_headers()
+    self.wfile.write(response)
+
+  def log_message(self, format, *args):
+    if self.server.verbose:
+      BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+class SymbolicationServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, address, verbose=False, symbols_path=None,
+               use_symbol_index=True):
+    BaseHTTPServer.HTTPServer.__init__(self, address, SymbolicationRequestHandler)
+    self.verbose = verbose
+    self.symbols_path = symbols_path
+    self.use_symbol_index = use_symbol_index
+    # Library instances and the locks serializing their use, keyed by
+    # (basename, breakpad ID). The Library is None until it has been located.
+    self.libraries = {}
+    self.lock = threading.Lock()
+
+  def AddLibraries(self, libs):
+    """Serves the libraries of a profile's Libraries as they are, so that
+    their symbols come out named as in that profile."""
+    for lib in libs.libs:
+      if not lib.target_name.startswith("["):
+        key = (os.path.basename(lib.target_name), lib.id)
+        if key not in self.libraries:
+          lib.Locate()
+          self.libraries[key] = (lib, threading.Lock())
+
+  def GetLibrary(self, libname, breakpad_id):
+    """Returns the (Library, lock) pair for a library, creating it on first
+    use. Locating a library can mean walking the build trees, so we only
+    hold the library's own lock meanwhile, not the server's."""
+    key = (libname, breakpad_id)
+    with self.lock:
+      if key not in self.libraries:
+        self.libraries[key] = (None, threading.Lock())
+      (lib, lock) = self.libraries[key]
+    if lib is not None:
+      return (lib, lock)
+    with lock:
+      # Another request may have located the library while we waited.
+      with self.lock:
+        (lib, _) = self.libraries[key]
+      if lib is not None:
+        return (lib, lock)
+      # Pretend the library lives under /system so that Locate searches
+      # the build trees for it, then name it the way symbolapi does.
+      lib = Library({"start": 0, "end": 0, "offset": 0,
+                     "name": "/system/" + libname, "breakpadId": breakpad_id},
+                    verbose=self.verbose, symbols_path=self.symbols_path,
+                    use_symbol_index=self.use_symbol_index)
+      try:
+        lib.Locate()
+      except LocateError as e:
+        # Answer "Unknown" for the library's frames this time, and try to
+        # locate it again on the next request; the tree may turn up.
+        if self.verbose:
+          print "Can't locate '" + libname + "': " + str(e)
+        lib.located = True
+        lib.target_name = libname
+        return (lib, lock)
+      lib.target_name = libname
+      with self.lock:
+        self.libraries[key] = (lib, lock)
+      return (lib, lock)
+
+  def Symbolicate(self, request):
+    """Returns a list of symbols for each stack in request["stacks"]. Each
+    frame is a [memoryMap index, fixed up library address] pair."""
+    if request.get("version") != 3:
+      raise ValueError("unsupported version " + str(request.get("version")))
+    memory_map = request["memoryMap"]
+    libs = []
+    for (libname, breakpad_id) in memory_map:
+      try:
+        libs.append(self.GetLibrary(libname, breakpad_id))
+      except Exception as e:
+        print "Error loading '" + libname + "':", e
+        libs.append(None)
+    results = []
+    for stack in request["stacks"]:
+      syms = ["0x%x" % adj_address for (lib_index, adj_address) in stack]
+      # Look up all the frames from one library in a single batch.
+      frames_by_lib = collections.defaultdict(list)
+      for (i, (lib_index, adj_address)) in enumerate(stack):
+        if 0 <= lib_index < len(libs):
+          frames_by_lib[lib_index].append(i)
+      for (lib_index, frames) in frames_by_lib.iteritems():
+        libname = memory_map[lib_index][0]
+        adj_addresses = [stack[i][1] for i in frames]
+        lib_syms = None
+        if libs[lib_index]:
+          (lib, lock) = libs[lib_index]
+          try:
+            with lock:
+              lib_syms = lib.CachedLookup(adj_addresses, lambda missing:
+                lib.LibAddressesToSymbols([adj_addresses[i] for i in missing]))
+          except Exception as e:
+            print "Error symbolicating '" + libname + "':", e
+        if lib_syms is None:
+          # One broken library shouldn't cost the other libraries' frames
+          # their symbols.
+          lib_syms = ["Unknown (in " + libname + ")"] * len(frames)
+        for (i, sym) in zip(frames, lib_syms):
+          syms[i] = sym
+      results.append(syms)
+    return results
+
+###############################################################################
+#
+# Single address lookups, for --lookup. These only read as much as they need
+# to find the libraries, and answer from the symbol indexes of earlier runs
+# where they can.
+#
+###############################################################################
+
+def ReadLibraryList(f):
+  """Reads a list of libraries given either like a profile's "libs" (as a
+  JSON list) or as /proc/<pid>/maps, and returns it as a list of
+  dictionaries like the profile's. Only executable mappings are taken from
+  maps."""
+  text = f.read()
+  if text.lstrip()[:1] == "[":
+    return json.loads(text)
+  libs = []
+  for line in text.splitlines():
+    # 40000000-40123000 r-xp 00000000 b3:11 1234       /system/b2g/libxul.so
+    fields = line.split(None, 5)
+    if len(fields) < 6 or "x" not in fields[1]:
+      continue
+    (start, _, end) = fields[0].partition("-")
+    libs.append({"start": int(start, 16), "end": int(end, 16),
+                 "offset": int(fields[2], 16), "name": fields[5].strip(),
+                 "breakpadId": ""})
+  return libs
+
+def LookupAddress(libs, address):
+  """Prints the symbol for address in one of libs (a Libraries)."""
+  lib = libs.Lookup(address)
+  if lib:
+    lib.Locate()
+    print("Address 0x%08x maps to symbol '%s'" % (address, lib.AddressToSymbol(address)))
+  else:
+    print("Address 0x%08x not found in a library" % address)
+
+def LookupInSymbolIndex(breakpad_id, lib_address):
+  """Prints the function containing lib_address, an address relative to the
+  start of the library with the given breakpad ID, using the library's
+  symbol index alone."""
+  index = SymbolIndex.Load(breakpad_id)
+  if index is None:
+    print "No symbol index for breakpad ID " + breakpad_id + "; symbolicate a profile using the library first"
+    sys.exit(1)
+  # The address is from a stack frame; see fixupAddress.
+  sym = index.Lookup(max(0, (lib_address & ~1) - 1))
+  print("Address 0x%08x in %s maps to symbol '%s'" % (lib_address, breakpad_id, sym))
 
 ###############################################################################
 #
@@ -414,25 +2034,69 @@ class Libraries:
 ###############################################################################
 
 def main():
-  parser = argparse.ArgumentParser(description="Symbolicate Gecko Profiler file")
-  parser.add_argument("filename", help="profile file from phone")
+  global gAllowMismatchedSymbols, gCacheDir, gInlines, gSymbolCacheSize, gUseToolchain
+  parser = argparse.ArgumentParser(description="Symbolicate Gecko Profiler files")
+  parser.add_argument("filenames", metavar="filename", nargs="*",
+                      help="profile file from phone. Libraries shared by several profiles are only resolved once")
   parser.add_argument("--dump-libs", help="Dump library information", action="store_true")
   parser.add_argument("--dump-syms", help="Dump symbol information", action="store_true")
   parser.add_argument("--no-progress", help="Turn off progress messages", action="store_true")
   parser.add_argument("-l", "--lookup", help="lookup a single address")
-  parser.add_argument("-o", "--output", help="specify the name of the output file")
+  parser.add_argument("--maps", metavar="FILE",
+                      help="With --lookup, take the libraries from FILE, in /proc/<pid>/maps form or as a profile's JSON \"libs\" list, rather than from a profile")
+  parser.add_argument("--breakpad-id",
+                      help="With --lookup, look up an address relative to the start of the library with this breakpad ID, using the symbol index built by an earlier run")
+  parser.add_argument("-o", "--output", help="specify the name of the output file (only with a single profile)")
   parser.add_argument("-v", "--verbose", help="increase output verbosity", action="store_true")
   parser.add_argument("-s", "--symbols-path", metavar="symbols path", help="Path to symbols directory")
+  parser.add_argument("--allow-mismatched-symbols", help="When the symbols path has no symbols for a library's breakpad ID, but has them for exactly one other build of the library, use those", action="store_true")
+  parser.add_argument("--cache-dir", help="Directory for persistent symbol indexes and caches (default: %(default)s)", default=gCacheDir)
+  parser.add_argument("--symbol-cache-size", type=int, default=gSymbolCacheSize,
+                      help="Most symbols to cache for each library between runs, 0 to disable the cache (default: %(default)s)")
+  parser.add_argument("-j", "--jobs", type=int, default=1,
+                      help="Number of libraries to resolve concurrently (default: %(default)s)")
+  parser.add_argument("--remote-jobs", type=int, default=4,
+                      help="Number of concurrent requests to a symbolapi server (default: %(default)s)")
+  parser.add_argument("--chunk-size", type=int, default=2048,
+                      help="Number of addresses in each request to a symbolapi server (default: %(default)s)")
+  parser.add_argument("--serve", metavar="[HOST:]PORT",
+                      help="Serve symbolication requests over HTTP, for the libraries in the given profiles and any others asked for")
+  parser.add_argument("--stream", help="Scan the profile incrementally instead of loading it, keeping memory use bounded on large profiles", action="store_true")
+  parser.add_argument("--no-symbol-index", help="Don't use or build persistent symbol indexes; always look addresses up in the libraries", action="store_true")
+  parser.add_argument("--summary", metavar="N", type=int,
+                      help="Print the top N functions and libraries of each thread by self and total samples")
+  parser.add_argument("--diff", metavar="N", type=int,
+                      help="Given a base and a new profile, print the N functions of each thread whose share of samples changed the most between them. The profiles are always streamed, as with --stream")
+  parser.add_argument("--folded", help="Also write the stacks of each profile to <filename>.folded, in the folded format read by flame graph tools", action="store_true")
+  parser.add_argument("--inlines", help="Name the functions inlined at each address, as \"inner [inlined into outer]\", rather than only the function they were inlined into", action="store_true")
+  parser.add_argument("--use-toolchain", help="Run the toolchain's nm and addr2line instead of reading the libraries in-process", action="store_true")
   args = parser.parse_args(sys.argv[1:])
   verbose = args.verbose
   progress = not args.no_progress
+  gCacheDir = args.cache_dir
+  gSymbolCacheSize = args.symbol_cache_size
+  gUseToolchain = args.use_toolchain
+  gInlines = args.inlines
+  gAllowMismatchedSymbols = args.allow_mismatched_symbols
+  if (args.maps or args.breakpad_id) and not args.lookup:
+    parser.error("--maps and --breakpad-id can only be used with --lookup")
+  if not args.filenames and not args.serve and not (args.lookup and (args.maps or args.breakpad_id)):
+    parser.error("a profile filename is required")
+  if args.output and len(args.filenames) > 1:
+    parser.error("--output can only be used with a single profile")
+  if args.diff and len(args.filenames) != 2:
+    parser.error("--diff needs exactly two profiles")
+
+  if args.lookup and args.breakpad_id:
+    LookupInSymbolIndex(args.breakpad_id, int(args.lookup, 0))
+    return
 
   if not args.symbols_path:
     if "GECKO_OBJDIR" not in os.environ:
       print "'GECKO_OBJDIR' needs to be defined in the environment"
       sys.exit(1)
 
-    if get_tools_prefix() is None:
+    if args.use_toolchain and get_tools_prefix() is None:
       print "'{GECKO|TARGET}_TOOLS_PREFIX' needs to be defined in the environment"
       sys.exit(1)
 
@@ -446,7 +2110,7 @@ def main():
 
 
   if verbose:
-    print "Filename =", args.filename
+    print "Filenames =", " ".join(args.filenames)
     print_var("GECKO_OBJDIR")
     if "GECKO_TOOLS_PREFIX" in os.environ:
       print_var("GECKO_TOOLS_PREFIX")
@@ -454,42 +2118,128 @@ def main():
       print_var("TARGET_TOOLS_PREFIX")
     print_var("PRODUCT_OUT")
 
-  # Read in the JSON file created by the profiler.
-  if progress:
-    print "Reading profiler file", args.filename, "..."
-  profile = json.load(open(args.filename, "rb"))
-
-  libs = Libraries(profile, verbose, args.symbols_path)
-  if args.dump_libs:
-    libs.Dump()
+  if args.serve:
+    (host, _, port) = args.serve.rpartition(":")
+    server = SymbolicationServer((host or "localhost", int(port)),
+                                 verbose=verbose, symbols_path=args.symbols_path,
+                                 use_symbol_index=not args.no_symbol_index)
+    for filename in args.filenames:
+      with open(filename, "rb") as f:
+        (lib_list, _) = ScanProfile(f, collect_addresses=False)
+      if lib_list is None:
+        print "No libraries found in", filename
+        sys.exit(1)
+      server.AddLibraries(Libraries({"libs": lib_list}, verbose, args.symbols_path,
+                                    use_symbol_index=not args.no_symbol_index))
+    if progress:
+      print "Serving symbolication requests on http://%s:%d/" % server.server_address
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    Addr2line.CloseAll()
+    elf_symbolizer.ElfSymbolizer.close_all()
+    return
 
   if args.lookup:
-    address_str = args.lookup
-    address = int(address_str, 0)
-    lib = libs.Lookup(address)
-    if lib:
-      lib.Locate()
-      print("Address 0x%08x maps to symbol '%s'" % (address, lib.AddressToSymbol(address_str)))
+    if args.maps:
+      with open(args.maps, "rb") as f:
+        lib_list = json.dumps(ReadLibraryList(f))
     else:
-      print("Address 0x%08x not found in a library" % address)
-  else:
-    libs.SearchUnresolvedAddresses(progress=progress)
-    libs.ResolveSymbols(progress=progress)
+      # We only need the libraries, which come before the samples.
+      with open(args.filenames[0], "rb") as f:
+        (lib_list, _) = ScanProfile(f, collect_addresses=False)
+      if lib_list is None:
+        print "No libraries found in", args.filenames[0]
+        sys.exit(1)
+    libs = Libraries({"libs": lib_list}, verbose, args.symbols_path,
+                     use_symbol_index=not args.no_symbol_index)
+    if args.dump_libs:
+      libs.Dump()
+    LookupAddress(libs, int(args.lookup, 0))
+    Addr2line.CloseAll()
+    elf_symbolizer.ElfSymbolizer.close_all()
+    return
+
+  # Read in the JSON files created by the profiler, collecting the addresses
+  # in each of them. --diff holds on to two profiles' worth of stacks, so it
+  # always streams them rather than decoding both profiles whole.
+  stream = args.stream or args.diff
+  profiles = []
+  for filename in args.filenames:
+    if progress:
+      print "Reading profiler file", filename, "..."
+    if stream:
+      with open(filename, "rb") as f:
+        (lib_list, addresses) = ScanProfile(f)
+      if lib_list is None:
+        print "No libraries found in", filename
+        sys.exit(1)
+      libs = Libraries({"libs": lib_list}, verbose, args.symbols_path,
+                       use_symbol_index=not args.no_symbol_index)
+      libs.AddUnresolvedAddresses(addresses)
+      del addresses
+      if args.summary or args.diff or args.folded:
+        with open(filename, "rb") as f:
+          libs.thread_stacks = StreamThreadStacks(f)
+    else:
+      profile = json.load(open(filename, "rb"))
+      libs = Libraries(profile, verbose, args.symbols_path,
+                       use_symbol_index=not args.no_symbol_index)
+      libs.SearchUnresolvedAddresses(progress=progress)
+      if args.summary or args.diff or args.folded:
+        libs.thread_stacks = ThreadStacks(profile)
+      # We copy the profile text straight from the file when writing the
+      # results, so there's no need to keep the decoded profile around.
+      libs.profile = None
+      del profile
+    if args.dump_libs:
+      libs.Dump()
+    profiles.append((filename, libs))
+
+  ResolveSymbolsForProfiles([libs for (filename, libs) in profiles],
+                            progress=progress, jobs=args.jobs,
+                            remote_jobs=args.remote_jobs,
+                            chunk_size=args.chunk_size)
+  Addr2line.CloseAll()
+  elf_symbolizer.ElfSymbolizer.close_all()
+  symbolication_tables = []
+  for (filename, libs) in profiles:
+    symbolication_table = libs.SymbolicationTable()
+    symbolication_tables.append(symbolication_table)
+    if args.summary:
+      if len(profiles) > 1:
+        print filename + ":"
+      PrintSummary(libs.thread_stacks, symbolication_table, args.summary)
+    if args.folded:
+      folded_filename = filename + ".folded"
+      if progress:
+        print "Writing folded stacks to", folded_filename, "..."
+      with open(folded_filename, "wb") as outfile:
+        WriteFoldedStacks(outfile, libs.thread_stacks, symbolication_table)
     if args.dump_syms:
+      if len(profiles) > 1:
+        print filename + ":"
       libs.DumpSymbols()
+      continue
+    if args.output:
+      sym_filename = args.output
     else:
-      sym_profile = {"format": "profileJSONWithSymbolicationTable,1",
-                     "profileJSON": profile,
-                     "symbolicationTable": libs.SymbolicationTable()}
-      if args.output:
-        sym_filename = args.output
-      else:
-        sym_filename = args.filename + ".syms"
-      if progress:
-        print "Writing symbolicated results to", sym_filename, "..."
-      json.dump(sym_profile, open(sym_filename, "wb"))
-      if progress:
-        print "Done"
+      sym_filename = filename + ".syms"
+    if progress:
+      print "Writing symbolicated results to", sym_filename, "..."
+    with open(filename, "rb") as profile_file:
+      with open(sym_filename, "wb") as outfile:
+        WriteSymbolicatedProfile(outfile, profile_file, symbolication_table)
+  if args.diff:
+    PrintDiff(profiles[0][1].thread_stacks, symbolication_tables[0],
+              profiles[1][1].thread_stacks, symbolication_tables[1], args.diff)
+  if progress and not args.dump_syms:
+    print "Done"
 
 if __name__ == "__main__":
-  main()
+  try:
+    main()
+  except LocateError as e:
+    print e
+    sys.exit(1)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# Tests for profile-symbolicate.py. Run them from this directory with
+#
+#   python -m unittest discover -p 'test_*.py'
+
+import BaseHTTPServer, imp, json, os.path, SocketServer, threading, unittest
+
+profile_symbolicate = imp.load_source(
+  "profile_symbolicate",
+  os.path.join(os.path.dirname(os.path.abspath(__file__)), "profile-symbolicate.py"))
+SymbolapiClient = profile_symbolicate.SymbolapiClient
+
+class FakeSymbolapiHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Answers symbolication requests the way a symbolapi server would, naming
+  each address after itself and the library it's in. Address 0 is never
+  found."""
+  protocol_version = "HTTP/1.1"
+
+  def do_POST(self):
+    server = self.server
+    request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+    with server.lock:
+      server.requests.append(request)
+      fail = server.failures > 0
+      server.failures -= 1
+    if fail and server.drop:
+      # Hang up without answering, as a restarting server would.
+      self.close_connection = 1
+      return
+    if fail:
+      self.send_response(503)
+      self.send_header("Content-Length", "0")
+      self.end_headers()
+      return
+    memory_map = request["memoryMap"]
+    syms = []
+    for (index, address) in request["stacks"][0]:
+      lib = memory_map[index][0]
+      if address:
+        syms.append("sym_%x (in %s)" % (address, lib))
+      else:
+        syms.append("0x%x (in %s)" % (address, lib))
+    body = json.dumps([syms])
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class FakeSymbolapiServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+class SymbolapiClientTest(unittest.TestCase):
+  memory_map = [["libxul.so", "ABCDEF0"], ["libc.so", "1234560"]]
+
+  def setUp(self):
+    self.server = FakeSymbolapiServer(("127.0.0.1", 0), FakeSymbolapiHandler)
+    self.server.lock = threading.Lock()
+    self.server.requests = []
+    self.server.failures = 0
+    self.server.drop = False
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.start()
+    self.url = "http://127.0.0.1:%d/" % self.server.server_port
+
+  def tearDown(self):
+    self.server.shutdown()
+    self.thread.join()
+    self.server.server_close()
+
+  def frames(self, count):
+    return [(i % 2, 0x1000 + i) for i in range(count)]
+
+  def expected(self, frames):
+    return ["sym_%x (in %s)" % (address, self.memory_map[index][0])
+            for (index, address) in frames]
+
+  def testChunks(self):
+    frames = self.frames(10)
+    client = SymbolapiClient(self.url, jobs=2, chunk_size=3)
+    self.assertEqual(client.Symbolicate(self.memory_map, frames),
+                     self.expected(frames))
+    sizes = sorted(len(request["stacks"][0]) for request in self.server.requests)
+    self.assertEqual(sizes, [1, 3, 3, 3])
+    for request in self.server.requests:
+      self.assertEqual(request["version"], 3)
+      self.assertEqual(request["memoryMap"], self.memory_map)
+
+  def testOneChunk(self):
+    frames = self.frames(10)
+    client = SymbolapiClient(self.url, jobs=1, chunk_size=2048)
+    self.assertEqual(client.Symbolicate(self.memory_map, frames),
+                     self.expected(frames))
+    self.assertEqual(len(self.server.requests), 1)
+
+  def testRetryServerError(self):
+    self.server.failures = 2
+    frames = self.frames(4)
+    client = SymbolapiClient(self.url, jobs=1, chunk_size=2, retries=3)
+    self.assertEqual(client.Symbolicate(self.memory_map, frames),
+                     self.expected(frames))
+    self.assertEqual(len(self.server.requests), 4)
+
+  def testRetryDroppedConnection(self):
+    self.server.failures = 1
+    self.server.drop = True
+    frames = self.frames(4)
+    client = SymbolapiClient(self.url, jobs=1, chunk_size=4, retries=2)
+    self.assertEqual(client.Symbolicate(self.memory_map, frames),
+                     self.expected(frames))
+    self.assertEqual(len(self.server.requests), 2)
+
+  def testGiveUp(self):
+    self.server.failures = 3
+    client = SymbolapiClient(self.url, jobs=1, retries=3)
+    self.assertRaises(Exception, client.Symbolicate, self.memory_map, self.frames(4))
+    self.assertEqual(len(self.server.requests), 3)
+
+  def testUnresolved(self):
+    frames = [(0, 0), (0, 0x1000)]
+    client = SymbolapiClient(self.url)
+    syms = client.Symbolicate(self.memory_map, frames)
+    self.assertEqual([SymbolapiClient.IsUnresolved(sym) for sym in syms],
+                     [True, False])
+
+  def testIsUnresolved(self):
+    for sym in ["0x1234", "0x1234 (in libxul.so)", "??", "?? (in libxul.so)",
+                "Unknown", "Unknown (in libc.so)", ""]:
+      self.assertTrue(SymbolapiClient.IsUnresolved(sym), sym)
+    for sym in ["main", "main (in b2g)", "mozilla::dom::Foo() (in libxul.so)",
+                "f(int (*)(int)) (in libxul.so)"]:
+      self.assertFalse(SymbolapiClient.IsUnresolved(sym), sym)
+
+if __name__ == "__main__":
+  unittest.main()
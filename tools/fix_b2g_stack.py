@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 
-"""This script uses addr2line (part of binutils) to post-process the entries
-produced by NS_FormatCodeAddress().
+"""This script post-processes the entries produced by NS_FormatCodeAddress(),
+reading the libraries' symbol tables and line number information itself (or,
+with --use-toolchain, running addr2line, part of binutils).
 
 This is an analog to fix_linux_stack.py and is functionally similar to
 $B2G_ROOT/scripts/profile-symbolicate.py.
 
+It handles DMD's reports in both text and JSON formats.
+
+Run it with --warm after a build to store the symbol tables of libxul.so, b2g
+and plugin-container in its cache ahead of time.
+
 """
 
 from __future__ import print_function
@@ -20,15 +26,25 @@ import os
 import re
 import subprocess
 import itertools
+import json
 import argparse
+import array
+import copy
+import cPickle
+import multiprocessing
 import platform
+import tempfile
 import textwrap
+import sqlite3
 import threading
-import cPickle as pickle
-import fcntl
+import zlib
 from os.path import dirname
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from gzip import GzipFile
+from multiprocessing.pool import ThreadPool
+
+import include.demangler as demangler
+import include.elf_symbolizer as elf_symbolizer
 
 
 def first(pred, itr):
@@ -45,33 +61,6 @@ def first(pred, itr):
         return None
 
 
-def pump(dst, src):
-    """Pump the file dst into the file src.  When src hits EOF, close dst.
-
-    Returns a thread object, so you can e.g. join() on the result.
-
-    """
-    class Pumper(threading.Thread):
-        def run(self):
-            while True:
-                bytes = src.read(4096)
-                if not bytes:
-                    break
-                dst.write(bytes)
-            dst.close()
-    p = Pumper()
-    p.start()
-    return p
-
-
-def _none_factory():
-    return None
-
-
-def _defaultdict_none_factory():
-    return defaultdict(_none_factory)
-
-
 class FixB2GStacksOptions(object):
     """Encapsulates arguments used in fix_b2g_stacks_in_file.
 
@@ -101,7 +90,15 @@ class FixB2GStacksOptions(object):
         not specified, we raise an exception.
 
       * remove_cache: If true, delete fix_b2g_stack.py's persistent
-        addr2line cache when we start running fix_b2g_stacks_in_file.
+        addr2line cache, and the pickled cache older versions kept, when we
+        start running fix_b2g_stacks_in_file.
+
+      * use_toolchain: If true, run the cross-toolchain's nm and addr2line
+        instead of reading the libraries in-process.  Without it, we don't
+        need a toolchain at all.
+
+      * jobs: How many libraries to look up at once, and how many files
+        fix_b2g_stacks_in_files fixes at once.  Default: 1.
 
     In addition, this class defines two additional properties on itself based
     on the parameters received in __init__.
@@ -110,7 +107,8 @@ class FixB2GStacksOptions(object):
 
       * cross_bin(bin_name): Returns a path to the given cross-toolchain
         program.  For example, cross_bin('nm') returns a path to the
-        cross-toolchain's nm binary.
+        cross-toolchain's nm binary.  If we have no toolchain, returns
+        bin_name, so that the host's program gets run.
 
     """
     def __init__(self, args):
@@ -135,8 +133,15 @@ class FixB2GStacksOptions(object):
             return default
 
         self.toolchain_prefix = get_arg('toolchain_prefix', 'arm-linux-androideabi-')
-        self.toolchain_dir = get_arg('toolchain_dir', self._guess_toolchain_dir)
+        self.use_toolchain = get_arg('use_toolchain', False)
+        try:
+            self.toolchain_dir = get_arg('toolchain_dir', self._guess_toolchain_dir)
+        except Exception:
+            if self.use_toolchain:
+                raise
+            self.toolchain_dir = None
         self.remove_cache = get_arg('remove_cache', False)
+        self.jobs = get_arg('jobs', 1)
 
         self.gecko_objdir = get_arg(
             'gecko_objdir', os.path.join(dirname(__file__), '../objdir-gecko'))
@@ -152,6 +157,8 @@ class FixB2GStacksOptions(object):
         self.lib_search_dirs = [self.gecko_objdir, product_dir]
 
     def cross_bin(self, bin_name):
+        if self.toolchain_dir is None:
+            return bin_name
         return os.path.join(self.toolchain_dir, self.toolchain_prefix + bin_name)
 
     @staticmethod
@@ -190,102 +197,166 @@ class FixB2GStacksOptions(object):
 
 
 class StackFixerCache():
-    """A cache for StackFixer which occasionally serializes itself to disk.
+    """A cache for StackFixer, kept on disk in an sqlite database.
 
     This cache stores (lib, offset) --> string mappings, so we can avoid
-    calling addr2line.  After every so many puts, we write the cache out to
-    disk.
+    looking frames up again.  It can also hold a lib's whole symbol table,
+    demangled, and the line tables and inlined functions of each of its
+    compilation units, which warm_cache() computes ahead of time.  We only
+    ever read the entries we're asked for, and after every so many puts, we
+    write out just the entries added since the last write, so neither gets
+    slower as the cache grows.
 
     Please be kind and call flush() on this object when you're done with it.
-    That gives us one last chance to write our cache out to disk.
+    That gives us one last chance to write our new entries out to disk.
+
+    The first time we use a library's entries, we check that its size, mtime,
+    and ctime haven't changed since we stored them.  If they have, we throw
+    out its entries.
 
-    When the cache is read in from disk, we check that the libraries' sizes,
-    mtimes, and ctimes haven't changed.  If they have, we throw out the cached
-    mappings.
+    We also keep which copy of a lib StackFixer chose, so it needn't look
+    for the libs again on every run, and the listing of each directory it
+    searches for libs, for when it has to.
 
-    In theory you can safely access this cache from multiple processes, because
-    we use fcntl locking on the cache file.  (We never block on acquiring a
-    lock on the cache file; if we can't immediately access the file, we simply
-    give up.) But note that I have not tested that this locking works as
-    intended.
+    The cache may be shared by several threads, and several processes may use
+    the cache file at once, since sqlite locks it for us.  If another process
+    holds the lock for too long, or the file can't be used at all, we simply
+    carry on without the entries we couldn't read or write.
 
     """
+    # How long to wait for another process to unlock the cache file, in
+    # seconds.
+    _timeout = 10
+
+    # The most entries we read in one query.
+    _read_batch_size = 500
+
+    # Bump this when the lookups or symbols we store change meaning, so that
+    # we drop the stale ones.  Version 1 lookups have their function names
+    # demangled; version 2 lookups and symbols name functions as addr2line
+    # does.
+    _version = 2
+
     def __init__(self, options):
+        self._lock = threading.Lock()
         self._initialized = False
-        self._lib_lookups = None
-        self._lib_metadata = None
-        self._put_counter = 0
-
-        # Write the cache file after this many puts.
+        self._db = None
+        # The database ID of each lib_path we've used, or None if we can't
+        # store its entries.
+        self._lib_ids = {}
+        # The entries we've read or put so far, and those we haven't written
+        # out yet, as (lib ID, offset, result) tuples.
+        self._lib_lookups = defaultdict(dict)
+        self._pending = []
+
+        # Write the new entries out after this many puts.
         self._write_cache_after_puts = 500
 
     def _ensure_initialized(self):
         if self._initialized:
             return
-        cache = self._read_cache_from_disk()
-        if cache:
-            self._lib_lookups = cache['lookups']
-            self._lib_metadata = cache['metadata']
-            self._validate_lib_metadata()
-        else:
-            self._lib_lookups = defaultdict(_defaultdict_none_factory)
-            self._lib_metadata = {}
         self._initialized = True
+        # Nothing reads the pickled cache we used to keep any more, and it can
+        # be big, so don't leave it lying around.
+        try:
+            os.remove(StackFixerCache.legacy_cache_filename())
+        except OSError:
+            pass
+        try:
+            db = sqlite3.connect(StackFixerCache.cache_filename(),
+                                 timeout=self._timeout,
+                                 check_same_thread=False)
+            db.text_factory = str
+            with db:
+                (version,) = db.execute('PRAGMA user_version').fetchone()
+                if version != self._version:
+                    db.execute('DROP TABLE IF EXISTS lookups')
+                    db.execute('DROP TABLE IF EXISTS symbol_tables')
+                    db.execute('DROP TABLE IF EXISTS unit_data')
+                    db.execute('PRAGMA user_version = %d' % self._version)
+                db.execute('CREATE TABLE IF NOT EXISTS libs ('
+                           'id INTEGER PRIMARY KEY, path TEXT UNIQUE, '
+                           'size INTEGER, mtime REAL, ctime REAL)')
+                db.execute('CREATE TABLE IF NOT EXISTS lookups ('
+                           'lib INTEGER, offset INTEGER, result TEXT, '
+                           'PRIMARY KEY (lib, offset))')
+                db.execute('CREATE TABLE IF NOT EXISTS lib_dirs ('
+                           'path TEXT PRIMARY KEY, mtime REAL, '
+                           'subdirs TEXT, libs TEXT)')
+                db.execute('CREATE TABLE IF NOT EXISTS lib_choices ('
+                           'lib TEXT PRIMARY KEY, candidates TEXT, path TEXT)')
+                db.execute('CREATE TABLE IF NOT EXISTS symbol_tables ('
+                           'lib INTEGER PRIMARY KEY, addresses BLOB, '
+                           'sizes BLOB, names BLOB)')
+                db.execute('CREATE TABLE IF NOT EXISTS unit_data ('
+                           'lib INTEGER, unit INTEGER, data BLOB, '
+                           'PRIMARY KEY (lib, unit))')
+            self._db = db
+        except sqlite3.Error:
+            pass
 
     @staticmethod
     def cache_filename():
         """Get the filename of our cache."""
-        return os.path.join(dirname(__file__), '.fix_b2g_stack.cache')
+        return os.path.join(dirname(__file__), '.fix_b2g_stack.sqlite')
 
     @staticmethod
-    def _read_cache_from_disk():
-        try:
-            with open(StackFixerCache.cache_filename(), 'rb') as cache_file:
-                try:
-                    fcntl.lockf(cache_file.fileno(), fcntl.LOCK_SH | fcntl.LOCK_NB)
-                    return pickle.load(cache_file)
-                finally:
-                    try:
-                        fcntl.lockf(cache_file.fileno(), fcntl.LOCK_UN)
-                    except IOError:
-                        pass
-        except (EOFError, IOError, pickle.PickleError) as e:
-            pass
-        return None
+    def legacy_cache_filename():
+        """Get the filename of the pickled cache we used to keep."""
+        return os.path.join(dirname(__file__), '.fix_b2g_stack.cache')
 
     def flush(self):
-        if self._put_counter:
-            self._write_cache_to_disk()
-
-    def _write_cache_to_disk(self):
+        with self._lock:
+            self._write_pending()
+
+    def _write_pending(self):
+        pending = self._pending
+        # Forget the entries even if the write below fails; if this write
+        # failed, it's likely that our next write will fail too, and we don't
+        # want to waste our time writing and failing over and over again.
+        self._pending = []
+        if not pending or not self._db:
+            return
         try:
-            with open(StackFixerCache.cache_filename(), 'wb') as cache_file:
-                try:
-                    fcntl.lockf(cache_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-                    pickle.dump({'lookups': self._lib_lookups,
-                                 'metadata': self._lib_metadata},
-                                cache_file,
-                                pickle.HIGHEST_PROTOCOL)
-                    self._put_counter = 0
-                    return True
-                finally:
-                    try:
-                        fcntl.lockf(cache_file.fileno(), fcntl.LOCK_UN)
-                    except IOError:
-                        pass
-        except IOError, pickle.PickleError:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO lookups '
+                                     '(lib, offset, result) VALUES (?, ?, ?)',
+                                     pending)
+        except sqlite3.Error:
             pass
-        return False
 
-    def _validate_lib_metadata(self):
-        for (lib_path, cached_metadata) in self._lib_metadata.items():
-            real_metadata = self._get_lib_metadata(lib_path)
-            if real_metadata != cached_metadata or not real_metadata:
-                self._lib_metadata[lib_path] = real_metadata
-                try:
-                    del self._lib_lookups[lib_path]
-                except KeyError:
-                    pass
+    def _lib_id(self, lib_path):
+        """Get lib_path's ID in the database, checking its metadata and
+        throwing out its entries if the lib has changed.  Returns None if we
+        can't store entries for lib_path."""
+        if lib_path in self._lib_ids:
+            return self._lib_ids[lib_path]
+        lib_id = None
+        metadata = self._get_lib_metadata(lib_path)
+        if metadata and self._db:
+            try:
+                with self._db:
+                    self._db.execute('INSERT OR IGNORE INTO libs '
+                                     '(path, size, mtime, ctime) '
+                                     'VALUES (?, ?, ?, ?)', metadata)
+                    row = self._db.execute('SELECT id, size, mtime, ctime '
+                                           'FROM libs WHERE path = ?',
+                                           metadata[:1]).fetchone()
+                    lib_id = row[0]
+                    if row[1:] != metadata[1:]:
+                        self._db.execute('DELETE FROM lookups WHERE lib = ?',
+                                         (lib_id,))
+                        self._db.execute('DELETE FROM symbol_tables '
+                                         'WHERE lib = ?', (lib_id,))
+                        self._db.execute('DELETE FROM unit_data '
+                                         'WHERE lib = ?', (lib_id,))
+                        self._db.execute('UPDATE libs SET size = ?, mtime = ?, '
+                                         'ctime = ? WHERE id = ?',
+                                         metadata[1:] + (lib_id,))
+            except sqlite3.Error:
+                lib_id = None
+        self._lib_ids[lib_path] = lib_id
+        return lib_id
 
     @staticmethod
     def _get_lib_metadata(lib_path):
@@ -296,45 +367,248 @@ class StackFixerCache():
         except:
             return None
 
+    def _read(self, lib_path, offsets):
+        """Read the entries for the given offsets into lib_path which we
+        haven't read yet."""
+        lookups = self._lib_lookups[lib_path]
+        offsets = [offset for offset in offsets if offset not in lookups]
+        for offset in offsets:
+            lookups[offset] = None
+        lib_id = self._lib_id(lib_path)
+        if lib_id is None:
+            return
+        try:
+            for i in range(0, len(offsets), self._read_batch_size):
+                batch = offsets[i:i + self._read_batch_size]
+                lookups.update(self._db.execute(
+                    'SELECT offset, result FROM lookups '
+                    'WHERE lib = ? AND offset IN (%s)' % ','.join('?' * len(batch)),
+                    [lib_id] + batch))
+        except sqlite3.Error:
+            pass
+
     def get(self, lib_path, offset):
-        self._ensure_initialized()
-        return self._lib_lookups[lib_path][offset]
+        with self._lock:
+            self._ensure_initialized()
+            self._read(lib_path, [offset])
+            return self._lib_lookups[lib_path][offset]
+
+    def get_many(self, lib_path, offsets):
+        """Get the results for many offsets into lib_path at once, as a dict
+        holding those of the offsets we have results for."""
+        with self._lock:
+            self._ensure_initialized()
+            self._read(lib_path, offsets)
+            lookups = self._lib_lookups[lib_path]
+            return dict((offset, lookups[offset]) for offset in offsets
+                        if lookups[offset])
 
     def put(self, lib_path, offset, result):
-        self._ensure_initialized()
-        if lib_path not in self._lib_metadata:
-            self._lib_metadata[lib_path] = self._get_lib_metadata(lib_path)
-        self._lib_lookups[lib_path][offset] = result
+        self.update(lib_path, [(offset, result)])
+
+    def update(self, lib_path, results):
+        """Put many (offset, result) pairs for lib_path at once."""
+        with self._lock:
+            self._ensure_initialized()
+            lib_id = self._lib_id(lib_path)
+            lookups = self._lib_lookups[lib_path]
+            for (offset, result) in results:
+                lookups[offset] = result
+                if lib_id is not None:
+                    self._pending.append((lib_id, offset, result))
+            if len(self._pending) >= self._write_cache_after_puts:
+                self._write_pending()
+
+    def get_symbols(self, lib_path):
+        """Get the (addresses, sizes, names) symbol table put_symbols() stored
+        for lib_path, or None if we don't have one for the lib as it is now."""
+        with self._lock:
+            self._ensure_initialized()
+            lib_id = self._lib_id(lib_path)
+            if lib_id is None:
+                return None
+            try:
+                row = self._db.execute('SELECT addresses, sizes, names FROM '
+                                       'symbol_tables WHERE lib = ?',
+                                       (lib_id,)).fetchone()
+            except sqlite3.Error:
+                return None
+        if not row:
+            return None
+        addresses = array.array('L')
+        addresses.fromstring(str(row[0]))
+        sizes = array.array('L')
+        sizes.fromstring(str(row[1]))
+        names = zlib.decompress(str(row[2])).split('\n') if addresses else []
+        return (addresses, sizes, names)
+
+    def put_symbols(self, lib_path, symbols):
+        """Store lib_path's (addresses, sizes, names) symbol table, as
+        ElfSymbolizer.symbols() returns it."""
+        (addresses, sizes, names) = symbols
+        data = (buffer(addresses.tostring()), buffer(sizes.tostring()),
+                buffer(zlib.compress('\n'.join(names))))
+        with self._lock:
+            self._ensure_initialized()
+            lib_id = self._lib_id(lib_path)
+            if lib_id is None:
+                return
+            try:
+                with self._db:
+                    self._db.execute('INSERT OR REPLACE INTO symbol_tables '
+                                     'VALUES (?, ?, ?, ?)', (lib_id,) + data)
+            except sqlite3.Error:
+                pass
+
+    def get_unit_data(self, lib_path, unit):
+        """Get what put_unit_data() stored for the compilation unit at
+        offset unit in lib_path's .debug_info, or None."""
+        with self._lock:
+            self._ensure_initialized()
+            lib_id = self._lib_id(lib_path)
+            if lib_id is None:
+                return None
+            try:
+                row = self._db.execute('SELECT data FROM unit_data '
+                                       'WHERE lib = ? AND unit = ?',
+                                       (lib_id, unit)).fetchone()
+            except sqlite3.Error:
+                return None
+        if not row:
+            return None
+        return cPickle.loads(zlib.decompress(str(row[0])))
+
+    def put_unit_data(self, lib_path, units):
+        """Store many (unit, data) pairs for lib_path at once, where data is
+        what ElfSymbolizer.unit_data(unit) returned, pickled and
+        compressed."""
+        with self._lock:
+            self._ensure_initialized()
+            lib_id = self._lib_id(lib_path)
+            if lib_id is None:
+                return
+            try:
+                with self._db:
+                    self._db.executemany('INSERT OR REPLACE INTO unit_data '
+                                         'VALUES (?, ?, ?)',
+                                         [(lib_id, unit, buffer(data))
+                                          for (unit, data) in units])
+            except sqlite3.Error:
+                pass
+
+    def get_lib_dirs(self):
+        """Get the listings of the directories we've searched for libs, as a
+        dict mapping each directory to its (mtime, subdirs, libs)."""
+        def split(names):
+            return names.split('/') if names else []
+
+        with self._lock:
+            self._ensure_initialized()
+            if not self._db:
+                return {}
+            try:
+                return dict((path, (mtime, split(subdirs), split(libs)))
+                            for (path, mtime, subdirs, libs) in
+                            self._db.execute('SELECT * FROM lib_dirs'))
+            except sqlite3.Error:
+                return {}
+
+    def update_lib_dirs(self, changed, removed):
+        """Store the directory listings in changed (see get_lib_dirs()), and
+        forget the listings of the directories in removed."""
+        with self._lock:
+            self._ensure_initialized()
+            if not self._db:
+                return
+            try:
+                with self._db:
+                    self._db.executemany(
+                        'INSERT OR REPLACE INTO lib_dirs VALUES (?, ?, ?, ?)',
+                        [(path, mtime, '/'.join(subdirs), '/'.join(libs))
+                         for (path, (mtime, subdirs, libs)) in
+                         changed.items()])
+                    self._db.executemany('DELETE FROM lib_dirs WHERE path = ?',
+                                         [(path,) for path in removed])
+            except sqlite3.Error:
+                pass
 
-        self._put_counter += 1
-        if self._put_counter == self._write_cache_after_puts:
-            self._write_cache_to_disk()
+    def get_chosen_lib(self, lib):
+        """Get the path we last chose for lib, or None.  The path is '' if
+        we didn't find lib; see put_lib_choice()."""
+        with self._lock:
+            self._ensure_initialized()
+            if not self._db:
+                return None
+            try:
+                row = self._db.execute('SELECT path FROM lib_choices '
+                                       'WHERE lib = ?', (lib,)).fetchone()
+            except sqlite3.Error:
+                return None
+            return row and row[0]
+
+    def get_lib_choice(self, lib, lib_paths):
+        """Get the path we chose for lib among lib_paths last time, or None if
+        we haven't chosen among these lib_paths, or they've since changed.
+        The path is '' if we didn't find lib; see put_lib_choice()."""
+        with self._lock:
+            self._ensure_initialized()
+            if not self._db:
+                return None
+            try:
+                row = self._db.execute('SELECT candidates, path FROM '
+                                       'lib_choices WHERE lib = ?',
+                                       (lib,)).fetchone()
+            except sqlite3.Error:
+                return None
+            if row and row[0] == self._lib_candidates(lib_paths):
+                return row[1]
+            return None
 
-            # Reset the put counter even if the cache write above fails; if
-            # this write failed, it's likely that our next write will fail too,
-            # and we don't want to waste our time writing and failing over and
-            # over again.
-            self._put_counter = 0
+    def put_lib_choice(self, lib, lib_paths, lib_path):
+        """Store that we chose lib_path for lib among lib_paths.  To store
+        that we didn't find lib, pass the dirs we searched as lib_paths and
+        '' as lib_path."""
+        with self._lock:
+            self._ensure_initialized()
+            if not self._db:
+                return
+            try:
+                with self._db:
+                    self._db.execute('INSERT OR REPLACE INTO lib_choices '
+                                     'VALUES (?, ?, ?)',
+                                     (lib, self._lib_candidates(lib_paths),
+                                      lib_path))
+            except sqlite3.Error:
+                pass
+
+    @staticmethod
+    def _lib_candidates(lib_paths):
+        """Describe lib_paths and their metadata, so we can tell whether our
+        choice among them still holds."""
+        return repr([StackFixerCache._get_lib_metadata(lib_path)
+                     for lib_path in lib_paths])
 
     def get_maybe_set(self, lib_path, offset, result):
         """Get the addr2line result for (lib_path, offset).
 
         If (lib_path, offset) is not in our cache, insert |result()| or
-        |result|, depending on whether |result| is callable.
+        |result|, depending on whether |result| is callable.  We don't hold
+        the cache's lock while calling |result()|, so other threads may use
+        the cache meanwhile.
 
         """
-        self._ensure_initialized()
-        if not self._lib_lookups[lib_path][offset]:
-            if callable(result):
-                self.put(lib_path, offset, result())
-            else:
-                self.put(lib_path, offset, result)
-        return self._lib_lookups[lib_path][offset]
+        cached = self.get(lib_path, offset)
+        if cached:
+            return cached
+        if callable(result):
+            result = result()
+        self.put(lib_path, offset, result)
+        return result
 
 
 class StackFixer(object):
     """An object used for translating (lib, offset) tuples into function+file
-    names, using addr2line and a cache.
+    names, using the libraries' symbols (or addr2line) and a cache.
 
     Here and elsewhere we adopt the convention that |lib| is a library's
     basename (e.g. 'libxul.so'), while lib_path is a relative path from
@@ -344,14 +618,40 @@ class StackFixer(object):
     gives us a chance to flush the cache to disk, making future invocations
     faster.
 
+    A StackFixer may be used by several threads at once.  With the jobs
+    option, resolve() looks frames up in that many worker processes.  We use
+    processes rather than threads since looking frames up in-process is
+    mostly Python code, which threads can't run in parallel.  Create the
+    StackFixer before starting any threads, since starting the workers forks.
+
     """
 
     _addr2line_procs = {}
+    _elf_symbolizers = {}
+
+    # A lock for each lib, held while looking up addresses in it, since its
+    # addr2line process can only answer one thread at a time.
+    _lib_locks = defaultdict(threading.Lock)
+    _lib_locks_lock = threading.Lock()
+
+    # resolve() splits the offsets into each lib into about one chunk per
+    # worker, so that even a single big lib is looked up in parallel, but
+    # doesn't make chunks smaller than this.
+    _MIN_CHUNK_SIZE = 1024
 
     def __init__(self, options):
-        self._lib_path_cache = defaultdict(list)
+        # The path _find_lib() found for each lib, or None if it didn't find
+        # the lib, and every path to each lib under our lib_search_dirs, or
+        # None if we haven't walked them.
+        self._lib_choices = {}
+        self._lib_path_cache = None
+        self._lib_path_lock = threading.Lock()
         self._cache = StackFixerCache(options)
         self._options = options
+        self._pool = None
+        if options.jobs > 1:
+            self._pool = multiprocessing.Pool(options.jobs, _init_worker,
+                                              (options,))
 
     def translate(self, fn_guess, lib, offset):
         """Translate the given offset (an integer) into the given library (e.g.
@@ -363,22 +663,165 @@ class StackFixer(object):
         """
         lib_path = self._find_lib(lib)
         return self._cache.get_maybe_set(lib_path, offset,
-            lambda: self._addr2line(lib, offset, fn_guess))
+            lambda: self._symbolize(lib, [offset], [fn_guess])[0])
+
+    def resolve(self, frames):
+        """Translate many frames ahead of the translate() calls for them.
+
+        frames maps (lib, offset) tuples to a fn_guess (see translate()).  We
+        look the offsets into each lib which aren't in our cache up together,
+        in large batches, rather than one at a time as translate() would.
+
+        """
+        offsets_by_lib = defaultdict(list)
+        for (lib, offset) in frames:
+            offsets_by_lib[lib].append(offset)
+
+        chunks = []
+        for (lib, offsets) in offsets_by_lib.items():
+            lib_path = self._find_lib(lib)
+            cached = self._cache.get_many(lib_path, offsets)
+            offsets = sorted(offset for offset in offsets
+                             if offset not in cached)
+            chunk_size = max(self._MIN_CHUNK_SIZE,
+                             -(-len(offsets) // self._options.jobs))
+            for i in range(0, len(offsets), chunk_size):
+                chunk = offsets[i:i + chunk_size]
+                chunks.append((lib, lib_path, chunk,
+                               [frames[(lib, offset)] for offset in chunk]))
+
+        if self._pool:
+            results = self._pool.map(_symbolize_in_worker, chunks)
+        else:
+            results = [self._symbolize(lib, offsets, fn_guesses)
+                       for (lib, _, offsets, fn_guesses) in chunks]
+        for ((lib, lib_path, offsets, _), chunk_results) in zip(chunks, results):
+            self._cache.update(lib_path, zip(offsets, chunk_results))
+
+    # warm() splits the compilation units of each lib into about this many
+    # chunks per worker.
+    _WARM_CHUNKS_PER_JOB = 4
+
+    def warm(self, libs):
+        """Read the symbol tables of the given libs (e.g. 'libxul.so') and
+        store them, demangled, in our cache, along with what we need from each
+        of the libs' compilation units: their line tables, their inlined
+        functions, and their functions' demangled names.  That way the first
+        frames we look up in a new build of the libs needn't wait for any of
+        it.  Returns the paths of the libs whose symbol tables we stored.
+
+        Finding the libs also caches which copy of each lib we chose, and
+        the listings of our lib_search_dirs if we had to walk them.  With
+        use_toolchain, that's all we do, since addr2line has no use for the
+        symbol tables.
+
+        """
+        lib_paths = [lib_path for lib_path in map(self._find_lib, libs)
+                     if lib_path]
+        if self._options.use_toolchain:
+            return []
+        if self._pool:
+            (pool_map, pool_imap) = (self._pool.map, self._pool.imap)
+        else:
+            (pool_map, pool_imap) = (map, itertools.imap)
+        stored = []
+        chunks = []
+        for (lib_path, read) in zip(lib_paths, pool_map(_read_symbols, lib_paths)):
+            if not read:
+                continue
+            (symbols, units) = read
+            self._cache.put_symbols(lib_path, symbols)
+            stored.append(lib_path)
+            chunk_size = -(-len(units) //
+                           (self._options.jobs * self._WARM_CHUNKS_PER_JOB))
+            for i in range(0, len(units), chunk_size):
+                chunks.append((lib_path, units[i:i + chunk_size]))
+        for (lib_path, unit_data) in pool_imap(_read_unit_data, chunks):
+            self._cache.put_unit_data(lib_path, unit_data)
+        return stored
 
     def close(self):
+        if self._pool:
+            self._pool.close()
+            self._pool.join()
         self._cache.flush()
 
+    @staticmethod
+    def _lib_lock(lib):
+        with StackFixer._lib_locks_lock:
+            return StackFixer._lib_locks[lib]
+
     def _init_lib_path_cache(self):
         """Initialize self._lib_path_cache by walking all of the subdirectories
         of self._options.lib_search_dirs and finding all the '*.so', 'b2g', and
         'plugin-container' files therein.
 
+        Walking a full objdir takes a while, so we keep each directory's
+        listing in our cache, and only list the directories whose mtime has
+        changed since then.
+
         """
-        for root, _, files in itertools.chain(*[os.walk(dir) for dir in
-                                                self._options.lib_search_dirs]):
-            for f in files:
-                if f.endswith('.so') or f == 'b2g' or f == 'plugin-container':
-                    self._lib_path_cache[f].append(os.path.join(root, f))
+        self._lib_path_cache = defaultdict(list)
+        stored = self._cache.get_lib_dirs()
+        visited = set()
+        changed = {}
+        for top in self._options.lib_search_dirs:
+            top = os.path.abspath(top)
+            for (dir, libs) in self._walk_lib_dirs(top, stored, visited,
+                                                   changed):
+                for f in libs:
+                    self._lib_path_cache[f].append(os.path.join(dir, f))
+
+        # Forget the directories under our search dirs which are gone.
+        tops = [os.path.abspath(top) for top in self._options.lib_search_dirs]
+        removed = [dir for dir in stored if dir not in visited and
+                   any(dir == top or dir.startswith(top + os.sep)
+                       for top in tops)]
+        if changed or removed:
+            self._cache.update_lib_dirs(changed, removed)
+
+    @staticmethod
+    def _walk_lib_dirs(top, stored, visited, changed):
+        """Walk top like os.walk(top) does, yielding (dir, libs) for each dir
+        under top, where libs are the names of the libs in dir.
+
+        stored maps dirs to the (mtime, subdirs, libs) we last saw for them.
+        We list only the dirs which aren't in stored or whose mtime has
+        changed, and put their new (mtime, subdirs, libs) in changed.  We add
+        every dir we walk to visited.
+
+        """
+        try:
+            mtime = os.stat(top).st_mtime
+        except OSError:
+            return
+        visited.add(top)
+        entry = stored.get(top)
+        if not entry or entry[0] != mtime:
+            try:
+                names = os.listdir(top)
+            except OSError:
+                return
+            subdirs = []
+            libs = []
+            for name in names:
+                path = os.path.join(top, name)
+                if os.path.isdir(path):
+                    # Like os.walk, don't follow symlinks to directories.
+                    if not os.path.islink(path):
+                        subdirs.append(name)
+                elif (name.endswith('.so') or name == 'b2g' or
+                      name == 'plugin-container'):
+                    libs.append(name)
+            entry = (mtime, subdirs, libs)
+            changed[top] = entry
+
+        (_, subdirs, libs) = entry
+        yield (top, libs)
+        for subdir in subdirs:
+            for result in StackFixer._walk_lib_dirs(os.path.join(top, subdir),
+                                                    stored, visited, changed):
+                yield result
 
     def _find_lib(self, lib):
         """Get a path to the given lib (e.g. 'libxul.so').
@@ -389,28 +832,58 @@ class StackFixer(object):
         If we can't find the lib, we return None.
 
         """
-        if not self._lib_path_cache:
+        with self._lib_path_lock:
+            if lib not in self._lib_choices:
+                self._lib_choices[lib] = self._choose_lib(lib)
+            return self._lib_choices[lib]
+
+    def _choose_lib(self, lib):
+        """Find lib for _find_lib(), which holds our lib path lock."""
+        search_dirs = [os.path.abspath(top)
+                       for top in self._options.lib_search_dirs]
+        if self._lib_path_cache is None:
+            # The copy of the lib we chose last time will do if it's still
+            # there, and spares us walking the search dirs.  So does knowing
+            # that we didn't find the lib, as long as the search dirs
+            # themselves haven't changed since.
+            lib_path = self._cache.get_chosen_lib(lib)
+            if (lib_path and os.path.isfile(lib_path) and
+                    any(lib_path.startswith(top + os.sep)
+                        for top in search_dirs)):
+                return lib_path
+            if self._cache.get_lib_choice(lib, search_dirs) == '':
+                return None
             self._init_lib_path_cache()
 
-        lib_paths = self._lib_path_cache[lib]
+        lib_paths = self._lib_path_cache.get(lib)
         if not lib_paths:
+            self._cache.put_lib_choice(lib, search_dirs, '')
             return None
-        if len(lib_paths) == 1:
-            return lib_paths[0]
-
-        lib_path = first(self._lib_has_symbols, lib_paths)
+        lib_path = self._cache.get_lib_choice(lib, lib_paths)
         if not lib_path:
-            lib_path = self._lib_path_cache[lib][0]
-        self._lib_path_cache[lib] = [lib_path]
+            lib_path = lib_paths[0]
+            if len(lib_paths) > 1:
+                lib_path = first(self._lib_has_symbols, lib_paths) or lib_path
+            self._cache.put_lib_choice(lib, lib_paths, lib_path)
         return lib_path
 
     def _lib_has_symbols(self, lib_path):
         """Check if the given lib_path has symbols.
 
-        We do this by running nm on the library.  If it's stripped, nm will not
-        output anything to stdout.
+        We do this by looking for a symbol table or line number information in
+        the library's section headers.  If we can't read those, we run nm on
+        the library instead.  If it's stripped, nm will not output anything to
+        stdout.
 
         """
+        try:
+            symbolizer = elf_symbolizer.ElfSymbolizer(lib_path)
+            try:
+                return symbolizer.has_symbols()
+            finally:
+                symbolizer.close()
+        except elf_symbolizer.ElfError:
+            pass
         proc = subprocess.Popen(
             [self._options.cross_bin('nm'), lib_path],
             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -421,88 +894,302 @@ class StackFixer(object):
         finally:
             proc.kill()
 
-    def _addr2line(self, lib, offset, fn_guess):
-        """Use addr2line to translate the given lib+offset.
+    @staticmethod
+    def _addr_str(lib, offset):
+        return '(%s+0x%x)' % (lib, offset)
 
-        If addr2line can't resolve a lib+offset, you may still have a guess as
-        to what function lives there.  (For example, NS_StackWalk is sometimes
-        able to resolve function names that addr2line can't.)  fn_guess should
-        be this guess, if you have one.
+    @staticmethod
+    def _fallback_str(lib, offset, fn_guess):
+        _fn_guess = (demangler.demangle(fn_guess) + ' '
+                     if fn_guess and fn_guess != '???' else '')
+        return '%s%s' % (_fn_guess, StackFixer._addr_str(lib, offset))
+
+    def _symbolize(self, lib, offsets, fn_guesses):
+        """Translate the given offsets into lib by reading the lib's symbols
+        ourselves, returning a list of strings.
+
+        We use addr2line instead if we were asked to, or if the lib isn't an
+        ELF file we can read.  See _addr2line for the meaning of fn_guesses.
 
         """
-        def addr_str():
-            return '(%s+0x%x)' % (lib, offset)
+        with self._lib_lock(lib):
+            return self._symbolize_locked(lib, offsets, fn_guesses)
 
-        def fallback_str():
-            _fn_guess = fn_guess + ' ' if fn_guess and fn_guess != '???' else ''
-            return '%s%s' % (_fn_guess, addr_str())
+    def _symbolize_locked(self, lib, offsets, fn_guesses):
+        if lib not in StackFixer._elf_symbolizers:
+            symbolizer = None
+            lib_path = self._find_lib(lib)
+            if lib_path and not self._options.use_toolchain:
+                try:
+                    symbolizer = elf_symbolizer.ElfSymbolizer(lib_path)
+                except elf_symbolizer.ElfError:
+                    pass
+                else:
+                    # Use the symbol table and compilation units warm()
+                    # stored, if there are any.
+                    symbols = self._cache.get_symbols(lib_path)
+                    if symbols:
+                        symbolizer.set_symbols(*symbols)
+                    symbolizer.set_unit_loader(
+                        lambda unit, lib_path=lib_path:
+                            self._cache.get_unit_data(lib_path, unit))
+            StackFixer._elf_symbolizers[lib] = symbolizer
+
+        symbolizer = StackFixer._elf_symbolizers[lib]
+        if not symbolizer:
+            return self._addr2line(lib, offsets, fn_guesses)
+
+        results = []
+        for (offset, fn_guess, (func, file_name, line)) in \
+                zip(offsets, fn_guesses, symbolizer.lookup(offsets)):
+            if not func and not file_name:
+                results.append('%s (no symbols)' %
+                               self._fallback_str(lib, offset, fn_guess))
+                continue
+            # Write what addr2line would for a function with no line.
+            if file_name:
+                file_name = os.path.normpath('%s:%s' % (file_name, line or '?'))
+            results.append('%s %s %s' % (func or '??', file_name or '??:?',
+                                         self._addr_str(lib, offset)))
+        return results
+
+    # The most addresses we write to addr2line before reading its answers.
+    # This keeps what we write well within the pipe's buffer, so that we
+    # can't deadlock with addr2line blocking on writing to us.
+    _ADDR2LINE_BATCH_SIZE = 1024
+
+    def _addr2line(self, lib, offsets, fn_guesses):
+        """Use addr2line to translate the given offsets into lib, returning a
+        list of strings.
+
+        If addr2line can't resolve a lib+offset, you may still have a guess as
+        to what function lives there.  (For example, NS_StackWalk is sometimes
+        able to resolve function names that addr2line can't.)  fn_guesses
+        should hold this guess for each offset, if you have one.
 
+        """
         if lib not in StackFixer._addr2line_procs:
             lib_path = self._find_lib(lib)
             if not lib_path:
-                return "%s (can't find lib)" % fallback_str()
+                return ["%s (can't find lib)" %
+                        self._fallback_str(lib, offset, fn_guess)
+                        for (offset, fn_guess) in zip(offsets, fn_guesses)]
             StackFixer._addr2line_procs[lib] = subprocess.Popen(
                 [self._options.cross_bin('addr2line'), '-Cfe', lib_path],
                 stdin=subprocess.PIPE, stdout=subprocess.PIPE)
 
         proc = StackFixer._addr2line_procs[lib]
+        results = []
         try:
-            proc.stdin.write('0x%x\n' % offset)
-            proc.stdin.flush()
-
-            # addr2line returns two lines for every address we give it.  The
-            # first line is of the form "foo()", and the second line is of the
-            # form "foo.cpp:123".
-            func = proc.stdout.readline().strip()
-            file_name = os.path.normpath(proc.stdout.readline().strip())
-            if func == '??' and file_name == '??:0':
-                # addr2line wasn't helpful here.
-                return '%s (no addr2line)' % fallback_str()
-            return '%s %s %s' % (func, file_name, addr_str())
+            for i in range(0, len(offsets), self._ADDR2LINE_BATCH_SIZE):
+                batch = offsets[i:i + self._ADDR2LINE_BATCH_SIZE]
+                proc.stdin.write(''.join(['0x%x\n' % offset for offset in batch]))
+                proc.stdin.flush()
+
+                # addr2line returns two lines for every address we give it.
+                # The first line is of the form "foo()", and the second line
+                # is of the form "foo.cpp:123".
+                for (offset, fn_guess) in zip(batch, fn_guesses[i:]):
+                    func = proc.stdout.readline().strip()
+                    file_name = os.path.normpath(proc.stdout.readline().strip())
+                    if func == '??' and file_name == '??:0':
+                        # addr2line wasn't helpful here.
+                        results.append('%s (no addr2line)' %
+                                       self._fallback_str(lib, offset, fn_guess))
+                    else:
+                        results.append('%s %s %s' % (func, file_name,
+                                                     self._addr_str(lib, offset)))
         except IOError as e:
             # If our addr2line process dies, don't try to restart it.  Just
             # leave it in a dead state and presumably every time we read/write
             # to/from it, we'll hit this case.
-            return '%s (addr2line exception)' % fallback_str()
+            for (offset, fn_guess) in zip(offsets, fn_guesses)[len(results):]:
+                results.append('%s (addr2line exception)' %
+                               self._fallback_str(lib, offset, fn_guess))
+        return results
+
+
+# The StackFixer of a StackFixer's worker process; see StackFixer.resolve().
+_worker_fixer = None
+
+
+def _init_worker(options):
+    global _worker_fixer
+    options = copy.copy(options)
+    options.jobs = 1
+    _worker_fixer = StackFixer(options)
+
+
+def _symbolize_in_worker((lib, lib_path, offsets, fn_guesses)):
+    # Our parent has already found the lib.
+    _worker_fixer._lib_choices[lib] = lib_path
+    return _worker_fixer._symbolize(lib, offsets, fn_guesses)
 
 
-# Matches lines produced by DMD before bug 1062709 landed.
-old_line_re = re.compile(
-    r'''(\s+)                   # leading whitespace
+def _read_symbols(lib_path):
+    """Return lib_path's symbol table, with its names demangled, and the
+    offsets of its compilation units, or None if we can't read lib_path."""
+    try:
+        symbolizer = elf_symbolizer.ElfSymbolizer(lib_path)
+    except elf_symbolizer.ElfError:
+        return None
+    try:
+        return (symbolizer.symbols(), symbolizer.unit_offsets())
+    finally:
+        symbolizer.close()
+
+
+def _read_unit_data((lib_path, units)):
+    """Return lib_path and a list of (unit, data) for the given compilation
+    units of lib_path, as StackFixerCache.put_unit_data() takes them."""
+    try:
+        symbolizer = elf_symbolizer.ElfSymbolizer(lib_path)
+    except elf_symbolizer.ElfError:
+        return (lib_path, [])
+    try:
+        return (lib_path, [(unit, zlib.compress(cPickle.dumps(
+            symbolizer.unit_data(unit), cPickle.HIGHEST_PROTOCOL)))
+            for unit in units])
+    finally:
+        symbolizer.close()
+
+
+# Matches stack frame lines in either of the formats DMD has produced.
+frame_re = re.compile(
+    r'''# Lines produced by DMD (via NS_FormatCodeAddress()) after bug 1062709
+        # landed.
+        (.*\#\d+:\ )            # anything, then the frame number
+        (.+)                    # either '???' or mangled fn signature
+        \[
+          (.+)                  # library name
+          \ \+(0x[0-9a-fA-F]+)  # offset into lib
+        \]
+        (.*)$                   # anything else
+      |
+        # Lines produced by DMD before bug 1062709 landed.
+        (\s+)                   # leading whitespace
         ([^ ][^\]]*)            # either '???' or mangled fn signature
         \[
           (\S+)                 # library name
           \s+
           \+(0x[0-9a-fA-F]+)    # offset into lib
         \]
-        (\s+0x[0-9a-fA-F]+.*)      # program counter and anything else
+        (\s+0x[0-9a-fA-F]+.*)   # program counter and anything else
         ''',
     re.VERBOSE)
 
-# Matches lines produced by DMD (via NS_FormatCodeAddress()) after bug 1062709
-# landed.
-line_re = re.compile("^(.*#\d+: )(.+)\[(.+) \+(0x[0-9A-Fa-f]+)\](.*)$")
+
+def parse_frame(line):
+    """Return a (before, fn, lib, offset, after) tuple for a stack frame line
+    in either format, or None if the line isn't a stack frame."""
+    # Most lines aren't stack frames.  Every stack frame has an offset, so we
+    # can skip most lines without trying to match frame_re against them.
+    if '+0x' not in line:
+        return None
+    result = frame_re.match(line)
+    if result is None:
+        return None
+    groups = result.groups()
+    if groups[0] is None:
+        # It's in the old stack frame format.
+        groups = groups[5:]
+    (before, fn, lib, offset, after) = groups[:5]
+    return (before, fn, lib, int(offset, 16), after)
+
 
 def fixSymbols(line, fixer):
-    # Try parsing it as if it's the new stack frame format.
-    result = line_re.match(line)
-    if result is not None:
-        (before, fn, lib, offset, after) = result.groups()
-        return before + fixer.translate(fn, lib, int(offset, 16)) + after + '\n'
+    frame = parse_frame(line)
+    if frame is None:
+        return line
+    (before, fn, lib, offset, after) = frame
+    return before + fixer.translate(fn, lib, offset) + after + '\n'
 
-    # Try parsing it as if it's the old stack frame format.
-    result = old_line_re.match(line)
-    if result is not None:
-        (before, fn, lib, offset, after) = result.groups()
-        return before + fixer.translate(fn, lib, int(offset, 16)) + after + '\n'
 
-    return line
+def _options(args, kwargs, caller):
+    if args and kwargs:
+        raise Exception("Can't pass args and kwargs to %s." % caller)
+    options = FixB2GStacksOptions(args if args else kwargs)
+
+    if options.remove_cache:
+        for filename in (StackFixerCache.cache_filename(),
+                         StackFixerCache.cache_filename() + '-journal',
+                         StackFixerCache.legacy_cache_filename()):
+            try:
+                os.remove(filename)
+            except Exception:
+                pass
+    return options
+
+
+def _fix_stacks(infile, outfile, fixer):
+    # DMD's JSON reports start with a '{', while its text reports never do.
+    first_line = infile.readline()
+    if first_line.lstrip().startswith('{'):
+        _fix_json_stacks(first_line + infile.read(), outfile, fixer)
+        return
+    infile = itertools.chain([first_line], infile)
+
+    # We fix the stacks in two passes.  The first finds every distinct frame,
+    # so that the fixer can look them all up a library at a time, and the
+    # second rewrites the lines.  infile may not be seekable, so we keep a
+    # copy of it for the second pass.
+    spool = tempfile.TemporaryFile()
+    frames = {}
+    for line in infile:
+        spool.write(line)
+        frame = parse_frame(line)
+        if frame is not None:
+            (_, fn, lib, offset, _) = frame
+            frames.setdefault((lib, offset), fn)
+    fixer.resolve(frames)
+    del frames
+    spool.seek(0)
+
+    try:
+        for line in spool:
+            outfile.write(fixSymbols(line, fixer))
+    finally:
+        spool.close()
+
+
+def _fix_json_stacks(report, outfile, fixer):
+    """Fix the stacks in a DMD report in JSON format.
+
+    The report lists each distinct stack frame just once, in its frameTable,
+    which the traceTable refers to by key, so we only need to fix the frames
+    in the frameTable.  We leave the rest of the report, including the
+    blockList, as it is.
+
+    """
+    report = json.loads(report, object_pairs_hook=OrderedDict)
+    frame_table = report.get('frameTable', {})
+
+    parsed_frames = {}
+    frames = {}
+    for (key, frame) in frame_table.iteritems():
+        frame = parse_frame(frame.encode('utf-8'))
+        if frame is not None:
+            (_, fn, lib, offset, _) = frame
+            parsed_frames[key] = frame
+            frames.setdefault((lib, offset), fn)
+    fixer.resolve(frames)
+    del frames
+
+    for (key, (before, fn, lib, offset, after)) in parsed_frames.iteritems():
+        frame = before + fixer.translate(fn, lib, offset) + after
+        frame_table[key] = frame.decode('utf-8', 'replace')
+
+    json.dump(report, outfile, separators=(',', ':'))
+    outfile.write('\n')
 
 
 def fix_b2g_stacks_in_file(infile, outfile, args={}, **kwargs):
     """Read lines from infile and output those lines to outfile with their
     stack frames rewritten.
 
+    If infile holds a DMD report in JSON format, we rewrite the frames in its
+    frameTable instead, and output the report as JSON.
+
     infile and outfile may be a files or file-like objects.  For example, to
     read/write from strings, pass StringIO objects.
 
@@ -511,35 +1198,75 @@ def fix_b2g_stacks_in_file(infile, outfile, args={}, **kwargs):
     names.
 
     """
-    if args and kwargs:
-        raise Exception("Can't pass args and kwargs to fix_b2g_stacks_in_file.")
-    options = FixB2GStacksOptions(args if args else kwargs)
+    options = _options(args, kwargs, 'fix_b2g_stacks_in_file')
+    fixer = StackFixer(options)
+    try:
+        _fix_stacks(infile, outfile, fixer)
+    finally:
+        fixer.close()
 
-    if options.remove_cache:
-        try:
-            os.remove(StackFixerCache.cache_filename())
-        except Exception:
-            pass
 
+# The libs warm_cache() prepares, which DMD's stacks are mostly made of.
+_WARM_LIBS = ['libxul.so', 'b2g', 'plugin-container']
+
+
+def warm_cache(args={}, **kwargs):
+    """Prepare our cache for the first run of fix_b2g_stacks_in_file on a new
+    build, e.g. as a post-build step.
+
+    We store the symbol tables and decoded debug information of libxul.so,
+    b2g and plugin-container, as found in the objdirs, along with the
+    objdirs' listings, so that the first run only has to look its frames up.  Returns the paths of the libs whose
+    symbol tables we stored.
+
+    args and kwargs are as for fix_b2g_stacks_in_file.
+
+    """
+    options = _options(args, kwargs, 'warm_cache')
+    fixer = StackFixer(options)
+    try:
+        return fixer.warm(_WARM_LIBS)
+    finally:
+        fixer.close()
+
+
+def open_maybe_gzipped(filename, mode):
+    """Open filename, through GzipFile if its name ends with '.gz'."""
+    if filename.endswith('.gz'):
+        return GzipFile(filename, mode)
+    return open(filename, mode)
+
+
+def fix_b2g_stacks_in_files(filenames, args={}, **kwargs):
+    """Like fix_b2g_stacks_in_file, for each (infile, outfile) pair of
+    filenames in filenames.  Files whose names end with '.gz' are read or
+    written gzipped.
+
+    With the jobs option, we fix that many files at once.  All of the files
+    share one cache, so a frame which appears in several of them is only
+    looked up once.
+
+    """
+    options = _options(args, kwargs, 'fix_b2g_stacks_in_files')
     fixer = StackFixer(options)
 
-    # Filter our output through c++filt.  Pumping on a separate thread is
-    # *much* faster than filtering line-by-line.
-    #
-    # On Mac OS, the native c++filt doesn't filter our output correctly, so we
-    # use the cross-compiled one.  (I don't know if the system c++filt works
-    # properly on Linux, though I imagine it does.)
-    cppfilt = subprocess.Popen([options.cross_bin('c++filt')],
-                               stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE)
+    def fix((infile_name, outfile_name)):
+        with open_maybe_gzipped(outfile_name, 'w') as outfile:
+            with open_maybe_gzipped(infile_name, 'r') as infile:
+                _fix_stacks(infile, outfile, fixer)
+
+    # The files share the fixer, and so its cache and worker processes, so
+    # we only need threads to work on them at once.
+    pool = ThreadPool(options.jobs) if options.jobs > 1 else None
     try:
-        p = pump(outfile, cppfilt.stdout)
-        for line in infile:
-            cppfilt.stdin.write(fixSymbols(line, fixer))
+        if pool:
+            pool.map(fix, filenames)
+        else:
+            map(fix, filenames)
     finally:
-        cppfilt.stdin.close()
-    p.join()
-    fixer.close()
+        if pool:
+            pool.close()
+        fixer.close()
 
 
 def add_argparse_arguments(parser):
@@ -566,6 +1293,12 @@ def add_argparse_arguments(parser):
                              'We try to detect this automatically.')
     parser.add_argument('--remove-cache', action='store_true',
                         help="Delete the persistent addr2line cache before running.")
+    parser.add_argument('--use-toolchain', action='store_true',
+                        help="Run the toolchain's nm and addr2line instead of "
+                             "reading the libraries in-process.")
+    parser.add_argument('--jobs', '-j', metavar='N', type=int, default=1,
+                        help='Number of libraries (and DMD files) to process '
+                             'at once (default: %(default)s).')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -577,21 +1310,27 @@ if __name__ == '__main__':
                         help=textwrap.dedent('''\
                             File to write output to (default: stdout).  If name
                             ends with ".gz", we will gzip the file.'''))
+    parser.add_argument('--warm', action='store_true',
+                        help=textwrap.dedent('''\
+                            Don't fix any stacks.  Instead, store the symbol
+                            tables and decoded debug information of libxul.so,
+                            b2g and plugin-container from the objdirs in our
+                            cache, so that the first run after a build is as
+                            fast as later ones.'''))
     add_argparse_arguments(parser)
     args = parser.parse_args()
 
+    if args.warm:
+        for lib_path in warm_cache(args):
+            print('Stored the symbols of %s' % lib_path, file=sys.stderr)
+        sys.exit(0)
+
     infile = sys.stdin
     if args.infile:
-        if args.infile.endswith('.gz'):
-            infile = GzipFile(args.infile, 'r')
-        else:
-            infile = open(args.infile, 'r')
+        infile = open_maybe_gzipped(args.infile, 'r')
 
     outfile = sys.stdout
     if args.outfile:
-        if args.outfile.endswith('.gz'):
-            outfile = GzipFile(args.outfile, 'w')
-        else:
-            outfile = open(args.outfile, 'w')
+        outfile = open_maybe_gzipped(args.outfile, 'w')
 
     fix_b2g_stacks_in_file(infile, outfile, args)
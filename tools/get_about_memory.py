@@ -115,6 +115,7 @@ def process_dmd_files_impl(dmd_files, args):
     proc_names, procrank = get_proc_names(out_dir)
     get_objdir_and_product(args)
 
+    filenames = []
     for f in dmd_files:
         # Extract the PID (e.g. 111) and UNIX time (e.g. 9999999) and the file
         # kind ('txt' or 'json', depending on the version) from the name
@@ -139,12 +140,15 @@ def process_dmd_files_impl(dmd_files, args):
                 outfile_name = outfile_name[:-3]
 
         outfile_path = os.path.join(out_dir, outfile_name)
-        with GzipFile(outfile_path + '.gz', 'w') if args.compress_dmd_logs else \
-                open(outfile_path, 'w') as outfile:
-            with GzipFile(f, 'r') as infile:
-                fix_b2g_stack.fix_b2g_stacks_in_file(infile, outfile, args)
+        if args.compress_dmd_logs:
+            outfile_path += '.gz'
+        filenames.append((f, outfile_path))
 
-        if not args.keep_individual_reports:
+    # With --jobs, this fixes several files at once, sharing one cache.
+    fix_b2g_stack.fix_b2g_stacks_in_files(filenames, args)
+
+    if not args.keep_individual_reports:
+        for f in dmd_files:
             os.remove(f)
 
 
@@ -0,0 +1,1888 @@
+"""Demangle C++ symbol names in-process, without running c++filt.
+
+This understands the Itanium C++ ABI's name mangling, which GCC and Clang use
+on every platform we care about, and formats names the way GNU c++filt does,
+so that demangle('_ZN7mozilla3dom7Element4BlurEv') returns
+'mozilla::dom::Element::Blur()'.  Names which aren't mangled, or which we
+can't make sense of, are returned unchanged, as c++filt would.  Like c++filt,
+we also demangle the names of Rust functions, which rustc's legacy mangling
+dresses up as C++ names.
+
+We parse a mangled name into a tree of nodes, following the grammar in the
+ABI spec, and then print the tree.  Most nodes print themselves in two
+halves, around whatever is declared with them, since that's how C++ writes
+types: a pointer to a function is printed as 'int (*' and ')(char)'.
+
+demangle() remembers every name it has demangled, since the same names tend
+to turn up over and over again.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+
+class _Error(Exception):
+    """Raised when we can't demangle a name."""
+    pass
+
+
+# c++filt gives up on C++ names longer than this, rather than risk running
+# out of stack demangling them.
+_MAX_LENGTH = 1024
+
+
+def demangle(name, verbose=True):
+    """Return the demangled form of name, or name itself if it isn't a
+    mangled name.
+
+    Pass verbose=False to get the names addr2line and nm give, rather than
+    c++filt's: they abbreviate std::basic_string<char, ...> to std::string,
+    and so on, and leave the hash off the end of Rust names.
+
+    """
+    cache = _demangled if verbose else _demangled_briefly
+    try:
+        return cache[name]
+    except KeyError:
+        pass
+    result = _demangle_rust(name, verbose)
+    if result is None:
+        result = name
+        try:
+            if len(name) > _MAX_LENGTH:
+                pass
+            elif name.startswith('_Z'):
+                result = _Parser(name).parse(verbose)
+            elif (name.startswith('_GLOBAL_') and name[8:9] in ('.', '_', '$')
+                  and name[9:10] in ('I', 'D') and name[10:11] == '_'):
+                # c++filt ignores whatever follows the encoding here, such
+                # as a clone suffix.
+                keyed_to = name[11:]
+                if keyed_to.startswith('_Z'):
+                    keyed_to = _Parser(keyed_to).parse(verbose, top_level=False)
+                result = '%s keyed to %s' % (
+                    'global constructors' if name[9] == 'I'
+                    else 'global destructors', keyed_to)
+        except (_Error, IndexError, ValueError, RuntimeError):
+            # RuntimeError means we recursed too deeply; either way, the name
+            # isn't one we understand.
+            pass
+    cache[name] = result
+    return result
+
+
+_demangled = {}
+_demangled_briefly = {}
+
+
+#
+# Printing
+#
+
+class _Printer(object):
+    """Accumulates the text of a demangled name."""
+
+    def __init__(self, verbose=True):
+        self._parts = []
+        self._last = ''
+        self.size = 0
+        self.verbose = verbose
+        # Which element of the argument packs we're printing, inside a pack
+        # expansion.
+        self.pack_index = None
+        # How many lambdas' parameter lists we're inside of.
+        self.lambda_depth = 0
+        # The template arguments of the function templates we're inside of.
+        # Like c++filt, we look template parameters up in the innermost one,
+        # even if they came from a substitution for a parameter of another.
+        self.templates = []
+        # The templates in scope where we first printed each reference to a
+        # template parameter, and the nodes we're in the middle of printing;
+        # see _PointerType.
+        self.scopes = {}
+        self.active = []
+
+    def write(self, text):
+        if text:
+            self._parts.append(text)
+            self._last = text[-1]
+            self.size += len(text)
+
+    def last(self):
+        return self._last
+
+    def node(self, node):
+        node.left(self)
+        node.right(self)
+
+    def nodes(self, nodes):
+        """Print nodes separated by commas.  Like c++filt, we drop the commas
+        before nodes which print nothing (empty argument packs) only at the
+        end of the list, and still think the last thing we printed was a
+        space."""
+        commas = []
+        for (i, node) in enumerate(nodes):
+            if i:
+                commas.append(self.size)
+                self.write(', ')
+            self.node(node)
+        while commas and self.size == commas[-1] + 2:
+            commas.pop()
+            self._parts.pop()
+            self.size -= 2
+
+    def subexpr(self, node):
+        """Print node as an operand in an expression, parenthesizing it unless
+        it's simple."""
+        if node.simple:
+            self.node(node)
+        else:
+            self.write('(')
+            self.node(node)
+            self.write(')')
+
+    def text(self):
+        return ''.join(self._parts)
+
+
+def _find_pack(node, p):
+    """Find the argument pack which a pack expansion of node expands."""
+    if isinstance(node, _TemplateParam):
+        if p.lambda_depth:
+            return None
+        arg = node.arg(p)
+        return arg if isinstance(arg, _ArgPack) else None
+    for child in node.children():
+        if child is not None:
+            pack = _find_pack(child, p)
+            if pack is not None:
+                return pack
+    return None
+
+
+class _Node(object):
+    # Whether the node needs no parentheses as an operand in an expression.
+    simple = False
+
+    def left(self, p):
+        pass
+
+    def right(self, p):
+        pass
+
+    def has_rhs(self, p):
+        """Whether right() prints anything."""
+        return False
+
+    def has_array(self, p):
+        return False
+
+    def has_function(self, p):
+        return False
+
+    def children(self):
+        return ()
+
+
+class _Name(_Node):
+    simple = True
+
+    def __init__(self, text):
+        self.text = text
+
+    def left(self, p):
+        p.write(self.text)
+
+
+class _Builtin(_Name):
+    simple = False
+
+    def __init__(self, text, code):
+        self.text = text
+        self.code = code
+
+
+class _SpecialSubstitution(_Node):
+    # The abbreviations the ABI defines for some parts of the std namespace,
+    # what they stand for, how addr2line abbreviates them, and the names of
+    # their constructors.  c++filt writes them out in full.
+    _NAMES = {
+        'a': ('std::allocator', 'std::allocator', 'allocator'),
+        'b': ('std::basic_string', 'std::basic_string', 'basic_string'),
+        's': ('std::basic_string<char, std::char_traits<char>, '
+              'std::allocator<char> >', 'std::string', 'basic_string'),
+        'i': ('std::basic_istream<char, std::char_traits<char> >',
+              'std::istream', 'basic_istream'),
+        'o': ('std::basic_ostream<char, std::char_traits<char> >',
+              'std::ostream', 'basic_ostream'),
+        'd': ('std::basic_iostream<char, std::char_traits<char> >',
+              'std::iostream', 'basic_iostream'),
+    }
+
+    def __init__(self, code):
+        (self._text, self._short_text, self.name) = self._NAMES[code]
+        # Whether to write the type out in full even when we're abbreviating,
+        # as for the class of a constructor.
+        self.full = False
+
+    def left(self, p):
+        p.write(self._text if p.verbose or self.full else self._short_text)
+
+
+class _NestedName(_Node):
+    simple = True
+
+    def __init__(self, prefix, name):
+        self.prefix = prefix
+        self.name = name
+
+    def left(self, p):
+        p.node(self.prefix)
+        p.write('::')
+        p.node(self.name)
+
+    def children(self):
+        return (self.prefix, self.name)
+
+
+class _LocalName(_Node):
+    def __init__(self, encoding, entity):
+        self.encoding = encoding
+        self.entity = entity
+
+    def left(self, p):
+        p.node(self.encoding)
+        p.write('::')
+        p.node(self.entity)
+
+    def children(self):
+        return (self.encoding, self.entity)
+
+
+class _TemplateName(_Node):
+    """A name with template arguments."""
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def left(self, p):
+        p.node(self.name)
+        self.args_left(p)
+
+    def args_left(self, p):
+        # Don't print '<<' or '>>', which would look like an operator.
+        if p.last() == '<':
+            p.write(' ')
+        p.write('<')
+        pack_index = p.pack_index
+        p.nodes(self.args)
+        p.pack_index = pack_index
+        if p.last() == '>':
+            p.write(' ')
+        p.write('>')
+
+    def children(self):
+        return [self.name] + self.args
+
+
+class _ArgPack(_Node):
+    def __init__(self, args):
+        self.args = args
+
+    def left(self, p):
+        p.nodes(self.args)
+
+    def children(self):
+        return self.args
+
+
+class _TemplateParam(_Node):
+    """A reference to a template argument, which we look up when we print
+    it."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def arg(self, p):
+        if not p.templates or self.index >= len(p.templates[-1]):
+            raise _Error()
+        return p.templates[-1][self.index]
+
+    def resolve(self, p):
+        arg = self.arg(p)
+        if isinstance(arg, _ArgPack):
+            index = p.pack_index or 0
+            if index >= len(arg.args):
+                raise _Error()
+            arg = arg.args[index]
+        return arg.resolve(p) if isinstance(arg, _TemplateParam) else arg
+
+    def left(self, p):
+        if p.lambda_depth:
+            # c++filt calls the parameters of generic lambdas 'auto:1' and so
+            # on, since that's what g++ calls them.
+            p.write('auto:%d' % (self.index + 1))
+        else:
+            p.active.append(self)
+            self.resolve(p).left(p)
+            p.active.pop()
+
+    def right(self, p):
+        if not p.lambda_depth:
+            p.active.append(self)
+            self.resolve(p).right(p)
+            p.active.pop()
+
+    def has_rhs(self, p):
+        return not p.lambda_depth and self.resolve(p).has_rhs(p)
+
+    def has_array(self, p):
+        return not p.lambda_depth and self.resolve(p).has_array(p)
+
+    def has_function(self, p):
+        return not p.lambda_depth and self.resolve(p).has_function(p)
+
+
+class _PackExpansion(_Node):
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def left(self, p):
+        pack = _find_pack(self.pattern, p)
+        if pack is None:
+            # We can't tell how long the pack is, e.g. because it's a pack of
+            # function parameters.
+            p.subexpr(self.pattern)
+            p.write('...')
+            return
+        pack_index = p.pack_index
+        for i in range(len(pack.args)):
+            if i:
+                p.write(', ')
+            p.pack_index = i
+            p.node(self.pattern)
+        p.pack_index = pack_index
+
+    def children(self):
+        return (self.pattern,)
+
+
+class _CtorDtorName(_Name):
+    simple = False
+
+
+class _AbiTagged(_Node):
+    def __init__(self, name, tag):
+        self.name = name
+        self.tag = tag
+
+    def left(self, p):
+        p.node(self.name)
+        p.write('[abi:%s]' % self.tag)
+
+    def children(self):
+        return (self.name,)
+
+
+class _OperatorName(_Node):
+    def __init__(self, name):
+        self.name = name
+
+    def left(self, p):
+        p.write('operator')
+        if self.name[0].islower():
+            p.write(' ')
+        p.write(self.name.rstrip(' '))
+
+
+class _ConversionOperatorName(_Node):
+    def __init__(self, type):
+        self.type = type
+        # Whether the operator is a template, which the parser tells us.
+        self.templated = False
+
+    def left(self, p):
+        p.write('operator ')
+        if not (self.templated and isinstance(self.type, _TemplateName)):
+            p.node(self.type)
+            return
+        # c++filt prints the template arguments of the type we convert to
+        # with the operator's own template arguments out of scope.
+        p.node(self.type.name)
+        templates = p.templates
+        p.templates = templates[:-1]
+        self.type.args_left(p)
+        p.templates = templates
+
+    def children(self):
+        return (self.type,)
+
+
+class _LambdaName(_Node):
+    def __init__(self, params, number):
+        self.params = params
+        self.number = number
+
+    def left(self, p):
+        p.write('{lambda(')
+        p.lambda_depth += 1
+        p.nodes(self.params)
+        p.lambda_depth -= 1
+        p.write(')#%d}' % self.number)
+
+    def children(self):
+        return self.params
+
+
+class _QualType(_Node):
+    def __init__(self, type, quals):
+        self.type = type
+        self.quals = quals
+
+    def left(self, p):
+        self.quals_left(p, ())
+
+    def quals_left(self, p, outer):
+        """Print the left half of the type, leaving out the qualifiers in
+        outer.  c++filt doesn't repeat a qualifier which an enclosing
+        qualified type, typically one of a template parameter, applies
+        too: 'const T*' with T = 'const int' is 'int const*'."""
+        quals = self.quals.split()
+        type = self.type
+        if isinstance(type, _TemplateParam) and not p.lambda_depth:
+            type = type.resolve(p)
+        if isinstance(type, _QualType):
+            type.quals_left(p, outer + tuple(quals))
+        else:
+            self.type.left(p)
+        p.write(''.join([' ' + q for q in quals if q not in outer]))
+
+    def right(self, p):
+        self.type.right(p)
+
+    def has_rhs(self, p):
+        return self.type.has_rhs(p)
+
+    def has_array(self, p):
+        return self.type.has_array(p)
+
+    def has_function(self, p):
+        return self.type.has_function(p)
+
+    def children(self):
+        return (self.type,)
+
+
+class _PostfixType(_Node):
+    """A type followed by a keyword, like 'double _Complex'."""
+
+    def __init__(self, type, postfix):
+        self.type = type
+        self.postfix = postfix
+
+    def left(self, p):
+        p.node(self.type)
+        p.write(self.postfix)
+
+    def children(self):
+        return (self.type,)
+
+
+class _PointerType(_Node):
+    """A pointer or reference type."""
+
+    def __init__(self, pointee, sigil):
+        self.pointee = pointee
+        self.sigil = sigil
+
+    def _collapse(self, p):
+        """Apply the reference collapsing rules, where a reference to a
+        reference is a reference, and return (sigil, pointee)."""
+        sigil = self.sigil
+        pointee = self.pointee
+        if sigil == '*':
+            return (sigil, pointee)
+        while True:
+            target = pointee
+            if isinstance(target, _TemplateParam) and not p.lambda_depth:
+                target = target.resolve(p)
+            if not (isinstance(target, _PointerType) and target.sigil != '*'):
+                return (sigil, pointee)
+            if target.sigil == '&':
+                sigil = '&'
+            pointee = target.pointee
+
+    def _scope(self, p):
+        """Return the templates to look our pointee up in.
+
+        c++filt remembers which templates were in scope the first time it
+        prints a reference to a template parameter.  When a substitution
+        brings the reference back somewhere else, it looks the parameter up
+        in those templates again, unless it's printing the reference from
+        within itself.
+
+        """
+        if (self.sigil == '*' or p.lambda_depth or
+                not isinstance(self.pointee, _TemplateParam)):
+            return p.templates
+        scope = p.scopes.get(self.pointee)
+        if scope is None:
+            p.scopes[self.pointee] = list(p.templates)
+        elif self.pointee not in p.active and self not in p.active:
+            return scope
+        return p.templates
+
+    def _in_scope(self, p, method):
+        templates = p.templates
+        p.templates = self._scope(p)
+        p.active.append(self)
+        result = method(p)
+        p.active.pop()
+        p.templates = templates
+        return result
+
+    def left(self, p):
+        self._in_scope(p, self._left)
+
+    def _left(self, p):
+        (sigil, pointee) = self._collapse(p)
+        pointee.left(p)
+        if pointee.has_array(p):
+            p.write(' ')
+        if pointee.has_array(p) or pointee.has_function(p):
+            p.write('(')
+        p.write(sigil)
+
+    def right(self, p):
+        self._in_scope(p, self._right)
+
+    def _right(self, p):
+        (_, pointee) = self._collapse(p)
+        if pointee.has_array(p) or pointee.has_function(p):
+            p.write(')')
+        pointee.right(p)
+
+    def has_rhs(self, p):
+        return self._in_scope(p, lambda p: self._collapse(p)[1].has_rhs(p))
+
+    def children(self):
+        return (self.pointee,)
+
+
+class _PointerToMemberType(_Node):
+    def __init__(self, cls, member):
+        self.cls = cls
+        self.member = member
+
+    def left(self, p):
+        self.member.left(p)
+        if self.member.has_function(p) and p.last() != ' ':
+            p.write(' ')
+        if self.member.has_array(p) or self.member.has_function(p):
+            p.write('(')
+        else:
+            p.write(' ')
+        p.node(self.cls)
+        p.write('::*')
+
+    def right(self, p):
+        if self.member.has_array(p) or self.member.has_function(p):
+            p.write(')')
+        self.member.right(p)
+
+    def has_rhs(self, p):
+        return self.member.has_rhs(p)
+
+    def children(self):
+        return (self.cls, self.member)
+
+
+class _FunctionType(_Node):
+    def __init__(self, ret, params, quals, exception_spec):
+        self.ret = ret
+        self.params = params
+        self.quals = quals
+        self.exception_spec = exception_spec
+
+    def left(self, p):
+        self.ret.left(p)
+        # c++filt writes 'void (*(*)())()' for a pointer to a function
+        # returning a function pointer.
+        if not self.ret.has_rhs(p) or p.last() not in ('(', '*'):
+            p.write(' ')
+
+    def right(self, p):
+        p.write('(')
+        p.nodes(self.params)
+        p.write(')')
+        self.ret.right(p)
+        p.write(self.quals)
+        if self.exception_spec:
+            p.node(self.exception_spec)
+
+    def has_rhs(self, p):
+        return True
+
+    def has_function(self, p):
+        return True
+
+    def children(self):
+        return [self.ret] + self.params
+
+
+class _ArrayType(_Node):
+    def __init__(self, element, dimension):
+        self.element = element
+        self.dimension = dimension
+
+    def left(self, p):
+        self.element.left(p)
+
+    def right(self, p):
+        if p.last() != ']':
+            p.write(' ')
+        p.write('[')
+        if self.dimension is not None:
+            p.node(self.dimension)
+        p.write(']')
+        self.element.right(p)
+
+    def has_rhs(self, p):
+        return True
+
+    def has_array(self, p):
+        return True
+
+    def children(self):
+        return (self.element, self.dimension)
+
+
+class _FunctionEncoding(_Node):
+    def __init__(self, name, ret, params, quals):
+        self.name = name
+        self.ret = ret
+        self.params = params
+        self.quals = quals
+        template = name.entity if isinstance(name, _LocalName) else name
+        self.template_args = (template.args
+                              if isinstance(template, _TemplateName) else None)
+
+    def left(self, p):
+        if self.template_args is not None:
+            p.templates.append(self.template_args)
+        if self.ret:
+            self.ret.left(p)
+            if not self.ret.has_rhs(p):
+                p.write(' ')
+        p.node(self.name)
+        if self.template_args is not None:
+            p.templates.pop()
+
+    def right(self, p):
+        if self.template_args is not None:
+            p.templates.append(self.template_args)
+        p.write('(')
+        p.nodes(self.params)
+        p.write(')')
+        if self.ret:
+            self.ret.right(p)
+        p.write(self.quals)
+        if self.template_args is not None:
+            p.templates.pop()
+
+    def children(self):
+        return [self.name, self.ret] + self.params
+
+
+class _Prefixed(_Node):
+    """Some text followed by a node, e.g. 'vtable for Foo' or
+    'decltype (x)'."""
+
+    def __init__(self, prefix, node, suffix=''):
+        self.prefix = prefix
+        self.node = node
+        self.suffix = suffix
+
+    def left(self, p):
+        p.write(self.prefix)
+        p.node(self.node)
+        p.write(self.suffix)
+
+    def children(self):
+        return (self.node,)
+
+
+class _ConstructionVtable(_Node):
+    def __init__(self, derived, base):
+        self.derived = derived
+        self.base = base
+
+    def left(self, p):
+        p.write('construction vtable for ')
+        p.node(self.base)
+        p.write('-in-')
+        p.node(self.derived)
+
+
+class _Clone(_Node):
+    def __init__(self, encoding, suffix):
+        self.encoding = encoding
+        self.suffix = suffix
+
+    def left(self, p):
+        p.node(self.encoding)
+        p.write(' [clone %s]' % self.suffix)
+
+
+#
+# Expressions
+#
+
+class _Literal(_Node):
+    # How c++filt prints integer literals of each builtin type.
+    _SUFFIXES = {'i': '', 'j': 'u', 'l': 'l', 'm': 'ul', 'x': 'll', 'y': 'ull'}
+
+    def __init__(self, type, value, negative):
+        self.type = type
+        self.value = value
+        self.negative = negative
+
+    def left(self, p):
+        code = self.type.code if isinstance(self.type, _Builtin) else None
+        if code in self._SUFFIXES:
+            p.write('-' if self.negative else '')
+            p.write(self.value + self._SUFFIXES[code])
+            return
+        if code == 'b' and self.value in ('0', '1') and not self.negative:
+            p.write('true' if self.value == '1' else 'false')
+            return
+        p.write('(')
+        p.node(self.type)
+        p.write(')')
+        p.write('-' if self.negative else '')
+        if code in ('f', 'd', 'e', 'g'):
+            p.write('[%s]' % self.value)
+        else:
+            p.write(self.value)
+
+    def children(self):
+        return (self.type,)
+
+
+class _FunctionParam(_Node):
+    simple = True
+
+    def __init__(self, number):
+        self.number = number
+
+    def left(self, p):
+        if self.number:
+            p.write('{parm#%d}' % self.number)
+        else:
+            p.write('this')
+
+
+class _Unary(_Node):
+    def __init__(self, op, operand, suffix=False):
+        self.op = op
+        self.operand = operand
+        self.suffix = suffix
+
+    def left(self, p):
+        if self.suffix:
+            p.subexpr(self.operand)
+            p.write(self.op)
+        elif self.op == '::':
+            p.write(self.op)
+            p.node(self.operand)
+        elif (self.op == '&' and
+              isinstance(self.operand, _FunctionEncoding) and
+              isinstance(self.operand.name, _NestedName) and
+              not self.operand.quals):
+            # A pointer to a member function, which we print without its
+            # parameters' types.
+            p.write(self.op)
+            p.node(self.operand.name)
+        else:
+            p.write(self.op)
+            p.subexpr(self.operand)
+
+    def children(self):
+        return (self.operand,)
+
+
+class _SizeofType(_Node):
+    def __init__(self, op, type):
+        self.op = op
+        self.type = type
+
+    def left(self, p):
+        p.write(self.op)
+        p.write('(')
+        p.node(self.type)
+        p.write(')')
+
+    def children(self):
+        return (self.type,)
+
+
+class _SizeofPack(_Node):
+    def __init__(self, pack):
+        self.pack = pack
+
+    def left(self, p):
+        pack = _find_pack(self.pack, p)
+        if pack is None:
+            raise _Error()
+        p.write(str(len(pack.args)))
+
+    def children(self):
+        return (self.pack,)
+
+
+class _Binary(_Node):
+    def __init__(self, op, lhs, rhs):
+        self.op = op
+        self.lhs = lhs
+        self.rhs = rhs
+
+    def left(self, p):
+        # Parenthesize '>' so that it doesn't end a template argument list.
+        if self.op == '>':
+            p.write('(')
+        p.subexpr(self.lhs)
+        if self.op == '[]':
+            p.write('[')
+            p.node(self.rhs)
+            p.write(']')
+        else:
+            p.write(self.op)
+            p.subexpr(self.rhs)
+        if self.op == '>':
+            p.write(')')
+
+    def children(self):
+        return (self.lhs, self.rhs)
+
+
+class _Conditional(_Node):
+    def __init__(self, cond, then, otherwise):
+        self.cond = cond
+        self.then = then
+        self.otherwise = otherwise
+
+    def left(self, p):
+        p.subexpr(self.cond)
+        p.write('?')
+        p.subexpr(self.then)
+        p.write(' : ')
+        p.subexpr(self.otherwise)
+
+    def children(self):
+        return (self.cond, self.then, self.otherwise)
+
+
+class _ExprList(_Node):
+    def __init__(self, exprs):
+        self.exprs = exprs
+
+    def left(self, p):
+        p.nodes(self.exprs)
+
+    def children(self):
+        return self.exprs
+
+
+class _Call(_Node):
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+
+    def left(self, p):
+        function = self.function
+        if isinstance(function, _FunctionEncoding):
+            # Don't print the types of the function's parameters.
+            function = function.name
+        p.subexpr(function)
+        p.subexpr(_ExprList(self.args))
+
+    def children(self):
+        return [self.function] + self.args
+
+
+class _Cast(_Node):
+    def __init__(self, type, operand):
+        self.type = type
+        self.operand = operand
+
+    def left(self, p):
+        p.write('(')
+        p.node(self.type)
+        p.write(')')
+        p.subexpr(self.operand)
+
+    def children(self):
+        return (self.type, self.operand)
+
+
+class _NamedCast(_Node):
+    def __init__(self, op, type, operand):
+        self.op = op
+        self.type = type
+        self.operand = operand
+
+    def left(self, p):
+        p.write(self.op)
+        p.write('<')
+        p.node(self.type)
+        p.write('>(')
+        p.node(self.operand)
+        p.write(')')
+
+    def children(self):
+        return (self.type, self.operand)
+
+
+class _InitList(_Node):
+    simple = True
+
+    def __init__(self, type, exprs):
+        self.type = type
+        self.exprs = exprs
+
+    def left(self, p):
+        if self.type:
+            p.node(self.type)
+        p.write('{')
+        p.nodes(self.exprs)
+        p.write('}')
+
+    def children(self):
+        return [self.type] + self.exprs
+
+
+#
+# Parsing
+#
+
+_BUILTIN_TYPES = {
+    'v': 'void', 'w': 'wchar_t', 'b': 'bool', 'c': 'char',
+    'a': 'signed char', 'h': 'unsigned char', 's': 'short',
+    't': 'unsigned short', 'i': 'int', 'j': 'unsigned int', 'l': 'long',
+    'm': 'unsigned long', 'x': 'long long', 'y': 'unsigned long long',
+    'n': '__int128', 'o': 'unsigned __int128', 'f': 'float', 'd': 'double',
+    'e': 'long double', 'g': '__float128', 'z': '...',
+}
+
+_D_BUILTIN_TYPES = {
+    'd': 'decimal64', 'e': 'decimal128', 'f': 'decimal32', 'h': 'half',
+    'i': 'char32_t', 's': 'char16_t', 'u': 'char8_t', 'a': 'auto',
+    'c': 'decltype(auto)', 'n': 'decltype(nullptr)',
+}
+
+# Operators' codes, names, and numbers of operands.
+_OPERATORS = {
+    'nw': ('new', 3), 'na': ('new[]', 3), 'dl': ('delete ', 1),
+    'da': ('delete[] ', 1), 'ps': ('+', 1), 'ng': ('-', 1), 'ad': ('&', 1),
+    'de': ('*', 1), 'co': ('~', 1), 'pl': ('+', 2), 'mi': ('-', 2),
+    'ml': ('*', 2), 'dv': ('/', 2), 'rm': ('%', 2), 'an': ('&', 2),
+    'or': ('|', 2), 'eo': ('^', 2), 'aS': ('=', 2), 'pL': ('+=', 2),
+    'mI': ('-=', 2), 'mL': ('*=', 2), 'dV': ('/=', 2), 'rM': ('%=', 2),
+    'aN': ('&=', 2), 'oR': ('|=', 2), 'eO': ('^=', 2), 'ls': ('<<', 2),
+    'rs': ('>>', 2), 'lS': ('<<=', 2), 'rS': ('>>=', 2), 'eq': ('==', 2),
+    'ne': ('!=', 2), 'lt': ('<', 2), 'gt': ('>', 2), 'le': ('<=', 2),
+    'ge': ('>=', 2), 'ss': ('<=>', 2), 'nt': ('!', 1), 'aa': ('&&', 2),
+    'oo': ('||', 2), 'pp': ('++', 1), 'mm': ('--', 1), 'cm': (',', 2),
+    'pm': ('->*', 2), 'pt': ('->', 2), 'cl': ('()', 2), 'ix': ('[]', 2),
+    'qu': ('?', 3), 'st': ('sizeof ', 1), 'sz': ('sizeof ', 1),
+    'at': ('alignof ', 1), 'az': ('alignof ', 1), 'dt': ('.', 2),
+    'nx': ('noexcept', 1), 'tw': ('throw ', 1), 'ti': ('typeid ', 1),
+    'te': ('typeid ', 1), 'aw': ('co_await', 1),
+}
+
+_NAMED_CASTS = {
+    'dc': 'dynamic_cast', 'sc': 'static_cast', 'cc': 'const_cast',
+    'rc': 'reinterpret_cast',
+}
+
+_SPECIAL_NAMES = {
+    'TV': 'vtable for ', 'TT': 'VTT for ', 'TI': 'typeinfo for ',
+    'TS': 'typeinfo name for ', 'TF': 'typeinfo fn for ',
+}
+
+_BASE36 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+class _NameState(object):
+    """What we learn about a function from parsing its name."""
+
+    def __init__(self):
+        self.quals = ''
+        self.ends_with_template_args = False
+        self.ctor_dtor_conversion = False
+
+
+class _Parser(object):
+    def __init__(self, name):
+        self.s = name
+        self.pos = 0
+        # The candidates for substitutions (S_, S0_, ...).
+        self.subs = []
+        # The last source name we saw, which c++filt uses for the names of
+        # constructors and destructors.
+        self.last_name = None
+        self.parse_template_args = True
+        # Whether to read unresolved names the way old versions of GCC
+        # mangled them, and whether we've read one the new way; see parse().
+        self.old_unresolved_names = False
+        self.read_new_unresolved_name = False
+
+    def parse(self, verbose=True, top_level=True):
+        """Return the demangled name.
+
+        Pass top_level=False to demangle just the encoding at the start of
+        the name, ignoring anything after it.
+
+        An unresolved name like 'sr1A1x' could be read the way GCC mangles
+        them now, with an 'E' after the qualifiers, or the way it used to,
+        without.  Like c++filt, we try the new way first, and if that leaves
+        us with a name we can't parse, we read every one of them the old way.
+
+        """
+        try:
+            encoding = self.mangled_name(top_level)
+        except _Error:
+            if not self.read_new_unresolved_name:
+                raise
+            parser = _Parser(self.s)
+            parser.old_unresolved_names = True
+            encoding = parser.mangled_name(top_level)
+        p = _Printer(verbose)
+        p.node(encoding)
+        return p.text()
+
+    def mangled_name(self, top_level):
+        self.pos = 2
+        encoding = self.encoding()
+        if not top_level:
+            return encoding
+        while self.peek() == '.' and (self.peek(1).islower() or
+                                      self.peek(1).isdigit() or
+                                      self.peek(1) == '_'):
+            encoding = _Clone(encoding, self.clone_suffix())
+        if self.pos != len(self.s):
+            raise _Error()
+        return encoding
+
+    def peek(self, i=0):
+        return self.s[self.pos + i:self.pos + i + 1]
+
+    def consume(self, prefix):
+        if self.s.startswith(prefix, self.pos):
+            self.pos += len(prefix)
+            return True
+        return False
+
+    def expect(self, prefix):
+        if not self.consume(prefix):
+            raise _Error()
+
+    def number(self):
+        """Parse a possibly negative decimal number."""
+        start = self.pos
+        self.consume('n')
+        while self.peek().isdigit():
+            self.pos += 1
+        if self.s[start:self.pos] in ('', 'n'):
+            raise _Error()
+        return int(self.s[start:self.pos].replace('n', '-'))
+
+    def optional_number(self):
+        """Parse '_' as 0, or a number followed by '_' as that number plus
+        one, as for template parameters and lambdas."""
+        if self.consume('_'):
+            return 0
+        n = self.number()
+        self.expect('_')
+        return n + 1
+
+    def clone_suffix(self):
+        start = self.pos
+        self.pos += 2
+        while (self.peek().islower() or self.peek().isdigit() or
+               self.peek() == '_'):
+            self.pos += 1
+        while self.peek() == '.' and self.peek(1).isdigit():
+            self.pos += 2
+            while self.peek().isdigit():
+                self.pos += 1
+        return self.s[start:self.pos]
+
+    def at_end_of_encoding(self):
+        return self.pos == len(self.s) or self.peek() in ('E', '.')
+
+    def encoding(self):
+        if self.peek() in ('T', 'G'):
+            return self.special_name()
+        state = _NameState()
+        name = self.name(state)
+        if self.pos == len(self.s) or self.peek() == 'E':
+            return name
+        ret = None
+        if state.ends_with_template_args and not state.ctor_dtor_conversion:
+            ret = self.type()
+        # A function which takes no parameters takes void.  c++filt prints
+        # a void which isn't alone like any other parameter.
+        params = []
+        start = self.pos
+        if not (self.consume('v') and self.at_end_of_encoding()):
+            self.pos = start
+            params.append(self.type())
+            while not self.at_end_of_encoding():
+                params.append(self.type())
+        return _FunctionEncoding(name, ret, params, state.quals)
+
+    def call_offset(self):
+        if self.consume('h'):
+            self.number()
+        elif self.consume('v'):
+            self.number()
+            self.expect('_')
+            self.number()
+        else:
+            raise _Error()
+        self.expect('_')
+
+    def special_name(self):
+        code = self.s[self.pos:self.pos + 2]
+        if code in _SPECIAL_NAMES:
+            self.pos += 2
+            return _Prefixed(_SPECIAL_NAMES[code], self.type())
+        self.pos += 2
+        if code in ('Th', 'Tv'):
+            # The 'h' or 'v' is part of the call offset.
+            self.pos -= 1
+        if code == 'Th':
+            self.call_offset()
+            return _Prefixed('non-virtual thunk to ', self.encoding())
+        if code == 'Tv':
+            self.call_offset()
+            return _Prefixed('virtual thunk to ', self.encoding())
+        if code == 'Tc':
+            self.call_offset()
+            self.call_offset()
+            return _Prefixed('covariant return thunk to ', self.encoding())
+        if code == 'TC':
+            derived = self.type()
+            self.number()
+            self.expect('_')
+            return _ConstructionVtable(derived, self.type())
+        if code == 'TH':
+            return _Prefixed('TLS init function for ', self.name(None))
+        if code == 'TW':
+            return _Prefixed('TLS wrapper function for ', self.name(None))
+        if code == 'TA':
+            return _Prefixed('template parameter object for ',
+                             self.template_arg())
+        if code == 'GV':
+            return _Prefixed('guard variable for ', self.name(None))
+        if code == 'GR':
+            name = self.name(None)
+            return _Prefixed('reference temporary #%d for ' % self.digits(),
+                             name)
+        if code == 'GA':
+            return _Prefixed('hidden alias for ', self.encoding())
+        if code == 'GT':
+            if self.consume('t'):
+                return _Prefixed('transaction clone for ', self.encoding())
+            if self.consume('n'):
+                return _Prefixed('non-transaction clone for ',
+                                 self.encoding())
+        raise _Error()
+
+    def name(self, state):
+        c = self.peek()
+        if c == 'N':
+            return self.nested_name(state)
+        if c == 'Z':
+            return self.local_name(state)
+        if c == 'S' and self.peek(1) != 't':
+            sub = self.substitution()
+            if self.peek() != 'I':
+                raise _Error()
+            return _TemplateName(sub, self.template_args(state))
+        name = self.unscoped_name(state)
+        if self.peek() == 'I':
+            self.subs.append(name)
+            _note_templated(name)
+            name = _TemplateName(name, self.template_args(state))
+        return name
+
+    def unscoped_name(self, state):
+        std = self.consume('St')
+        name = self.unqualified_name(state)
+        return _NestedName(_Name('std'), name) if std else name
+
+    def nested_name(self, state):
+        self.expect('N')
+        quals = self.cv_qualifiers()
+        if self.consume('O'):
+            quals += ' &&'
+        elif self.consume('R'):
+            quals += ' &'
+        if state:
+            state.quals = quals
+
+        so_far = None
+        while not self.consume('E'):
+            if self.consume('M'):
+                if so_far is None:
+                    raise _Error()
+                continue
+            c = self.peek()
+            if c == 'S' and self.peek(1) == 't':
+                self.pos += 2
+                node = _Name('std')
+            elif c == 'S':
+                node = self.substitution()
+                if so_far is not None:
+                    raise _Error()
+                if (isinstance(node, _SpecialSubstitution) and
+                        self.peek() in ('C', 'D')):
+                    # addr2line writes out the class of a constructor or
+                    # destructor in full.
+                    node.full = True
+                so_far = node
+                continue
+            elif c == 'T':
+                node = self.template_param()
+            elif c == 'I':
+                if so_far is None:
+                    raise _Error()
+                _note_templated(so_far)
+                so_far = _TemplateName(so_far, self.template_args(state))
+                self.subs.append(so_far)
+                continue
+            elif c == 'D' and self.peek(1) in ('t', 'T'):
+                node = self.decltype()
+            elif c == 'C' or (c == 'D' and self.peek(1) != 'C'):
+                if so_far is None:
+                    raise _Error()
+                node = self.abi_tags(self.ctor_dtor_name(state))
+            else:
+                node = self.unqualified_name(state)
+            so_far = node if so_far is None else _NestedName(so_far, node)
+            if state:
+                state.ends_with_template_args = False
+            if not (isinstance(node, _Name) and node.text == 'std' and
+                    so_far is node):
+                self.subs.append(so_far)
+        if so_far is None:
+            raise _Error()
+        # The whole name isn't a candidate for substitution, unless it's
+        # a type, in which case type() adds it.
+        if self.subs and self.subs[-1] is so_far:
+            self.subs.pop()
+        return so_far
+
+    def local_name(self, state):
+        self.expect('Z')
+        encoding = self.encoding()
+        self.expect('E')
+        # c++filt doesn't print the return type of the function which the
+        # name is local to.
+        if isinstance(encoding, _FunctionEncoding):
+            encoding.ret = None
+        if self.consume('s'):
+            self.discriminator()
+            return _LocalName(encoding, _Name('string literal'))
+        if self.consume('d'):
+            number = 0
+            if not self.consume('_'):
+                number = self.number() + 1
+                self.expect('_')
+            entity = self.name(state)
+            return _LocalName(encoding, _NestedName(
+                _Name('{default arg#%d}' % (number + 1)), entity))
+        entity = self.name(state)
+        self.discriminator()
+        return _LocalName(encoding, entity)
+
+    def discriminator(self):
+        if not self.consume('_'):
+            return
+        if self.consume('_'):
+            if self.digits() >= 10:
+                self.expect('_')
+        else:
+            self.digits()
+
+    def digits(self):
+        """Parse a decimal number which may be missing, as 0."""
+        start = self.pos
+        while self.peek().isdigit():
+            self.pos += 1
+        return int(self.s[start:self.pos] or '0')
+
+    def unqualified_name(self, state):
+        if self.consume('L'):
+            # A name with internal linkage.
+            name = self.unqualified_name(state)
+            self.discriminator()
+            return name
+        c = self.peek()
+        if c.isdigit():
+            name = self.source_name()
+        elif c == 'U':
+            name = self.unnamed_type_name()
+        elif c == 'D' and self.peek(1) == 'C':
+            self.pos += 2
+            names = []
+            while not self.consume('E'):
+                names.append(self.source_name().text)
+            name = _Name('[%s]' % ', '.join(names))
+        elif c.islower():
+            name = self.operator_name(state)
+        else:
+            raise _Error()
+        return self.abi_tags(name)
+
+    def abi_tags(self, name):
+        while self.consume('B'):
+            name = _AbiTagged(name, self.identifier())
+        return name
+
+    def identifier(self):
+        length = self.number()
+        if length <= 0 or self.pos + length > len(self.s):
+            raise _Error()
+        self.pos += length
+        return self.s[self.pos - length:self.pos]
+
+    def source_name(self):
+        text = self.identifier()
+        if (text.startswith('_GLOBAL_') and text[8:9] in ('.', '_', '$') and
+                text[9:10] == 'N'):
+            text = '(anonymous namespace)'
+        self.last_name = text
+        return _Name(text)
+
+    def unnamed_type_name(self):
+        if self.consume('Ut'):
+            return _Name('{unnamed type#%d}' % (self.optional_number() + 1))
+        self.expect('Ul')
+        params = []
+        if not (self.peek() == 'v' and self.peek(1) == 'E' and
+                self.consume('v')):
+            while self.peek() != 'E':
+                params.append(self.type())
+        self.expect('E')
+        return _LambdaName(params, self.optional_number() + 1)
+
+    def operator_name(self, state):
+        code = self.s[self.pos:self.pos + 2]
+        self.pos += 2
+        if code == 'cv':
+            parse_template_args = self.parse_template_args
+            self.parse_template_args = False
+            type = self.type()
+            self.parse_template_args = parse_template_args
+            if state:
+                state.ctor_dtor_conversion = True
+            return _ConversionOperatorName(type)
+        if code == 'li':
+            return _Name('operator"" %s' % self.source_name().text)
+        if code[0] == 'v' and code[1:].isdigit():
+            return _Name('operator %s' % self.source_name().text)
+        if code in _OPERATORS:
+            return _OperatorName(_OPERATORS[code][0])
+        raise _Error()
+
+    def ctor_dtor_name(self, state):
+        if self.last_name is None:
+            raise _Error()
+        if state:
+            state.ctor_dtor_conversion = True
+        if self.consume('C'):
+            inheriting = self.consume('I')
+            if self.peek() not in ('1', '2', '3', '4', '5'):
+                raise _Error()
+            self.pos += 1
+            if inheriting:
+                self.type()
+            return _CtorDtorName(self.last_name)
+        self.expect('D')
+        if self.peek() not in ('0', '1', '2', '4', '5'):
+            raise _Error()
+        self.pos += 1
+        return _CtorDtorName('~' + self.last_name)
+
+    def substitution(self):
+        self.expect('S')
+        c = self.peek()
+        if c in _SpecialSubstitution._NAMES:
+            self.pos += 1
+            sub = _SpecialSubstitution(c)
+            self.last_name = sub.name
+            return sub
+        index = 0
+        if not self.consume('_'):
+            index = self.seq_id() + 1
+            self.expect('_')
+        if index >= len(self.subs):
+            raise _Error()
+        return self.subs[index]
+
+    def seq_id(self):
+        start = self.pos
+        while self.peek() and self.peek() in _BASE36:
+            self.pos += 1
+        if start == self.pos:
+            raise _Error()
+        return int(self.s[start:self.pos], 36)
+
+    def template_param(self):
+        self.expect('T')
+        return _TemplateParam(self.optional_number())
+
+    def template_args(self, state):
+        self.expect('I')
+        if state:
+            state.ends_with_template_args = True
+        # Don't let our arguments change the name of constructors, or stop
+        # the template arguments of a conversion operator's type.
+        last_name = self.last_name
+        parse_template_args = self.parse_template_args
+        self.parse_template_args = True
+        args = []
+        while not self.consume('E'):
+            args.append(self.template_arg())
+        self.last_name = last_name
+        self.parse_template_args = parse_template_args
+        return args
+
+    def template_arg(self):
+        c = self.peek()
+        if c == 'X':
+            self.pos += 1
+            expr = self.expression()
+            self.expect('E')
+            return expr
+        if c in ('J', 'I'):
+            # Old versions of GCC used I for argument packs.
+            self.pos += 1
+            args = []
+            while not self.consume('E'):
+                args.append(self.template_arg())
+            return _ArgPack(args)
+        if c == 'L':
+            return self.expr_primary()
+        return self.type()
+
+    def cv_qualifiers(self):
+        quals = ''
+        if self.consume('r'):
+            quals = ' restrict'
+        if self.consume('V'):
+            quals = ' volatile' + quals
+        if self.consume('K'):
+            quals = ' const' + quals
+        return quals
+
+    def type(self):
+        c = self.peek()
+        c1 = self.peek(1)
+        if c in _BUILTIN_TYPES:
+            self.pos += 1
+            return _Builtin(_BUILTIN_TYPES[c], c)
+        if c == 'D' and c1 in _D_BUILTIN_TYPES:
+            self.pos += 2
+            return _Builtin(_D_BUILTIN_TYPES[c1], 'D' + c1)
+        if c == 'D' and c1 == 'F':
+            self.pos += 2
+            bits = self.number()
+            self.expect('_')
+            return _Builtin('_Float%d' % bits, 'DF')
+
+        if c in ('r', 'V', 'K'):
+            quals = self.cv_qualifiers()
+            if self.peek() == 'F' or (self.peek() == 'D' and
+                                      self.peek(1) in ('o', 'O', 'w', 'x')):
+                type = self.function_type(quals)
+            else:
+                type = _QualType(self.type(), quals)
+        elif c == 'u':
+            self.pos += 1
+            type = self.source_name()
+        elif c == 'D':
+            self.pos += 2
+            if c1 == 'p':
+                type = _PackExpansion(self.type())
+            elif c1 in ('t', 'T'):
+                self.pos -= 2
+                type = self.decltype()
+            elif c1 == 'v':
+                if self.peek() == '_':
+                    self.pos += 1
+                    dimension = self.expression()
+                else:
+                    dimension = _Name(str(self.number()))
+                self.expect('_')
+                type = _PostfixType(self.type(), '')
+                type.postfix = ' __vector(%s)' % _print(dimension)
+            elif c1 in ('o', 'O', 'w', 'x'):
+                self.pos -= 2
+                type = self.function_type('')
+            else:
+                raise _Error()
+        elif c == 'F':
+            type = self.function_type('')
+        elif c == 'A':
+            type = self.array_type()
+        elif c == 'M':
+            self.pos += 1
+            cls = self.type()
+            type = _PointerToMemberType(cls, self.type())
+        elif c == 'T' and c1 not in ('s', 'u', 'e'):
+            type = self.template_param()
+            if self.parse_template_args and self.peek() == 'I':
+                self.subs.append(type)
+                type = _TemplateName(type, self.template_args(None))
+        elif c == 'P':
+            self.pos += 1
+            type = _PointerType(self.type(), '*')
+        elif c == 'R':
+            self.pos += 1
+            type = _PointerType(self.type(), '&')
+        elif c == 'O':
+            self.pos += 1
+            type = _PointerType(self.type(), '&&')
+        elif c == 'C':
+            self.pos += 1
+            type = _PostfixType(self.type(), ' _Complex')
+        elif c == 'G':
+            self.pos += 1
+            type = _PostfixType(self.type(), ' _Imaginary')
+        elif c == 'S' and c1 != 't':
+            sub = self.substitution()
+            if not (self.parse_template_args and self.peek() == 'I'):
+                return sub
+            type = _TemplateName(sub, self.template_args(None))
+        else:
+            # A class or enum type.
+            if c == 'T':
+                self.pos += 2
+            type = self.name(None)
+        self.subs.append(type)
+        return type
+
+    def function_type(self, quals):
+        exception_spec = None
+        if self.consume('Do'):
+            exception_spec = _Name(' noexcept')
+        elif self.consume('DO'):
+            exception_spec = _Prefixed(' noexcept(', self.expression(), ')')
+            self.expect('E')
+        elif self.consume('Dw'):
+            types = []
+            while not self.consume('E'):
+                types.append(self.type())
+            exception_spec = _Prefixed(' throw(', _ExprList(types), ')')
+        if self.consume('Dx'):
+            quals += ' transaction_safe'
+        self.expect('F')
+        self.consume('Y')
+        ret = self.type()
+        params = []
+        while not self.consume('E'):
+            if self.consume('RE'):
+                quals += ' &'
+                break
+            if self.consume('OE'):
+                quals += ' &&'
+                break
+            if self.peek() == 'v' and self.peek(1) == 'E':
+                self.pos += 1
+                continue
+            params.append(self.type())
+        return _FunctionType(ret, params, quals, exception_spec)
+
+    def array_type(self):
+        self.expect('A')
+        dimension = None
+        if self.peek().isdigit():
+            dimension = _Name(str(self.number()))
+        elif self.peek() != '_':
+            dimension = self.expression()
+        self.expect('_')
+        return _ArrayType(self.type(), dimension)
+
+    def decltype(self):
+        self.expect('D')
+        if not (self.consume('t') or self.consume('T')):
+            raise _Error()
+        expr = self.expression()
+        self.expect('E')
+        return _Prefixed('decltype (', expr, ')')
+
+    def expr_primary(self):
+        self.expect('L')
+        if self.consume('_Z') or self.consume('Z'):
+            encoding = self.encoding()
+            self.expect('E')
+            return encoding
+        type = self.type()
+        if isinstance(type, _Builtin) and type.code == 'Dn' and \
+                self.consume('E'):
+            return type
+        negative = self.consume('n')
+        start = self.pos
+        while self.peek() != 'E':
+            if not self.peek():
+                raise _Error()
+            self.pos += 1
+        value = self.s[start:self.pos]
+        self.pos += 1
+        return _Literal(type, value, negative)
+
+    def expressions(self, end='E'):
+        exprs = []
+        while not self.consume(end):
+            exprs.append(self.expression())
+        return exprs
+
+    def expression(self):
+        c = self.peek()
+        code = self.s[self.pos:self.pos + 2]
+        if c == 'L':
+            return self.expr_primary()
+        if c == 'T':
+            return self.template_param()
+        if code == 'fp':
+            # c++filt reads neither the qualifiers nor the fL<level>p form
+            # of a function parameter.
+            self.pos += 2
+            if self.consume('T'):
+                return _FunctionParam(0)
+            return _FunctionParam(self.optional_number() + 1)
+        if c.isdigit() or code in ('on', 'dn'):
+            return self.base_unresolved_name()
+        self.pos += 2
+        if code == 'sr':
+            return self.unresolved_name()
+        if code == 'gs':
+            return _Unary('::', self.expression())
+        if code == 'sp':
+            return _PackExpansion(self.expression())
+        if code == 'sZ':
+            return _SizeofPack(self.template_param() if self.peek() == 'T'
+                               else self.expression())
+        if code in ('st', 'at'):
+            return _SizeofType(_OPERATORS[code][0], self.type())
+        if code == 'tr':
+            return _Name('throw')
+        if code == 'il':
+            return _InitList(None, self.expressions())
+        if code == 'tl':
+            type = self.type()
+            return _InitList(type, self.expressions())
+        if code == 'cv':
+            type = self.type()
+            if self.consume('_'):
+                return _Cast(type, _ExprList(self.expressions()))
+            return _Cast(type, self.expression())
+        if code == 'cl':
+            function = self.expression()
+            return _Call(function, self.expressions())
+        if code in _NAMED_CASTS:
+            type = self.type()
+            return _NamedCast(_NAMED_CASTS[code], type, self.expression())
+        if code in ('dt', 'pt'):
+            lhs = self.expression()
+            if self.peek() in ('g', 's') and self.s[self.pos:self.pos + 2] \
+                    in ('gs', 'sr'):
+                rhs = self.expression()
+            else:
+                rhs = self.base_unresolved_name()
+            return _Binary(_OPERATORS[code][0], lhs, rhs)
+        if code not in _OPERATORS:
+            raise _Error()
+        (op, arity) = _OPERATORS[code]
+        if arity == 1:
+            suffix = code in ('pp', 'mm') and not self.consume('_')
+            return _Unary(op, self.expression(), suffix)
+        if arity == 2:
+            lhs = self.expression()
+            return _Binary(op, lhs, self.expression())
+        if code == 'qu':
+            cond = self.expression()
+            then = self.expression()
+            return _Conditional(cond, then, self.expression())
+        raise _Error()
+
+    def unresolved_name(self):
+        if self.peek().isdigit() and not self.old_unresolved_names:
+            self.read_new_unresolved_name = True
+            qualifier = self.simple_id()
+            while not self.consume('E'):
+                qualifier = _NestedName(qualifier, self.simple_id())
+        else:
+            # The old way, or an 'N' qualifier, which c++filt reads as a
+            # whole nested-name type.
+            qualifier = self.type()
+        name = self.base_unresolved_name()
+        if isinstance(name, _TemplateName):
+            # c++filt treats the template arguments as applying to the
+            # whole name.
+            return _TemplateName(_NestedName(qualifier, name.name), name.args)
+        return _NestedName(qualifier, name)
+
+    def simple_id(self):
+        name = self.source_name()
+        if self.peek() == 'I':
+            name = _TemplateName(name, self.template_args(None))
+        return name
+
+    def base_unresolved_name(self):
+        if self.consume('on'):
+            name = self.operator_name(None)
+        elif self.consume('dn'):
+            if self.peek().isdigit():
+                name = self.simple_id()
+            else:
+                name = self.type()
+            return _Prefixed('~', name)
+        else:
+            name = self.source_name()
+        if self.peek() == 'I':
+            name = _TemplateName(name, self.template_args(None))
+        return name
+
+
+def _note_templated(name):
+    """Tell a conversion operator, possibly nested in a class, that it's
+    being given template arguments."""
+    if isinstance(name, _NestedName):
+        name = name.name
+    if isinstance(name, _ConversionOperatorName):
+        name.templated = True
+
+
+def _print(node):
+    p = _Printer()
+    p.node(node)
+    return p.text()
+
+
+#
+# Rust
+#
+
+# The characters rustc's legacy mangling uses, besides letters and digits.
+_RUST_CHARS = frozenset('abcdefghijklmnopqrstuvwxyz'
+                        'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_$.:@')
+
+# What the escapes in Rust names stand for: '$LT$' is '<', and so on.
+_RUST_ESCAPES = {
+    'SP': '@', 'BP': '*', 'RF': '&', 'LT': '<', 'GT': '>', 'LP': '(',
+    'RP': ')',
+}
+
+_LOWER_HEX = '0123456789abcdef'
+
+
+def _demangle_rust(name, verbose):
+    """Demangle a name in rustc's legacy mangling, or return None if it isn't
+    one.
+
+    These look like the names of nested C++ entities, '_ZN3foo3bar17h...E',
+    whose last part is a hash, but their parts can hold '$' escapes and '..'
+    for '::'.  Like c++filt, we insist that the hash uses at least 5
+    different digits, so as not to take C++ names for Rust ones.
+
+    """
+    if not name.startswith('_ZN'):
+        return None
+    if any(c not in _RUST_CHARS for c in name):
+        return None
+    # Drop a suffix like '.llvm.1234' after the closing 'E'.
+    end = len(name) - 1 if name.endswith('E') else name.rfind('E.')
+    if end < 3:
+        return None
+    body = name[3:end]
+    if not (len(body) > 19 and body[-19:-16] == '17h'):
+        return None
+    parts = []
+    pos = 0
+    while pos < len(body):
+        start = pos
+        while pos < len(body) and body[pos].isdigit():
+            pos += 1
+        if start == pos or body[start] == '0':
+            return None
+        length = int(body[start:pos])
+        if pos + length > len(body):
+            return None
+        parts.append(body[pos:pos + length])
+        pos += length
+    digits = parts[-1][1:]
+    if not (len(parts[-1]) == 17 and parts[-1][0] == 'h' and
+            all(c in _LOWER_HEX for c in digits) and len(set(digits)) >= 5):
+        return None
+    if not verbose:
+        parts.pop()
+    return '::'.join([_rust_ident(part) for part in parts])
+
+
+def _rust_ident(text):
+    """Decode the escapes in one part of a Rust name."""
+    # rustc puts an underscore before an escape at the start of a part.
+    if text.startswith('_$'):
+        text = text[1:]
+    decoded = []
+    pos = 0
+    while pos < len(text):
+        if text[pos] == '$':
+            escape = _rust_escape(text[pos:])
+            if escape is None:
+                # Leave the rest of the part alone.
+                decoded.append(text[pos:])
+                break
+            decoded.append(escape[0])
+            pos += escape[1]
+        elif text.startswith('..', pos):
+            decoded.append('::')
+            pos += 2
+        elif text[pos] == '.':
+            decoded.append('.')
+            pos += 1
+        else:
+            start = pos
+            while pos < len(text) and text[pos] not in ('$', '.'):
+                pos += 1
+            decoded.append(text[start:pos])
+    return ''.join(decoded)
+
+
+def _rust_escape(text):
+    """Return (character, length) for the escape at the start of text, or
+    None if it isn't one we know."""
+    if len(text) < 3:
+        return None
+    if text[1] == 'C':
+        (char, length) = (',', 1)
+    elif len(text) > 3 and text[1:3] in _RUST_ESCAPES:
+        (char, length) = (_RUST_ESCAPES[text[1:3]], 2)
+    elif (len(text) > 4 and text[1] == 'u' and text[2] in _LOWER_HEX[:8] and
+          text[3] in _LOWER_HEX):
+        # Only printable ASCII characters.
+        if int(text[2:4], 16) < 0x20:
+            return None
+        (char, length) = (chr(int(text[2:4], 16)), 3)
+    else:
+        return None
+    if text[1 + length:2 + length] != '$':
+        return None
+    return (char, length + 2)
@@ -0,0 +1,1730 @@
+"""Symbolize addresses in ELF files without running binutils.
+
+ElfSymbolizer memory-maps an ELF file and answers batched lookups from its
+function symbols (.symtab, or .dynsym for stripped files) and its DWARF line
+table (.debug_line).  Nothing is read from a file until it's needed, and only
+the line programs of the compilation units which cover the looked up
+addresses are ever decoded, so symbolizing a handful of addresses in libxul
+is cheap.
+
+This needs no cross toolchain: 32- and 64-bit ELF files of either byte order
+and DWARF versions 2 to 5 are all handled here, and C++ names are demangled
+in-process by the demangler module rather than by running c++filt.
+
+"""
+
+from __future__ import print_function
+from __future__ import division
+
+import array
+import binascii
+import bisect
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from . import demangler
+
+
+class ElfError(Exception):
+    """Raised when a file isn't an ELF file we can read."""
+    pass
+
+
+# ELF constants.
+_ELFCLASS32 = 1
+_ELFCLASS64 = 2
+_ELFDATA2LSB = 1
+_ELFDATA2MSB = 2
+_EM_ARM = 40
+_SHT_SYMTAB = 2
+_SHT_NOTE = 7
+_SHT_NOBITS = 8
+_SHT_DYNSYM = 11
+_SHF_ALLOC = 0x2
+_SHF_EXECINSTR = 0x4
+_SHF_COMPRESSED = 0x800
+_SHN_UNDEF = 0
+_STT_NOTYPE = 0
+_STT_FUNC = 2
+_STT_FILE = 4
+_STT_GNU_IFUNC = 10
+_STB_LOCAL = 0
+_STV_HIDDEN = 2
+_NT_GNU_BUILD_ID = 3
+
+# DWARF constants.
+_DW_TAG_lexical_block = 0x0b
+_DW_TAG_compile_unit = 0x11
+_DW_TAG_inlined_subroutine = 0x1d
+_DW_TAG_subprogram = 0x2e
+_DW_TAG_namespace = 0x39
+_DW_TAG_partial_unit = 0x3c
+
+_DW_AT_sibling = 0x01
+_DW_AT_name = 0x03
+_DW_AT_stmt_list = 0x10
+_DW_AT_low_pc = 0x11
+_DW_AT_high_pc = 0x12
+_DW_AT_comp_dir = 0x1b
+_DW_AT_abstract_origin = 0x31
+_DW_AT_specification = 0x47
+_DW_AT_ranges = 0x55
+_DW_AT_call_file = 0x58
+_DW_AT_call_line = 0x59
+_DW_AT_linkage_name = 0x6e
+_DW_AT_str_offsets_base = 0x72
+_DW_AT_addr_base = 0x73
+_DW_AT_rnglists_base = 0x74
+_DW_AT_MIPS_linkage_name = 0x2007
+
+_DW_UT_compile = 0x01
+_DW_LNCT_path = 0x1
+_DW_LNCT_directory_index = 0x2
+
+_DW_FORM_addr = 0x01
+_DW_FORM_block2 = 0x03
+_DW_FORM_block4 = 0x04
+_DW_FORM_data2 = 0x05
+_DW_FORM_data4 = 0x06
+_DW_FORM_data8 = 0x07
+_DW_FORM_string = 0x08
+_DW_FORM_block = 0x09
+_DW_FORM_block1 = 0x0a
+_DW_FORM_data1 = 0x0b
+_DW_FORM_flag = 0x0c
+_DW_FORM_sdata = 0x0d
+_DW_FORM_strp = 0x0e
+_DW_FORM_udata = 0x0f
+_DW_FORM_ref_addr = 0x10
+_DW_FORM_ref1 = 0x11
+_DW_FORM_ref2 = 0x12
+_DW_FORM_ref4 = 0x13
+_DW_FORM_ref8 = 0x14
+_DW_FORM_ref_udata = 0x15
+_DW_FORM_indirect = 0x16
+_DW_FORM_sec_offset = 0x17
+_DW_FORM_exprloc = 0x18
+_DW_FORM_flag_present = 0x19
+_DW_FORM_strx = 0x1a
+_DW_FORM_addrx = 0x1b
+_DW_FORM_ref_sup4 = 0x1c
+_DW_FORM_strp_sup = 0x1d
+_DW_FORM_data16 = 0x1e
+_DW_FORM_line_strp = 0x1f
+_DW_FORM_ref_sig8 = 0x20
+_DW_FORM_implicit_const = 0x21
+_DW_FORM_loclistx = 0x22
+_DW_FORM_rnglistx = 0x23
+_DW_FORM_ref_sup8 = 0x24
+_DW_FORM_strx1 = 0x25
+_DW_FORM_strx2 = 0x26
+_DW_FORM_strx3 = 0x27
+_DW_FORM_strx4 = 0x28
+_DW_FORM_addrx1 = 0x29
+_DW_FORM_addrx2 = 0x2a
+_DW_FORM_addrx3 = 0x2b
+_DW_FORM_addrx4 = 0x2c
+_DW_FORM_GNU_addr_index = 0x1f01
+_DW_FORM_GNU_str_index = 0x1f02
+_DW_FORM_GNU_ref_alt = 0x1f20
+_DW_FORM_GNU_strp_alt = 0x1f21
+
+# Forms which are always the same number of bytes long.
+_FIXED_FORM_SIZES = {
+    _DW_FORM_data1: 1, _DW_FORM_ref1: 1, _DW_FORM_flag: 1,
+    _DW_FORM_strx1: 1, _DW_FORM_addrx1: 1,
+    _DW_FORM_data2: 2, _DW_FORM_ref2: 2, _DW_FORM_strx2: 2,
+    _DW_FORM_addrx2: 2,
+    _DW_FORM_strx3: 3, _DW_FORM_addrx3: 3,
+    _DW_FORM_data4: 4, _DW_FORM_ref4: 4, _DW_FORM_ref_sup4: 4,
+    _DW_FORM_strx4: 4, _DW_FORM_addrx4: 4,
+    _DW_FORM_data8: 8, _DW_FORM_ref8: 8, _DW_FORM_ref_sig8: 8,
+    _DW_FORM_ref_sup8: 8,
+    _DW_FORM_data16: 16,
+}
+
+# Forms which are a section offset, and so as long as the unit's offsets.
+_OFFSET_FORMS = frozenset([
+    _DW_FORM_strp, _DW_FORM_sec_offset, _DW_FORM_strp_sup,
+    _DW_FORM_line_strp, _DW_FORM_GNU_ref_alt, _DW_FORM_GNU_strp_alt,
+])
+
+# Forms which are a single LEB128 number.
+_LEB128_FORMS = frozenset([
+    _DW_FORM_udata, _DW_FORM_sdata, _DW_FORM_ref_udata, _DW_FORM_strx,
+    _DW_FORM_addrx, _DW_FORM_loclistx, _DW_FORM_rnglistx,
+    _DW_FORM_GNU_addr_index, _DW_FORM_GNU_str_index,
+])
+
+# Forms which index .debug_str_offsets and .debug_addr.
+_STRX_FORMS = frozenset([
+    _DW_FORM_strx, _DW_FORM_strx1, _DW_FORM_strx2, _DW_FORM_strx3,
+    _DW_FORM_strx4,
+])
+_ADDRX_FORMS = frozenset([
+    _DW_FORM_addrx, _DW_FORM_addrx1, _DW_FORM_addrx2, _DW_FORM_addrx3,
+    _DW_FORM_addrx4,
+])
+
+# Forms which refer to a DIE by its offset in the unit.
+_UNIT_REF_FORMS = frozenset([
+    _DW_FORM_ref1, _DW_FORM_ref2, _DW_FORM_ref4, _DW_FORM_ref8,
+    _DW_FORM_ref_udata,
+])
+
+# The attributes we look at when collecting inlined functions.
+_SCOPE_ATTRS = frozenset([
+    _DW_AT_sibling, _DW_AT_low_pc, _DW_AT_high_pc, _DW_AT_ranges,
+    _DW_AT_call_file, _DW_AT_call_line,
+])
+
+# DIEs whose children can be functions, even though they aren't functions.
+_CONTAINER_TAGS = frozenset([
+    _DW_TAG_compile_unit, _DW_TAG_partial_unit, _DW_TAG_namespace,
+    _DW_TAG_lexical_block,
+])
+
+# DWARF 5 range list entry kinds.
+_DW_RLE_end_of_list = 0
+_DW_RLE_base_addressx = 1
+_DW_RLE_startx_endx = 2
+_DW_RLE_startx_length = 3
+_DW_RLE_offset_pair = 4
+_DW_RLE_base_address = 5
+_DW_RLE_start_end = 6
+_DW_RLE_start_length = 7
+
+# DWARF line number program opcodes.
+_DW_LNS_copy = 1
+_DW_LNS_advance_pc = 2
+_DW_LNS_advance_line = 3
+_DW_LNS_set_file = 4
+_DW_LNS_const_add_pc = 8
+_DW_LNS_fixed_advance_pc = 9
+_DW_LNE_end_sequence = 1
+_DW_LNE_set_address = 2
+_DW_LNE_define_file = 3
+
+
+def _uleb128(data, pos):
+    """Decode an unsigned LEB128 number from the bytearray data at pos and
+    return (value, new_pos)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def _sleb128(data, pos):
+    """Decode a signed LEB128 number from the bytearray data at pos and
+    return (value, new_pos)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            if byte & 0x40:
+                result -= 1 << shift
+            return result, pos
+
+
+def _cstring(data, pos):
+    """Read a NUL-terminated string from the bytearray data at pos and return
+    (string, new_pos)."""
+    end = data.index(b'\0', pos)
+    return str(data[pos:end]), end + 1
+
+
+def demangle(names):
+    """Demangle a list of symbol names, some of which may be None, the way
+    addr2line -C does.
+
+    Names which aren't mangled C++ names, or which we can't demangle, are
+    returned unchanged.
+
+    """
+    return [name and demangler.demangle(name, verbose=False)
+            for name in names]
+
+
+class _LineTable(object):
+    """The rows of one compilation unit's line number program, sorted by
+    address.
+
+    Each sequence ends with a row whose line is 0, so that addresses in the
+    gaps between sequences don't get attributed to the row before them.
+
+    """
+    def __init__(self, addresses, files, lines, file_names):
+        self.addresses = addresses
+        self.files = files
+        self.lines = lines
+        self.file_names = file_names
+        # The .debug_info offset of the unit the table belongs to, if known.
+        self.info_offset = None
+
+    def lookup(self, address):
+        """Return (file, line) for the given address, or None."""
+        i = bisect.bisect_right(self.addresses, address) - 1
+        if i < 0 or not self.lines[i]:
+            return None
+        file_index = self.files[i]
+        if file_index >= len(self.file_names) or not self.file_names[file_index]:
+            return None
+        return (self.file_names[file_index], self.lines[i])
+
+
+class _Unit(object):
+    """A compilation unit's header, and the attributes of its top DIE which
+    the rest of the unit depends on."""
+    def __init__(self, offset):
+        self.offset = offset
+        self.end = offset
+        self.version = 0
+        self.offset_size = 4
+        self.address_size = 4
+        self.abbrev_offset = 0
+        self.die_start = None
+        self.low_pc = 0
+        self.comp_dir = None
+        self.stmt_list = None
+        self.str_offsets_base = None
+        self.addr_base = None
+        self.rnglists_base = None
+
+
+class _Scope(object):
+    """A function with code at the given address ranges: either a function
+    in its own right, or one inlined into another at call_file:call_line.
+
+    children holds the _Scopes of the functions inlined into this one.
+
+    """
+    __slots__ = ('ranges', 'die_offset', 'call_file', 'call_line', 'children')
+
+    def __init__(self, ranges, die_offset, call_file, call_line):
+        self.ranges = ranges
+        self.die_offset = die_offset
+        self.call_file = call_file
+        self.call_line = call_line
+        self.children = []
+
+
+class ElfSymbolizer(object):
+    """Translates addresses in an ELF file into function names and source
+    lines.
+
+    Addresses are virtual addresses in the file, i.e. what you'd pass to
+    addr2line.  Use ElfSymbolizer.get() to share one instance (and its
+    decoded tables) between every user of a file.  Instances are safe to use
+    from several threads.
+
+    Raises ElfError if path isn't an ELF file we understand.
+
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, path, demangle_names=True):
+        self.path = path
+        self._demangle_names = demangle_names
+        self._lock = threading.RLock()
+        try:
+            with open(path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError) as e:
+            raise ElfError('%s: %s' % (path, e))
+        try:
+            self._read_headers()
+        except (struct.error, IndexError, ValueError) as e:
+            self.close()
+            raise ElfError('%s: bad ELF headers (%s)' % (path, e))
+
+        self._symbols = None
+        # True if the names in _symbols are demangled already; if not, we
+        # demangle them as we need them, into _demangled_symbols.
+        self._symbols_demangled = False
+        self._demangled_symbols = {}
+        self._symbol_files = None
+        self._loaded_sections = None
+        self._abbrev_tables = {}
+        self._units = {}
+        self._unit_offsets = None
+        self._line_tables = {}
+        self._cu_tables = {}
+        self._range_starts = None
+        self._ranges = None
+        self._scopes = {}
+        self._function_names = {}
+        self._unit_loader = None
+        self._loaded_units = set()
+
+    @classmethod
+    def get(cls, path):
+        """Return the shared symbolizer for path, creating it if needed."""
+        key = os.path.realpath(path)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(path)
+            return cls._instances[key]
+
+    @classmethod
+    def close_all(cls):
+        """Close every shared symbolizer."""
+        with cls._instances_lock:
+            for symbolizer in cls._instances.values():
+                symbolizer.close()
+            cls._instances = {}
+
+    def close(self):
+        try:
+            self._map.close()
+        except (AttributeError, ValueError):
+            pass
+
+    def has_symbols(self):
+        """Return True if the file hasn't been stripped, i.e. it has a .symtab
+        or line number information."""
+        for section in self._sections.values():
+            if section['type'] == _SHT_SYMTAB and section['size']:
+                return True
+        return '.debug_line' in self._sections
+
+    def has_debug_info(self):
+        """Return True if the file has DWARF debug information, from which
+        addr2line names functions, rather than just a symbol table."""
+        return '.debug_info' in self._sections
+
+    def build_id(self):
+        """Return the file's GNU build ID as a byte string, or None if it has
+        none."""
+        note_header = struct.Struct(self._endian + 'III')
+        for section in self._section_list:
+            if section['type'] != _SHT_NOTE:
+                continue
+            pos = section['offset']
+            end = pos + section['size']
+            while pos + note_header.size <= end:
+                (namesz, descsz, note_type) = note_header.unpack_from(self._map, pos)
+                pos += note_header.size
+                name = self._map[pos:pos + namesz]
+                pos += (namesz + 3) & ~3
+                desc = self._map[pos:pos + descsz]
+                pos += (descsz + 3) & ~3
+                if note_type == _NT_GNU_BUILD_ID and name == b'GNU\0':
+                    return desc
+        return None
+
+    def breakpad_id(self):
+        """Return the file's breakpad ID, as found in profiles and breakpad
+        symbol files, or None if the file has no build ID to derive it from.
+
+        Like breakpad, we take the first 16 bytes of the build ID as a little
+        endian GUID and add an age of 0.
+
+        """
+        build_id = self.build_id()
+        if not build_id:
+            return None
+        guid = (build_id + b'\0' * 16)[:16]
+        (data1, data2, data3) = struct.unpack('<IHH', guid[:8])
+        return '%08X%04X%04X%s0' % (data1, data2, data3,
+                                    binascii.hexlify(guid[8:]).decode('ascii').upper())
+
+    def symbols(self):
+        """Return (addresses, sizes, names) for the file's function symbols.
+
+        addresses and sizes are array('L')s sorted by address, and names are
+        demangled unless this symbolizer was created with
+        demangle_names=False.
+
+        """
+        with self._lock:
+            self._ensure_symbols()
+            (addresses, sizes, names) = self._symbols
+            if not self._symbols_demangled:
+                names = self._demangle(names)
+            return (addresses, sizes, names)
+
+    def set_symbols(self, addresses, sizes, names):
+        """Use the given function symbols, as an earlier symbols() call for
+        this file returned them, instead of reading the file's symbol tables.
+
+        This lets callers keep the symbols (with their names already
+        demangled, so that we don't demangle them again) between runs.
+
+        """
+        with self._lock:
+            self._symbols = (addresses, sizes, list(names))
+            self._symbols_demangled = True
+            self._demangled_symbols = {}
+
+    def unit_offsets(self):
+        """Return the .debug_info offsets of the compilation units which
+        hold code, for unit_data()."""
+        with self._lock:
+            self._ensure_ranges()
+            offsets = set()
+            for (_, target) in self._ranges:
+                if isinstance(target, _LineTable):
+                    target = target.info_offset
+                if target is not None:
+                    offsets.add(target)
+            return sorted(offsets)
+
+    def unit_data(self, info_offset):
+        """Return what lookups need from the compilation unit at info_offset,
+        decoded, for a later set_unit_loader() to hand back.
+
+        This is (line_table, functions, scopes, names): the unit's line table
+        as (addresses, files, lines, file_names), its functions as (start,
+        end, scope index) tuples, every function and inlined function in it
+        as (ranges, die_offset, call_file, call_line, parent index) tuples,
+        parents first, and (die_offset, linkage_name, name) for each of
+        those, demangled.  It is all arrays, lists, tuples, strings and
+        numbers, so callers can pickle it.
+
+        """
+        with self._lock:
+            table = self._cu_line_table(info_offset)
+            if table is not None:
+                table = (table.addresses, table.files, table.lines,
+                         table.file_names)
+            functions = []
+            scopes = []
+            names = []
+            indexes = {}
+            pending = []
+            for (start, (end, scope)) in zip(*(self._unit_scopes(info_offset)
+                                               or ((), ()))):
+                if scope not in indexes:
+                    pending.append((scope, -1))
+                while pending:
+                    (child, parent) = pending.pop()
+                    indexes[child] = len(scopes)
+                    scopes.append((child.ranges, child.die_offset,
+                                   child.call_file, child.call_line, parent))
+                    self._function_name(child.die_offset)
+                    names.append((child.die_offset,) +
+                                 self._function_names[child.die_offset])
+                    pending.extend((grandchild, indexes[child])
+                                   for grandchild in reversed(child.children))
+                functions.append((start, end, indexes[scope]))
+            return (table, functions, scopes, names)
+
+    def set_unit_loader(self, loader):
+        """Have lookups call loader(info_offset) for a compilation unit
+        before decoding it themselves.  loader should return what
+        unit_data() returned for the unit, or None if it doesn't have it."""
+        with self._lock:
+            self._unit_loader = loader
+
+    def lookup(self, addresses, with_lines=True):
+        """Translate a list of addresses, as addr2line -f would.
+
+        Returns a (function, file, line) tuple for each address: the innermost
+        function inlined at the address, and the address's source line.
+        function and file are None, and line is 0, where we don't know them.
+        Pass with_lines=False if you only want the functions the symbol table
+        gives, as nm would; that spares us from reading any debug
+        information.
+
+        """
+        if with_lines:
+            return [frames[0] for frames in self.lookup_inlines(addresses)]
+        with self._lock:
+            self._ensure_symbols()
+            indexes = [self._symbol_index(address) for address in addresses]
+            return [(None if i is None else self._symbol_name(i), None, 0)
+                    for i in indexes]
+
+    def lookup_inlines(self, addresses):
+        """Translate a list of addresses, following inlining.
+
+        Returns a list of (function, file, line) tuples for each address, as
+        addr2line -i would give: first the innermost function inlined at the
+        address, with the address's source line, then the function it was
+        inlined into, with the line it was inlined at, and so on out to the
+        function whose code holds the address.
+
+        Like addr2line, we name functions from their debug information, so
+        that the cold part of a function is named for the function.  We only
+        take a name from the symbol table for code with no debug information,
+        or where the innermost function has no linkage name, as C functions
+        don't; the symbol table's file symbols also tell us which file a
+        static function is in when we don't know its line.
+
+        """
+        with self._lock:
+            self._ensure_symbols()
+            results = []
+            for address in addresses:
+                line_info = self._lookup_line(address)
+                target = self._unit_for_address(address)
+                if isinstance(target, _LineTable):
+                    target = target.info_offset
+                chain = []
+                if target is not None:
+                    chain = self._inline_chain(target, address)
+                i = self._symbol_index(address)
+                # Like addr2line, name the innermost function from its
+                # linkage name if it has one, or else from the symbol table.
+                name = chain and self._function_name(chain[-1].die_offset,
+                                                     linkage_only=True)
+                if not name and i is not None:
+                    name = self._symbol_name(i)
+                    (file_name, line) = line_info or (
+                        self._symbol_file(i), 0)
+                else:
+                    name = name or (chain and
+                                    self._function_name(chain[-1].die_offset))
+                    (file_name, line) = line_info or (None, 0)
+                frames = [(name or None, file_name, line)]
+                if len(chain) > 1:
+                    file_names = []
+                    line_table = self._cu_line_table(target)
+                    if line_table:
+                        file_names = line_table.file_names
+                    # Each function was inlined into the one before it in
+                    # the chain, at the call site its scope records.
+                    for (scope, caller) in zip(chain[:0:-1], chain[-2::-1]):
+                        file_name = None
+                        if scope.call_file < len(file_names):
+                            file_name = file_names[scope.call_file]
+                        frames.append((self._function_name(caller.die_offset),
+                                       file_name, scope.call_line))
+                results.append(frames)
+            return results
+
+    def _symbol_index(self, address):
+        """Return the index in the symbol table of the function holding
+        address, or None.
+
+        Like addr2line, we take that to be the last function which starts at
+        or before the address in the same section, whatever size the symbol
+        table gives it.
+
+        """
+        addresses = self._symbols[0]
+        i = bisect.bisect_right(addresses, address) - 1
+        if i < 0:
+            return None
+        section = self._section_holding(address)
+        if section is None or addresses[i] < section[0]:
+            return None
+        return i
+
+    def _section_holding(self, address):
+        """Return (start, end) for the loaded section holding address, or
+        None."""
+        if self._loaded_sections is None:
+            sections = sorted((s['addr'], s['addr'] + s['size'])
+                              for s in self._section_list
+                              if s['flags'] & _SHF_ALLOC and s['size'] and
+                              s['type'] != _SHT_NOBITS)
+            self._loaded_sections = (
+                array.array('L', [start for (start, _) in sections]), sections)
+        (starts, sections) = self._loaded_sections
+        i = bisect.bisect_right(starts, address) - 1
+        if i < 0 or address >= sections[i][1]:
+            return None
+        return sections[i]
+
+    def _symbol_name(self, i):
+        """Return the demangled name of the i'th function symbol."""
+        if self._symbols_demangled:
+            return self._symbols[2][i]
+        if i not in self._demangled_symbols:
+            self._demangled_symbols[i] = self._demangle([self._symbols[2][i]])[0]
+        return self._demangled_symbols[i]
+
+    def _symbol_file(self, i):
+        """Return the name of the file symbol which goes with the i'th
+        function symbol, or None."""
+        if self._symbol_files is None:
+            # set_symbols() gave us the symbols, but not their files.
+            self._symbol_files = {}
+            self._read_all_symbols({}, self._symbol_files)
+        return self._symbol_files.get(self._symbols[0][i])
+
+    def _demangle(self, names):
+        """Demangle a list of names, some of which may be None."""
+        if not self._demangle_names:
+            return list(names)
+        return demangle(names)
+
+    #
+    # ELF
+    #
+
+    def _read_headers(self):
+        m = self._map
+        if m[:4] != b'\x7fELF':
+            raise ElfError('%s: not an ELF file' % self.path)
+        elf_class = ord(m[4:5])
+        elf_data = ord(m[5:6])
+        if elf_data == _ELFDATA2LSB:
+            self._endian = '<'
+        elif elf_data == _ELFDATA2MSB:
+            self._endian = '>'
+        else:
+            raise ElfError('%s: unknown byte order' % self.path)
+        if elf_class == _ELFCLASS32:
+            ehdr, shdr, sym = 'HHIIIIIHHHHHH', 'IIIIIIIIII', 'IIIBBH'
+            self._address_size = 4
+        elif elf_class == _ELFCLASS64:
+            ehdr, shdr, sym = 'HHIQQQIHHHHHH', 'IIQQQQIIQQ', 'IBBHQQ'
+            self._address_size = 8
+        else:
+            raise ElfError('%s: unknown ELF class' % self.path)
+        self._elf_class = elf_class
+        self._int_formats = dict((size, self._endian + fmt) for (size, fmt) in
+                                 ((2, 'H'), (4, 'I'), (8, 'Q')))
+        self._sym_struct = struct.Struct(self._endian + sym)
+
+        (_, self._machine, _, _, _, shoff, _, _, _, _, shentsize, shnum,
+         shstrndx) = struct.unpack_from(self._endian + ehdr, m, 16)
+        shdr_struct = struct.Struct(self._endian + shdr)
+        headers = [shdr_struct.unpack_from(m, shoff + i * shentsize)
+                   for i in range(shnum)]
+
+        self._section_list = []
+        self._sections = {}
+        if not headers:
+            return
+        strtab_offset = headers[shstrndx][4]
+        for (name, sh_type, flags, addr, offset, size, link, _, _,
+             entsize) in headers:
+            section = {'name': self._string_at(strtab_offset + name),
+                       'type': sh_type, 'flags': flags, 'addr': addr,
+                       'offset': offset, 'size': size, 'link': link,
+                       'entsize': entsize}
+            self._section_list.append(section)
+            if sh_type != _SHT_NOBITS:
+                self._sections.setdefault(section['name'], section)
+
+    def _string_at(self, offset):
+        end = self._map.find(b'\0', offset)
+        return self._map[offset:end]
+
+    def _section_data(self, name, start=0, end=None):
+        """Return a bytearray holding (part of) the named section, or None if
+        the file has no such section."""
+        section = self._sections.get(name)
+        if section is None:
+            return None
+        if section['flags'] & _SHF_COMPRESSED:
+            if 'data' not in section:
+                section['data'] = self._decompress(section)
+            data = section['data']
+            return bytearray(data[start:end])
+        if end is None or end > section['size']:
+            end = section['size']
+        offset = section['offset']
+        return bytearray(self._map[offset + start:offset + end])
+
+    def _decompress(self, section):
+        if self._elf_class == _ELFCLASS32:
+            chdr = struct.Struct(self._endian + 'III')
+        else:
+            chdr = struct.Struct(self._endian + 'IIQQ')
+        start = section['offset'] + chdr.size
+        compressed = self._map[start:section['offset'] + section['size']]
+        try:
+            return zlib.decompress(compressed)
+        except zlib.error:
+            return b''
+
+    def _ensure_symbols(self):
+        if self._symbols is not None:
+            return
+        symbols = {}
+        self._symbol_files = {}
+        self._read_all_symbols(symbols, self._symbol_files)
+        addresses = array.array('L', sorted(symbols.keys()))
+        sizes = array.array('L', [symbols[a][0] for a in addresses])
+        names = [symbols[a][1] for a in addresses]
+        self._symbols = (addresses, sizes, names)
+
+    def _read_all_symbols(self, symbols, files):
+        """Read the function symbols from .symtab, or from .dynsym if the file
+        has been stripped; see _read_symbols."""
+        for sh_type in (_SHT_SYMTAB, _SHT_DYNSYM):
+            for section in self._section_list:
+                if section['type'] == sh_type:
+                    self._read_symbols(section, symbols, files)
+            if symbols:
+                break
+
+    def _read_symbols(self, section, symbols, files):
+        """Add the function symbols in the given symbol table section to the
+        symbols dict, which maps an address to a (size, name) tuple, and the
+        names of the files they're in, where the table says, to the files
+        dict."""
+        m = self._map
+        sym_struct = self._sym_struct
+        is_32 = self._elf_class == _ELFCLASS32
+        is_arm = self._machine == _EM_ARM
+        strtab_offset = self._section_list[section['link']]['offset']
+        entsize = section['entsize'] or sym_struct.size
+        exec_sections = set(i for (i, s) in enumerate(self._section_list)
+                            if s['flags'] & _SHF_EXECINSTR)
+        # Like addr2line, we take a function to be in the file named by the
+        # last file symbol before it, if it's local, or if it's global and
+        # there are no file symbols after the first other symbol.
+        file_name = None
+        global_files = True
+        seen_symbol = False
+        start = section['offset']
+        # Skip the null symbol at the start of the table.
+        for offset in range(start + entsize, start + section['size'], entsize):
+            if is_32:
+                (name, value, size, info, other, shndx) = \
+                    sym_struct.unpack_from(m, offset)
+            else:
+                (name, info, other, shndx, value, size) = \
+                    sym_struct.unpack_from(m, offset)
+            sym_type = info & 0xf
+            if sym_type == _STT_FILE:
+                file_name = self._string_at(strtab_offset + name) or None
+                global_files = global_files and not seen_symbol
+                continue
+            seen_symbol = True
+            if shndx == _SHN_UNDEF or not name:
+                continue
+            local = info >> 4 == _STB_LOCAL
+            if sym_type not in (_STT_FUNC, _STT_GNU_IFUNC):
+                # Hand-written assembly often leaves its functions untyped, so
+                # take untyped symbols in code sections too, but not ARM's
+                # mapping symbols, or the empty hidden ones annobin adds.
+                if sym_type != _STT_NOTYPE or shndx not in exec_sections:
+                    continue
+                if local and size == 0 and other & 3 == _STV_HIDDEN:
+                    continue
+                sym_name = self._string_at(strtab_offset + name)
+                if (local and is_arm and sym_name[:1] == b'$' and
+                        sym_name[1:2].islower() and sym_name[2:3] in (b'', b'.')):
+                    continue
+            if is_arm:
+                # Thumb functions have the low bit set.
+                value &= ~1
+            # Several names can alias one address; keep the first one, unless
+            # a later one knows how big the function is.
+            if value not in symbols or (size and not symbols[value][0]):
+                symbols[value] = (size, self._string_at(strtab_offset + name))
+                files[value] = file_name if local or global_files else None
+
+    #
+    # DWARF
+    #
+
+    def _lookup_line(self, address):
+        """Return (file, line) for the given address, or None."""
+        target = self._unit_for_address(address)
+        if target is None:
+            return None
+        if not isinstance(target, _LineTable):
+            target = self._cu_line_table(target)
+            if target is None:
+                return None
+        return target.lookup(address)
+
+    def _unit_for_address(self, address):
+        """Return the compilation unit covering address: its .debug_info
+        offset if we found it through .debug_aranges, or else its decoded line
+        table.  Returns None if no unit covers address."""
+        self._ensure_ranges()
+        i = bisect.bisect_right(self._range_starts, address) - 1
+        if i < 0:
+            return None
+        (end, target) = self._ranges[i]
+        if address >= end:
+            return None
+        return target
+
+    def _ensure_ranges(self):
+        """Work out which address ranges each compilation unit covers.
+
+        With .debug_aranges this is cheap, and we can leave the line programs
+        alone until an address in them is looked up.  Without it, we have to
+        decode every line program up front.
+
+        """
+        if self._ranges is not None:
+            return
+        ranges = []
+        if '.debug_line' in self._sections:
+            ranges = self._read_aranges()
+            if not ranges:
+                ranges = self._decode_all_line_programs()
+        ranges.sort(key=lambda r: r[0])
+        self._range_starts = array.array('L', [r[0] for r in ranges])
+        self._ranges = [(end, target) for (_, end, target) in ranges]
+
+    def _read_aranges(self):
+        data = self._section_data('.debug_aranges')
+        if not data:
+            return []
+        e = self._endian
+        ranges = []
+        pos = 0
+        while pos + 4 <= len(data):
+            (unit_length,) = struct.unpack_from(e + 'I', data, pos)
+            offset_size = 4
+            header_pos = pos + 4
+            if unit_length == 0xffffffff:
+                (unit_length,) = struct.unpack_from(e + 'Q', data, header_pos)
+                offset_size = 8
+                header_pos += 8
+            unit_end = header_pos + unit_length
+            info_offset = struct.unpack_from(
+                e + ('I' if offset_size == 4 else 'Q'), data, header_pos + 2)[0]
+            p = header_pos + 2 + offset_size
+            address_size = data[p]
+            segment_size = data[p + 1]
+            p += 2
+            if address_size not in (4, 8) or segment_size:
+                pos = unit_end
+                continue
+            # The tuples are aligned to twice the address size, counting from
+            # the start of the set.
+            tuple_size = 2 * address_size
+            p = pos + ((p - pos + tuple_size - 1) // tuple_size) * tuple_size
+            fmt = e + ('II' if address_size == 4 else 'QQ')
+            while p + tuple_size <= unit_end:
+                (start, length) = struct.unpack_from(fmt, data, p)
+                p += tuple_size
+                if not start and not length:
+                    break
+                # Code from discarded sections is left at address 0.
+                if start and length:
+                    ranges.append((start, start + length, info_offset))
+            pos = unit_end
+        return ranges
+
+    def _decode_all_line_programs(self):
+        data = self._section_data('.debug_line')
+        units = dict((unit.stmt_list, unit) for unit in self._all_units()
+                     if unit.stmt_list is not None)
+        ranges = []
+        pos = 0
+        while pos + 4 <= len(data):
+            unit = units.get(pos)
+            table = self._line_table(pos, unit.comp_dir if unit else None)
+            length = struct.unpack_from(self._endian + 'I', data, pos)[0]
+            if length == 0xffffffff:
+                length = struct.unpack_from(self._endian + 'Q', data, pos + 4)[0] + 8
+            pos += 4 + length
+            if table is None:
+                continue
+            if unit:
+                table.info_offset = unit.offset
+            # Add a range for each sequence in the table.
+            start = None
+            for (address, line) in zip(table.addresses, table.lines):
+                if start is None:
+                    start = address
+                if not line:
+                    if address > start:
+                        ranges.append((start, address, table))
+                    start = None
+        return ranges
+
+    def _cu_line_table(self, info_offset):
+        self._load_unit(info_offset)
+        if info_offset not in self._cu_tables:
+            table = None
+            unit = self._read_unit(info_offset)
+            if unit is not None and unit.stmt_list is not None:
+                table = self._line_table(unit.stmt_list, unit.comp_dir)
+            if table is not None:
+                table.info_offset = info_offset
+            self._cu_tables[info_offset] = table
+        return self._cu_tables[info_offset]
+
+    def _load_unit(self, info_offset):
+        """Take what we know about the compilation unit at info_offset from
+        our unit loader, if we have one and it has the unit."""
+        if self._unit_loader is None or info_offset in self._loaded_units:
+            return
+        self._loaded_units.add(info_offset)
+        data = self._unit_loader(info_offset)
+        if not data:
+            return
+        (table, functions, scopes, names) = data
+        if table is not None:
+            table = _LineTable(*table)
+            table.info_offset = info_offset
+        self._cu_tables[info_offset] = table
+        objects = []
+        for (ranges, die_offset, call_file, call_line, parent) in scopes:
+            scope = _Scope(ranges, die_offset, call_file, call_line)
+            if parent >= 0:
+                objects[parent].children.append(scope)
+            objects.append(scope)
+        self._scopes[info_offset] = None
+        if functions:
+            self._scopes[info_offset] = (
+                array.array('L', [start for (start, _, _) in functions]),
+                [(end, objects[i]) for (_, end, i) in functions])
+        for (die_offset, linkage_name, name) in names:
+            self._function_names[die_offset] = (linkage_name, name)
+
+    def _all_units(self):
+        """Return every compilation unit in .debug_info."""
+        if self._unit_offsets is None:
+            offsets = []
+            size = self._section_size('.debug_info')
+            pos = 0
+            while pos + 4 <= size:
+                unit = self._read_unit(pos)
+                if unit is None:
+                    break
+                offsets.append(pos)
+                pos = unit.end
+            self._unit_offsets = array.array('L', offsets)
+        return [self._read_unit(offset) for offset in self._unit_offsets]
+
+    def _unit_containing(self, offset):
+        """Return the compilation unit holding the DIE at offset in
+        .debug_info, or None."""
+        self._all_units()
+        i = bisect.bisect_right(self._unit_offsets, offset) - 1
+        if i < 0:
+            return None
+        unit = self._read_unit(self._unit_offsets[i])
+        if unit is None or offset >= unit.end:
+            return None
+        return unit
+
+    def _read_unit(self, offset):
+        """Read the header and top DIE of the compilation unit at offset in
+        .debug_info.  Returns a _Unit, or None if there's no unit there."""
+        if offset not in self._units:
+            try:
+                self._units[offset] = self._parse_unit(offset)
+            except (IndexError, ValueError, struct.error):
+                self._units[offset] = None
+        return self._units[offset]
+
+    def _parse_unit(self, offset):
+        e = self._endian
+        header = self._section_data('.debug_info', offset, offset + 32)
+        if header is None or len(header) < 11:
+            return None
+        unit = _Unit(offset)
+        (unit_length,) = struct.unpack_from(e + 'I', header, 0)
+        pos = 4
+        if unit_length == 0xffffffff:
+            (unit_length,) = struct.unpack_from(e + 'Q', header, 4)
+            unit.offset_size = 8
+            pos = 12
+        unit.end = offset + pos + unit_length
+        offset_fmt = e + ('I' if unit.offset_size == 4 else 'Q')
+        (unit.version,) = struct.unpack_from(e + 'H', header, pos)
+        pos += 2
+        if unit.version >= 5:
+            unit_type = header[pos]
+            unit.address_size = header[pos + 1]
+            (unit.abbrev_offset,) = struct.unpack_from(offset_fmt, header,
+                                                       pos + 2)
+            pos += 2 + unit.offset_size
+            if unit_type != _DW_UT_compile:
+                # Type units and the like have no code in them.
+                return unit
+        elif unit.version >= 2:
+            (unit.abbrev_offset,) = struct.unpack_from(offset_fmt, header, pos)
+            unit.address_size = header[pos + unit.offset_size]
+            pos += unit.offset_size + 1
+        else:
+            return unit
+
+        unit.die_start = offset + pos
+        die = self._read_die(unit, unit.die_start)
+        if die is None:
+            return unit
+        values = die[2]
+        # Read the bases first, since the other attributes can depend on them.
+        unit.str_offsets_base = values.get(_DW_AT_str_offsets_base, (0, None))[1]
+        unit.addr_base = values.get(_DW_AT_addr_base, (0, None))[1]
+        unit.rnglists_base = values.get(_DW_AT_rnglists_base, (0, None))[1]
+        unit.low_pc = self._attr_address(unit, values.get(_DW_AT_low_pc)) or 0
+        unit.comp_dir = self._attr_string(unit, values.get(_DW_AT_comp_dir))
+        if _DW_AT_stmt_list in values:
+            (form, value) = values[_DW_AT_stmt_list]
+            if form in (_DW_FORM_sec_offset, _DW_FORM_data4, _DW_FORM_data8):
+                unit.stmt_list = value
+        return unit
+
+    def _read_die(self, unit, offset):
+        """Read the DIE at offset in .debug_info, which is in unit.
+
+        Returns (tag, has_children, values, next_offset), where values maps
+        each of the DIE's attributes to a (form, raw value) tuple, or None if
+        there's no DIE there.
+
+        """
+        # DIEs are normally small, but the top DIE's producer string can be
+        # long when the compiler records its command line.
+        size = 4096
+        while True:
+            end = min(unit.end, offset + size)
+            data = self._section_data('.debug_info', offset, end)
+            try:
+                (code, pos) = _uleb128(data, 0)
+                if not code:
+                    return None
+                abbrev = self._abbrevs(unit.abbrev_offset).get(code)
+                if abbrev is None:
+                    return None
+                (tag, has_children, attrs) = abbrev
+                values = {}
+                for (attr, form, implicit) in attrs:
+                    (value, pos) = self._read_form(data, pos, form, implicit,
+                                                   unit.offset_size,
+                                                   unit.address_size,
+                                                   unit.version)
+                    values[attr] = (form, value)
+                return (tag, has_children, values, offset + pos)
+            except (IndexError, ValueError, struct.error):
+                if end >= unit.end:
+                    return None
+                size *= 16
+
+    def _abbrevs(self, abbrev_offset):
+        """Return the abbreviation table at abbrev_offset in .debug_abbrev, as
+        a dict mapping each code to (tag, has_children, attributes), where
+        attributes is a list of (attribute, form, implicit_const)."""
+        if abbrev_offset not in self._abbrev_tables:
+            self._abbrev_tables[abbrev_offset] = \
+                self._read_abbrevs(abbrev_offset)
+        return self._abbrev_tables[abbrev_offset]
+
+    def _read_abbrevs(self, abbrev_offset):
+        data = self._section_data('.debug_abbrev', abbrev_offset)
+        abbrevs = {}
+        if data is None:
+            return abbrevs
+        pos = 0
+        try:
+            while True:
+                (code, pos) = _uleb128(data, pos)
+                if not code:
+                    break
+                (tag, pos) = _uleb128(data, pos)
+                has_children = data[pos]
+                pos += 1
+                attrs = []
+                while True:
+                    (attr, pos) = _uleb128(data, pos)
+                    (form, pos) = _uleb128(data, pos)
+                    if not attr and not form:
+                        break
+                    implicit = None
+                    if form == _DW_FORM_implicit_const:
+                        (implicit, pos) = _sleb128(data, pos)
+                    attrs.append((attr, form, implicit))
+                abbrevs[code] = (tag, has_children, attrs)
+        except IndexError:
+            pass
+        return abbrevs
+
+    def _read_form(self, data, pos, form, implicit, offset_size, address_size,
+                   version):
+        """Read an attribute value of the given form from data at pos and
+        return (value, new_pos).
+
+        Strings held in the DIE itself come back as strs and blocks as None.
+        Everything else comes back as a number, which _attr_string,
+        _attr_address and _attr_ref turn into what it refers to.
+
+        """
+        if form in _FIXED_FORM_SIZES:
+            size = _FIXED_FORM_SIZES[form]
+            if size == 3:
+                (b0, b1, b2) = data[pos:pos + 3]
+                if self._endian == '<':
+                    return b0 | b1 << 8 | b2 << 16, pos + 3
+                return b0 << 16 | b1 << 8 | b2, pos + 3
+            if size == 16:
+                return None, pos + 16
+            return self._unpack(data, pos, size), pos + size
+        if form in _LEB128_FORMS:
+            if form == _DW_FORM_sdata:
+                return _sleb128(data, pos)
+            return _uleb128(data, pos)
+        if form in _OFFSET_FORMS:
+            return self._unpack(data, pos, offset_size), pos + offset_size
+        if form == _DW_FORM_string:
+            return _cstring(data, pos)
+        if form == _DW_FORM_addr:
+            return self._unpack(data, pos, address_size), pos + address_size
+        if form == _DW_FORM_flag_present:
+            return 1, pos
+        if form == _DW_FORM_implicit_const:
+            return implicit, pos
+        if form == _DW_FORM_ref_addr:
+            size = address_size if version == 2 else offset_size
+            return self._unpack(data, pos, size), pos + size
+        if form in (_DW_FORM_block, _DW_FORM_exprloc):
+            (length, pos) = _uleb128(data, pos)
+            return None, pos + length
+        if form == _DW_FORM_block1:
+            return None, pos + 1 + data[pos]
+        if form == _DW_FORM_block2:
+            return None, pos + 2 + self._unpack(data, pos, 2)
+        if form == _DW_FORM_block4:
+            return None, pos + 4 + self._unpack(data, pos, 4)
+        if form == _DW_FORM_indirect:
+            (form, pos) = _uleb128(data, pos)
+            return self._read_form(data, pos, form, implicit, offset_size,
+                                   address_size, version)
+        raise ValueError('unknown DWARF form 0x%x' % form)
+
+    def _unpack(self, data, pos, size):
+        """Read an unsigned integer size bytes long from data at pos."""
+        if size == 1:
+            return data[pos]
+        return struct.unpack_from(self._int_formats[size], data, pos)[0]
+
+    def _read_int(self, name, offset, size):
+        """Read an unsigned integer size bytes long from the named section, or
+        return None if it isn't there."""
+        data = self._section_data(name, offset, offset + size)
+        if data is None or len(data) < size or size not in self._int_formats:
+            return None
+        return self._unpack(data, 0, size)
+
+    def _attr_string(self, unit, attr_value):
+        """Return the string an attribute's (form, value) refers to, or None
+        if it isn't a string."""
+        if attr_value is None:
+            return None
+        (form, value) = attr_value
+        if form == _DW_FORM_string:
+            return value
+        if form == _DW_FORM_strp:
+            return self._debug_str('.debug_str', value)
+        if form == _DW_FORM_line_strp:
+            return self._debug_str('.debug_line_str', value)
+        if form in _STRX_FORMS:
+            if unit is None or unit.str_offsets_base is None:
+                return None
+            offset = self._read_int('.debug_str_offsets',
+                                    unit.str_offsets_base +
+                                    value * unit.offset_size,
+                                    unit.offset_size)
+            if offset is None:
+                return None
+            return self._debug_str('.debug_str', offset)
+        return None
+
+    def _attr_address(self, unit, attr_value):
+        """Return the address an attribute's (form, value) refers to, or None
+        if it isn't an address."""
+        if attr_value is None:
+            return None
+        (form, value) = attr_value
+        if form == _DW_FORM_addr:
+            return value
+        if form in _ADDRX_FORMS:
+            return self._debug_addr(unit, value)
+        return None
+
+    def _attr_ref(self, unit, attr_value):
+        """Return the .debug_info offset of the DIE an attribute's (form,
+        value) refers to, or None if it doesn't refer to one we can find."""
+        if attr_value is None:
+            return None
+        (form, value) = attr_value
+        if form in _UNIT_REF_FORMS:
+            return unit.offset + value
+        if form == _DW_FORM_ref_addr:
+            return value
+        return None
+
+    def _debug_addr(self, unit, index):
+        if unit.addr_base is None:
+            return None
+        return self._read_int('.debug_addr',
+                              unit.addr_base + index * unit.address_size,
+                              unit.address_size)
+
+    def _debug_str(self, name, offset):
+        section = self._sections.get(name)
+        if section is None:
+            return None
+        if section['flags'] & _SHF_COMPRESSED:
+            data = self._section_data(name, offset)
+            return _cstring(data, 0)[0]
+        return self._string_at(section['offset'] + offset)
+
+    def _section_size(self, name):
+        section = self._sections.get(name)
+        if section is None:
+            return 0
+        if section['flags'] & _SHF_COMPRESSED:
+            return len(self._section_data(name))
+        return section['size']
+
+    def _die_ranges(self, unit, values):
+        """Return the list of (low, high) address ranges covered by a DIE with
+        the given attribute values."""
+        if _DW_AT_ranges in values:
+            (form, value) = values[_DW_AT_ranges]
+            try:
+                return self._read_ranges(unit, form, value)
+            except (IndexError, struct.error):
+                return []
+        low = self._attr_address(unit, values.get(_DW_AT_low_pc))
+        high = values.get(_DW_AT_high_pc)
+        # Code from discarded sections is left at address 0.
+        if not low or high is None:
+            return []
+        if high[0] == _DW_FORM_addr or high[0] in _ADDRX_FORMS:
+            high = self._attr_address(unit, high)
+        else:
+            # Since DWARF 4, high_pc can be the size of the code.
+            high = low + high[1]
+        if high is None or high <= low:
+            return []
+        return [(low, high)]
+
+    def _read_ranges(self, unit, form, value):
+        """Read the range list referred to by a DW_AT_ranges attribute."""
+        ranges = []
+        base = unit.low_pc
+        size = unit.address_size
+        if unit.version < 5:
+            # .debug_ranges holds (start, end) pairs relative to a base
+            # address, which a pair starting with the largest address changes.
+            max_address = (1 << (8 * size)) - 1
+            pos = value
+            while True:
+                start = self._read_int('.debug_ranges', pos, size)
+                end = self._read_int('.debug_ranges', pos + size, size)
+                pos += 2 * size
+                if start is None or end is None or (not start and not end):
+                    break
+                if start == max_address:
+                    base = end
+                elif end > start and base + start:
+                    ranges.append((base + start, base + end))
+            return ranges
+
+        if form == _DW_FORM_rnglistx:
+            if unit.rnglists_base is None:
+                return ranges
+            offset = self._read_int('.debug_rnglists',
+                                    unit.rnglists_base +
+                                    value * unit.offset_size,
+                                    unit.offset_size)
+            if offset is None:
+                return ranges
+            offset += unit.rnglists_base
+        else:
+            offset = value
+        # Range lists are short, so read the section a little at a time.
+        data = bytearray()
+        exhausted = False
+        pos = 0
+        while True:
+            if len(data) - pos < 64 and not exhausted:
+                more = self._section_data('.debug_rnglists',
+                                          offset + len(data),
+                                          offset + len(data) + 4096)
+                if more:
+                    data.extend(more)
+                else:
+                    exhausted = True
+            if pos >= len(data):
+                break
+            kind = data[pos]
+            pos += 1
+            if kind == _DW_RLE_end_of_list:
+                break
+            elif kind == _DW_RLE_base_addressx:
+                (index, pos) = _uleb128(data, pos)
+                base = self._debug_addr(unit, index) or 0
+            elif kind == _DW_RLE_startx_endx:
+                (start, pos) = _uleb128(data, pos)
+                (end, pos) = _uleb128(data, pos)
+                start = self._debug_addr(unit, start)
+                end = self._debug_addr(unit, end)
+                if start and end:
+                    ranges.append((start, end))
+            elif kind == _DW_RLE_startx_length:
+                (start, pos) = _uleb128(data, pos)
+                (length, pos) = _uleb128(data, pos)
+                start = self._debug_addr(unit, start)
+                if start:
+                    ranges.append((start, start + length))
+            elif kind == _DW_RLE_offset_pair:
+                (start, pos) = _uleb128(data, pos)
+                (end, pos) = _uleb128(data, pos)
+                if base + start:
+                    ranges.append((base + start, base + end))
+            elif kind == _DW_RLE_base_address:
+                base = self._unpack(data, pos, size)
+                pos += size
+            elif kind == _DW_RLE_start_end:
+                start = self._unpack(data, pos, size)
+                end = self._unpack(data, pos + size, size)
+                pos += 2 * size
+                if start:
+                    ranges.append((start, end))
+            elif kind == _DW_RLE_start_length:
+                start = self._unpack(data, pos, size)
+                (length, pos) = _uleb128(data, pos + size)
+                if start:
+                    ranges.append((start, start + length))
+            else:
+                break
+        return [(start, end) for (start, end) in ranges if end > start]
+
+    #
+    # Inlined functions
+    #
+
+    def _inline_chain(self, info_offset, address):
+        """Return the functions covering address in the compilation unit at
+        info_offset, as a list of _Scopes: the function holding the address
+        first, then the function inlined into it there, and so on."""
+        scopes = self._unit_scopes(info_offset)
+        if not scopes:
+            return []
+        (starts, functions) = scopes
+        i = bisect.bisect_right(starts, address) - 1
+        if i < 0 or address >= functions[i][0]:
+            return []
+        chain = [functions[i][1]]
+        while True:
+            for child in chain[-1].children:
+                if any(low <= address < high for (low, high) in child.ranges):
+                    chain.append(child)
+                    break
+            else:
+                return chain
+
+    def _unit_scopes(self, info_offset):
+        """Return (starts, functions) for the compilation unit at info_offset,
+        where functions is a list of (end, _Scope) sorted by the start
+        addresses in starts, or None if the unit has no functions."""
+        self._load_unit(info_offset)
+        if info_offset not in self._scopes:
+            scopes = None
+            unit = self._read_unit(info_offset)
+            if unit is not None and unit.die_start is not None:
+                try:
+                    scopes = self._read_scopes(unit)
+                except (IndexError, KeyError, ValueError, struct.error):
+                    pass
+            self._scopes[info_offset] = scopes
+        return self._scopes[info_offset]
+
+    def _read_scopes(self, unit):
+        """Walk the DIEs of unit, collecting its functions and the functions
+        inlined into each of them."""
+        data = self._section_data('.debug_info', unit.offset, unit.end)
+        abbrevs = self._abbrevs(unit.abbrev_offset)
+        read_form = self._read_form
+        (offset_size, address_size, version) = \
+            (unit.offset_size, unit.address_size, unit.version)
+        functions = []
+        # The scope which the children of each open DIE belong to.
+        parents = []
+        scope = None
+        pos = unit.die_start - unit.offset
+        while pos < len(data):
+            die_offset = unit.offset + pos
+            (code, pos) = _uleb128(data, pos)
+            if not code:
+                if not parents:
+                    break
+                scope = parents.pop()
+                continue
+            (tag, has_children, attrs) = abbrevs[code]
+            values = {}
+            for (attr, form, implicit) in attrs:
+                (value, pos) = read_form(data, pos, form, implicit,
+                                         offset_size, address_size, version)
+                if attr in _SCOPE_ATTRS:
+                    values[attr] = (form, value)
+
+            child_scope = scope
+            if tag == _DW_TAG_subprogram or tag == _DW_TAG_inlined_subroutine:
+                ranges = self._die_ranges(unit, values)
+                child_scope = None
+                if not ranges:
+                    # A declaration, an abstract instance which only exists
+                    # to be inlined, or code which was optimized away.
+                    pass
+                elif tag == _DW_TAG_subprogram:
+                    child_scope = _Scope(ranges, die_offset, 0, 0)
+                    for (low, high) in ranges:
+                        functions.append((low, high, child_scope))
+                elif scope is not None:
+                    child_scope = _Scope(
+                        ranges, die_offset,
+                        values.get(_DW_AT_call_file, (0, 0))[1],
+                        values.get(_DW_AT_call_line, (0, 0))[1])
+                    scope.children.append(child_scope)
+
+            if has_children:
+                # Skip over the children of DIEs which can't hold code, like
+                # types, when the DIE tells us where its next sibling is.
+                if (child_scope is None and tag not in _CONTAINER_TAGS and
+                        _DW_AT_sibling in values):
+                    sibling = self._attr_ref(unit, values[_DW_AT_sibling])
+                    if sibling is not None and sibling > die_offset:
+                        pos = sibling - unit.offset
+                        continue
+                parents.append(scope)
+                scope = child_scope
+
+        if not functions:
+            return None
+        functions.sort(key=lambda f: f[0])
+        return (array.array('L', [f[0] for f in functions]),
+                [(high, s) for (_, high, s) in functions])
+
+    def _function_name(self, offset, linkage_only=False):
+        """Return the name of the function whose DIE is at offset, following
+        DW_AT_abstract_origin and DW_AT_specification to find it.  We prefer
+        the (mangled) linkage name, which says which class and namespace the
+        function is in; pass linkage_only=True to get None rather than the
+        plain name of a function which has no linkage name.  Names come back
+        demangled."""
+        if offset not in self._function_names:
+            linkage_name = None
+            name = None
+            die_offset = offset
+            seen = set()
+            while die_offset is not None and die_offset not in seen:
+                seen.add(die_offset)
+                unit = self._unit_containing(die_offset)
+                die = unit and self._read_die(unit, die_offset)
+                if not die:
+                    break
+                values = die[2]
+                linkage_name = self._attr_string(
+                    unit, values.get(_DW_AT_linkage_name,
+                                     values.get(_DW_AT_MIPS_linkage_name)))
+                if linkage_name:
+                    break
+                name = name or self._attr_string(unit, values.get(_DW_AT_name))
+                die_offset = self._attr_ref(
+                    unit, values.get(_DW_AT_abstract_origin,
+                                     values.get(_DW_AT_specification)))
+            self._function_names[offset] = tuple(
+                self._demangle([linkage_name, name]))
+        (linkage_name, name) = self._function_names[offset]
+        return linkage_name if linkage_only else linkage_name or name
+
+    def _line_table(self, offset, comp_dir):
+        """Decode the line number program at offset in .debug_line, and return
+        its rows as a _LineTable, or None if it can't be decoded."""
+        key = (offset, comp_dir)
+        if key not in self._line_tables:
+            try:
+                self._line_tables[key] = self._decode_line_program(offset,
+                                                                   comp_dir)
+            except (IndexError, ValueError, struct.error):
+                self._line_tables[key] = None
+        return self._line_tables[key]
+
+    def _decode_line_program(self, offset, comp_dir):
+        e = self._endian
+        header = self._section_data('.debug_line', offset, offset + 12)
+        (unit_length,) = struct.unpack_from(e + 'I', header, 0)
+        offset_size = 4
+        if unit_length == 0xffffffff:
+            (unit_length,) = struct.unpack_from(e + 'Q', header, 4)
+            offset_size = 8
+        data = self._section_data('.debug_line', offset,
+                                  offset + offset_size + unit_length +
+                                  (4 if offset_size == 8 else 0))
+        offset_fmt = e + ('I' if offset_size == 4 else 'Q')
+        pos = 4 if offset_size == 4 else 12
+        unit_end = len(data)
+
+        (version,) = struct.unpack_from(e + 'H', data, pos)
+        pos += 2
+        if version < 2 or version > 5:
+            return None
+        address_size = self._address_size
+        if version >= 5:
+            address_size = data[pos]
+            pos += 2  # address_size, segment_selector_size
+        (header_length,) = struct.unpack_from(offset_fmt, data, pos)
+        pos += offset_size
+        program_start = pos + header_length
+        min_inst_length = data[pos]
+        pos += 1
+        if version >= 4:
+            pos += 1  # maximum_operations_per_instruction
+        pos += 1  # default_is_stmt
+        line_base = data[pos]
+        if line_base >= 0x80:
+            line_base -= 0x100
+        line_range = data[pos + 1]
+        opcode_base = data[pos + 2]
+        pos += 3
+        opcode_lengths = [0] + list(data[pos:pos + opcode_base - 1])
+        pos += opcode_base - 1
+
+        if version >= 5:
+            (dirs, pos) = self._read_v5_entries(data, pos, offset_size,
+                                                address_size)
+            dirs = [d[0] for d in dirs]
+            (files, pos) = self._read_v5_entries(data, pos, offset_size,
+                                                 address_size)
+            base_dir = dirs[0] if dirs and dirs[0] else (comp_dir or '')
+        else:
+            dirs = [comp_dir or '']
+            while data[pos]:
+                (name, pos) = _cstring(data, pos)
+                dirs.append(name)
+            pos += 1
+            # File numbers start at 1 before DWARF 5.
+            files = [(None, 0)]
+            while data[pos]:
+                (name, pos) = _cstring(data, pos)
+                (dir_index, pos) = _uleb128(data, pos)
+                (_, pos) = _uleb128(data, pos)  # mtime
+                (_, pos) = _uleb128(data, pos)  # length
+                files.append((name, dir_index))
+            base_dir = comp_dir or ''
+
+        # Run the line number program, collecting each sequence's rows.
+        sequences = []
+        rows_addresses = []
+        rows_files = []
+        rows_lines = []
+        address = 0
+        file_index = 1
+        line = 1
+        address_fmt = e + ('I' if address_size == 4 else 'Q')
+        special_opcode_step = (255 - opcode_base) // line_range
+        pos = program_start
+        while pos < unit_end:
+            opcode = data[pos]
+            pos += 1
+            if opcode >= opcode_base:
+                adjusted = opcode - opcode_base
+                address += (adjusted // line_range) * min_inst_length
+                line += line_base + adjusted % line_range
+                rows_addresses.append(address)
+                rows_files.append(file_index)
+                rows_lines.append(line)
+            elif opcode == 0:
+                (length, pos) = _uleb128(data, pos)
+                end = pos + length
+                sub_opcode = data[pos]
+                if sub_opcode == _DW_LNE_end_sequence:
+                    rows_addresses.append(address)
+                    rows_files.append(0)
+                    rows_lines.append(0)
+                    # Code from discarded sections is left at address 0.
+                    if rows_addresses[0]:
+                        sequences.append((rows_addresses, rows_files,
+                                          rows_lines))
+                    rows_addresses = []
+                    rows_files = []
+                    rows_lines = []
+                    address = 0
+                    file_index = 1
+                    line = 1
+                elif sub_opcode == _DW_LNE_set_address:
+                    if length - 1 == 4:
+                        (address,) = struct.unpack_from(e + 'I', data, pos + 1)
+                    elif length - 1 == 8:
+                        (address,) = struct.unpack_from(e + 'Q', data, pos + 1)
+                    else:
+                        (address,) = struct.unpack_from(address_fmt, data,
+                                                        pos + 1)
+                elif sub_opcode == _DW_LNE_define_file:
+                    (name, p) = _cstring(data, pos + 1)
+                    (dir_index, p) = _uleb128(data, p)
+                    files.append((name, dir_index))
+                pos = end
+            elif opcode == _DW_LNS_copy:
+                rows_addresses.append(address)
+                rows_files.append(file_index)
+                rows_lines.append(line)
+            elif opcode == _DW_LNS_advance_pc:
+                (advance, pos) = _uleb128(data, pos)
+                address += advance * min_inst_length
+            elif opcode == _DW_LNS_advance_line:
+                (advance, pos) = _sleb128(data, pos)
+                line += advance
+            elif opcode == _DW_LNS_set_file:
+                (file_index, pos) = _uleb128(data, pos)
+            elif opcode == _DW_LNS_const_add_pc:
+                address += special_opcode_step * min_inst_length
+            elif opcode == _DW_LNS_fixed_advance_pc:
+                (advance,) = struct.unpack_from(e + 'H', data, pos)
+                address += advance
+                pos += 2
+            else:
+                # Skip the operands of the opcodes we don't care about.
+                for _ in range(opcode_lengths[opcode]):
+                    (_, pos) = _uleb128(data, pos)
+
+        sequences.sort(key=lambda s: s[0][0])
+        addresses = array.array('L')
+        table_files = array.array('L')
+        lines = array.array('L')
+        for (seq_addresses, seq_files, seq_lines) in sequences:
+            addresses.extend(seq_addresses)
+            table_files.extend(seq_files)
+            lines.extend(seq_lines)
+
+        def file_path(entry):
+            (name, dir_index) = entry
+            if not name:
+                return None
+            if os.path.isabs(name):
+                return name
+            directory = dirs[dir_index] if dir_index < len(dirs) else ''
+            return os.path.join(base_dir, directory or '', name)
+
+        file_names = [file_path(f) for f in files]
+        return _LineTable(addresses, table_files, lines, file_names)
+
+    def _read_v5_entries(self, data, pos, offset_size, address_size):
+        """Read a DWARF 5 directory or file name table and return
+        ([(path, directory_index), ...], new_pos)."""
+        format_count = data[pos]
+        pos += 1
+        formats = []
+        for _ in range(format_count):
+            (content_type, pos) = _uleb128(data, pos)
+            (form, pos) = _uleb128(data, pos)
+            formats.append((content_type, form))
+        (count, pos) = _uleb128(data, pos)
+        entries = []
+        for _ in range(count):
+            path = None
+            dir_index = 0
+            for (content_type, form) in formats:
+                (value, pos) = self._read_form(data, pos, form, None,
+                                               offset_size, address_size, 5)
+                if content_type == _DW_LNCT_path:
+                    path = self._attr_string(None, (form, value))
+                elif content_type == _DW_LNCT_directory_index:
+                    dir_index = value
+            entries.append((path, dir_index))
+        return entries, pos
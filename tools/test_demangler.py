@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+"""Tests for include/demangler.py.
+
+The expected names are what GNU c++filt 2.40 prints for each mangled name,
+and, for the brief forms, what addr2line -C and nm -C print.  Run these from
+the tools directory with
+
+  python -m unittest discover -p 'test_*.py'
+
+"""
+
+from __future__ import print_function
+
+import unittest
+
+import include.demangler as demangler
+
+# (mangled, c++filt's name, addr2line's name)
+NAMES = [
+    ('_Z11sum_squaresi',
+     'sum_squares(int)',
+     'sum_squares(int)'),
+    ('_ZN7mozilla6Thread5CountERKSt6vectorIiSaIiEE',
+     'mozilla::Thread::Count(std::vector<int, std::allocator<int> > const&)',
+     'mozilla::Thread::Count(std::vector<int, std::allocator<int> > const&)'),
+    ('_ZGVZ1fIiEvvE1x',
+     'guard variable for f<int>()::x',
+     'guard variable for f<int>()::x'),
+    ('_Z8makeNameB5cxx11PKc',
+     'makeName[abi:cxx11](char const*)',
+     'makeName[abi:cxx11](char const*)'),
+
+    # Clones, which GCC splits out of a function.
+    ('_Z11sum_squaresi.cold',
+     'sum_squares(int) [clone .cold]',
+     'sum_squares(int) [clone .cold]'),
+    ('_Z1fv.cold.1',
+     'f() [clone .cold.1]',
+     'f() [clone .cold.1]'),
+
+    # Lambdas nested in lambdas, and in templates' arguments.
+    ('_ZZNSt9once_flag18_Prepare_executionC4IZSt9call_onceIRFvvEJEEvRS_OT_'
+     'DpOT0_EUlvE_EERS6_ENUlvE_4_FUNEv',
+     'std::once_flag::_Prepare_execution::_Prepare_execution<std::call_once'
+     '<void (&)()>(std::once_flag&, void (&)())::{lambda()#1}>(void (&)())::'
+     '{lambda()#1}::_FUN()',
+     'std::once_flag::_Prepare_execution::_Prepare_execution<std::call_once'
+     '<void (&)()>(std::once_flag&, void (&)())::{lambda()#1}>(void (&)())::'
+     '{lambda()#1}::_FUN()'),
+    ('_ZZNK18grpc_ev_none_posixMUlvE_clEvENUlvE1_4_FUNEv',
+     'grpc_ev_none_posix::{lambda()#1}::operator()() const::{lambda()#3}::'
+     '_FUN()',
+     'grpc_ev_none_posix::{lambda()#1}::operator()() const::{lambda()#3}::'
+     '_FUN()'),
+
+    # Template parameters substituted into references and qualified types.
+    ('_ZSt9call_onceIMSt6threadFvvEJPS0_EEvRSt9once_flagOT_DpOT0_',
+     'void std::call_once<void (std::thread::*)(), std::thread*>'
+     '(std::once_flag&, void (std::thread::*&&)(), std::thread*&&)',
+     'void std::call_once<void (std::thread::*)(), std::thread*>'
+     '(std::once_flag&, void (std::thread::*&&)(), std::thread*&&)'),
+    ('_Z1fIKiEvKT_',
+     'void f<int const>(int const)',
+     'void f<int const>(int const)'),
+    ('_Z1fIKiEvPVKT_',
+     'void f<int const>(int const volatile*)',
+     'void f<int const>(int const volatile*)'),
+    ('_Z1fIVKiEvPKT_',
+     'void f<int const volatile>(int volatile const*)',
+     'void f<int const volatile>(int volatile const*)'),
+    ('_ZN2v88internal15SearchStringRawIKtS2_EElPNS0_7IsolateEPKT_iPKT0_ii',
+     'long v8::internal::SearchStringRaw<unsigned short const, unsigned short '
+     'const>(v8::internal::Isolate*, unsigned short const*, int, unsigned '
+     'short const*, int, int)',
+     'long v8::internal::SearchStringRaw<unsigned short const, unsigned short '
+     'const>(v8::internal::Isolate*, unsigned short const*, int, unsigned '
+     'short const*, int, int)'),
+
+    # Unresolved names, in both the old and the new syntax.
+    ('_ZN4llvm10checkedAddIiEENSt9enable_ifIXsr3std9is_signedIT_EE5valueENS_'
+     '8OptionalIS2_EEE4typeES2_S2_',
+     'std::enable_if<std::is_signed<int>::value, llvm::Optional<int> >::type '
+     'llvm::checkedAdd<int>(int, int)',
+     'std::enable_if<std::is_signed<int>::value, llvm::Optional<int> >::type '
+     'llvm::checkedAdd<int>(int, int)'),
+    ('_Z10multiple_pILj1EljEN10if_nonpolyIT1_bXsr15poly_int_traitsIS1_E7is_'
+     'polyEE4typeERK12poly_int_podIXT_ET0_ES1_',
+     'if_nonpoly<unsigned int, bool, poly_int_traits<unsigned int>::is_poly>::'
+     'type multiple_p<1u, long, unsigned int>(poly_int_pod<1u, long> const&, '
+     'unsigned int)',
+     'if_nonpoly<unsigned int, bool, poly_int_traits<unsigned int>::is_poly>::'
+     'type multiple_p<1u, long, unsigned int>(poly_int_pod<1u, long> const&, '
+     'unsigned int)'),
+
+    # Function parameters in decltypes.  c++filt can't read the fL form.
+    ('_ZN4llvm25OptimizationRemarkEmitter4emitIZNS_17LoopVectorizePass11'
+     'processLoopEPNS_4LoopEE3$_5EEvT_PDTclfp_EE',
+     'void llvm::OptimizationRemarkEmitter::emit<llvm::LoopVectorizePass::'
+     'processLoop(llvm::Loop*)::$_5>(llvm::LoopVectorizePass::processLoop'
+     '(llvm::Loop*)::$_5, decltype ({parm#1}())*)',
+     'void llvm::OptimizationRemarkEmitter::emit<llvm::LoopVectorizePass::'
+     'processLoop(llvm::Loop*)::$_5>(llvm::LoopVectorizePass::processLoop'
+     '(llvm::Loop*)::$_5, decltype ({parm#1}())*)'),
+    ('_ZN4llvm25OptimizationRemarkEmitter4emitIZNS_17LoopVectorizePass11'
+     'processLoopEPNS_4LoopEE3$_5EEvT_PDTclfL0p_EE',
+     '_ZN4llvm25OptimizationRemarkEmitter4emitIZNS_17LoopVectorizePass11'
+     'processLoopEPNS_4LoopEE3$_5EEvT_PDTclfL0p_EE',
+     '_ZN4llvm25OptimizationRemarkEmitter4emitIZNS_17LoopVectorizePass11'
+     'processLoopEPNS_4LoopEE3$_5EEvT_PDTclfL0p_EE'),
+    ('_ZN1A4emitEvPDTclfpTEE',
+     'A::emit(void, decltype (this())*)',
+     'A::emit(void, decltype (this())*)'),
+
+    # Conversion operators, which c++filt can only sometimes read.
+    ('_ZNK1AcvT_IiEEv',
+     'A::operator int<int>() const',
+     'A::operator int<int>() const'),
+    ('_ZN3URIcvNSt7__cxx1112basic_stringIcSt11char_traitsIcESaIcEEEEv',
+     'URI::operator std::__cxx11::basic_string<char, std::char_traits<char>, '
+     'std::allocator<char> >()',
+     'URI::operator std::__cxx11::basic_string<char, std::char_traits<char>, '
+     'std::allocator<char> >()'),
+    ('_ZNK1AcvNS_1CIT_EEIiEEv',
+     '_ZNK1AcvNS_1CIT_EEIiEEv',
+     '_ZNK1AcvNS_1CIT_EEIiEEv'),
+    ('_ZNK1AIiEcvT_Ev',
+     '_ZNK1AIiEcvT_Ev',
+     '_ZNK1AIiEcvT_Ev'),
+
+    # addr2line abbreviates the standard library's strings and streams.
+    ('_ZNSs4sizeEv',
+     'std::basic_string<char, std::char_traits<char>, std::allocator<char> >'
+     '::size()',
+     'std::string::size()'),
+    ('_Z10ShowBrokenRSoR9CacheFileb',
+     'ShowBroken(std::basic_ostream<char, std::char_traits<char> >&, '
+     'CacheFile&, bool)',
+     'ShowBroken(std::ostream&, CacheFile&, bool)'),
+
+    # Static constructors and destructors.
+    ('_GLOBAL__I__Z1fv.cold',
+     'global constructors keyed to f()',
+     'global constructors keyed to f()'),
+    ('_GLOBAL__D__Z1fv',
+     'global destructors keyed to f()',
+     'global destructors keyed to f()'),
+    ('_GLOBAL__sub_I__Z11sum_squaresi',
+     '_GLOBAL__sub_I__Z11sum_squaresi',
+     '_GLOBAL__sub_I__Z11sum_squaresi'),
+
+    # Rust's legacy mangling.  addr2line leaves off the hash.
+    ('_ZN3std3env4args17h942b0424c0210fc4E',
+     'std::env::args::h942b0424c0210fc4',
+     'std::env::args'),
+    ('_ZN3foo3bar17h0123456789abcdefE.llvm.123',
+     'foo::bar::h0123456789abcdef',
+     'foo::bar'),
+    ('_ZN10a$u20$b$C$3bar17h0123456789abcdefE',
+     'a b,::bar::h0123456789abcdef',
+     'a b,::bar'),
+    ('_ZN10_$LT$a$GT$3bar17h0123456789abcdefE',
+     '<a>::bar::h0123456789abcdef',
+     '<a>::bar'),
+    # Too few different digits for a hash, so this is a C++ name.
+    ('_ZN3foo3bar17h0000000000000000E',
+     'foo::bar::h0000000000000000',
+     'foo::bar::h0000000000000000'),
+    ('_ZN3foo3bar17h01234567E',
+     '_ZN3foo3bar17h01234567E',
+     '_ZN3foo3bar17h01234567E'),
+
+    # Names which aren't mangled, or which are mangled wrongly.
+    ('main',
+     'main',
+     'main'),
+    ('_Zxx',
+     '_Zxx',
+     '_Zxx'),
+]
+
+
+class DemangleTest(unittest.TestCase):
+    def test_cxxfilt(self):
+        for (mangled, name, _) in NAMES:
+            self.assertEqual(demangler.demangle(mangled), name)
+
+    def test_addr2line(self):
+        for (mangled, _, name) in NAMES:
+            self.assertEqual(demangler.demangle(mangled, verbose=False), name)
+
+    def test_length_limit(self):
+        # c++filt gives up on names longer than 1024 characters.
+        prefix = '_ZN' + '3abc' * 253
+        self.assertEqual(len(prefix + '6abcdefEv'), 1024)
+        self.assertEqual(demangler.demangle(prefix + '6abcdefEv'),
+                         'abc::' * 253 + 'abcdef()')
+        self.assertEqual(demangler.demangle(prefix + '7abcdefgEv'),
+                         prefix + '7abcdefgEv')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""Tests for include/elf_symbolizer.py.
+
+We compile a small program, with and without debug information, and check
+that ElfSymbolizer says what addr2line says about every instruction in it.
+These are skipped if g++, objdump or addr2line is missing.  Run them from the
+tools directory with
+
+  python -m unittest discover -p 'test_*.py'
+
+"""
+
+from __future__ import print_function
+
+import os
+import pickle
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import include.elf_symbolizer as elf_symbolizer
+
+# This has templates, static and inline functions, cold clones of functions,
+# C functions, and static constructors, which addr2line and the symbol table
+# name in different ways.
+SOURCE = r'''
+#include <cstdio>
+#include <cstdlib>
+#include <stdexcept>
+#include <string>
+
+namespace ns {
+template <typename T>
+struct Box {
+    T value;
+    __attribute__((noinline)) T get() const { return value; }
+};
+}
+
+static inline int square(int x) { return x * x; }
+
+__attribute__((noinline)) int sum_squares(int n)
+{
+    int s = 0;
+    for (int i = 0; i < n; i++)
+        s += square(i);
+    return s;
+}
+
+__attribute__((noinline)) int checked(int x)
+{
+    if (__builtin_expect(x < 0, 0)) {
+        for (int i = 0; i < x; i++)
+            fprintf(stderr, "negative: %d %d\n", x, i);
+        throw std::runtime_error("negative");
+    }
+    return x + 1;
+}
+
+extern "C" {
+static inline int twice(int x) { return x * 2; }
+__attribute__((noinline)) int c_func(int x) { return twice(x) + 1; }
+}
+
+static std::string greeting = std::string("hello") + " world";
+
+int main(int argc, char **argv)
+{
+    ns::Box<long> box = {argc};
+    return sum_squares(argc) + checked(argc) + c_func(argc) +
+           (int)box.get() + (int)greeting.size();
+}
+'''
+
+
+def have_tools():
+    try:
+        for tool in ('g++', 'objdump', 'addr2line'):
+            subprocess.check_output([tool, '--version'],
+                                    stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return True
+
+
+@unittest.skipUnless(have_tools(), 'needs g++, objdump and addr2line')
+class ElfSymbolizerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        source = os.path.join(cls.dir, 'fixture.cpp')
+        with open(source, 'w') as f:
+            f.write(SOURCE)
+        for (name, flags) in (('fixture', ['-g']), ('nodebug', ['-g0'])):
+            subprocess.check_call(['g++', '-O2'] + flags +
+                                  ['-o', os.path.join(cls.dir, name), source])
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir)
+
+    def addresses(self, path):
+        disassembly = subprocess.check_output(['objdump', '-d', path])
+        return [int(address, 16) for address in
+                re.findall(r'^ *([0-9a-f]+):', disassembly.decode(), re.M)]
+
+    def addr2line(self, path, address):
+        """Return addr2line -f -C -i's (function, location) lines for
+        address.
+
+        addr2line remembers what it has looked up, and its answers can
+        change with what it was asked before, so ask it afresh each time.
+        We don't say which discriminator a line has, so leave those out.
+
+        """
+        output = subprocess.check_output(
+            ['addr2line', '-f', '-C', '-i', '-e', path, '0x%x' % address])
+        lines = output.decode().splitlines()
+        return [(lines[i], re.sub(r' \(discriminator \d+\)$', '', lines[i + 1]))
+                for i in range(0, len(lines), 2)]
+
+    def format(self, frame):
+        """Format a (function, file, line) tuple as addr2line would."""
+        (function, file_name, line) = frame
+        if file_name:
+            location = '%s:%s' % (file_name, line or '?')
+        elif function:
+            location = '??:?'
+        else:
+            location = '??:0'
+        return (function or '??', location)
+
+    def check(self, name):
+        path = os.path.join(self.dir, name)
+        addresses = self.addresses(path)
+        symbolizer = elf_symbolizer.ElfSymbolizer(path)
+        inlines = symbolizer.lookup_inlines(addresses)
+        lookups = symbolizer.lookup(addresses)
+        functions = symbolizer.lookup(addresses, with_lines=False)
+        for (address, frames, lookup, function) in \
+                zip(addresses, inlines, lookups, functions):
+            expected = self.addr2line(path, address)
+            message = '%s at 0x%x' % (name, address)
+            self.assertEqual([self.format(frame) for frame in frames],
+                             expected, message)
+            self.assertEqual(self.format(lookup), expected[0], message)
+            self.assertEqual(lookup, frames[0], message)
+            self.assertEqual(function[1:], (None, 0), message)
+        return (path, symbolizer)
+
+    def test_debug_info(self):
+        self.check('fixture')
+
+    def test_symbols_only(self):
+        (path, symbolizer) = self.check('nodebug')
+        # Without debug information, the symbol table names every function.
+        addresses = self.addresses(path)
+        self.assertEqual(symbolizer.lookup(addresses, with_lines=False),
+                         [(function, None, 0) for (function, _, _) in
+                          symbolizer.lookup(addresses)])
+
+    def test_set_symbols(self):
+        path = os.path.join(self.dir, 'fixture')
+        addresses = self.addresses(path)
+        expected = elf_symbolizer.ElfSymbolizer(path).lookup_inlines(addresses)
+        symbolizer = elf_symbolizer.ElfSymbolizer(path)
+        symbolizer.set_symbols(
+            *elf_symbolizer.ElfSymbolizer(path).symbols())
+        self.assertEqual(symbolizer.lookup_inlines(addresses), expected)
+
+    def test_unit_loader(self):
+        path = os.path.join(self.dir, 'fixture')
+        addresses = self.addresses(path)
+        warm = elf_symbolizer.ElfSymbolizer(path)
+        expected = warm.lookup_inlines(addresses)
+        units = dict((offset, pickle.dumps(warm.unit_data(offset)))
+                     for offset in warm.unit_offsets())
+        self.assertTrue(units)
+        loaded = []
+
+        def loader(offset):
+            loaded.append(offset)
+            return pickle.loads(units[offset])
+        symbolizer = elf_symbolizer.ElfSymbolizer(path)
+        symbolizer.set_symbols(*warm.symbols())
+        symbolizer.set_unit_loader(loader)
+        self.assertEqual(symbolizer.lookup_inlines(addresses), expected)
+        # Each unit is loaded once, and none is decoded from the file.
+        self.assertEqual(sorted(loaded), sorted(units))
+        self.assertFalse(symbolizer._line_tables)
+
+
+if __name__ == '__main__':
+    unittest.main()